@@ -4,9 +4,29 @@ import streamlit as st
 from modules.pdf_viewer import pdf_viewer_dashboard
 from modules.crm import crm_dashboard
 from modules.content_manager import content_manager_dashboard
+from modules.llm_gateway import clear_llm_cache, get_llm_cache_metrics
 
 st.set_page_config(page_title="CRM-GPT", page_icon="🤖", layout="wide")
 
+def show_llm_cache_metrics():
+    """Aciertos de la caché de respuestas de IA y tiempo ahorrado"""
+    with st.sidebar.expander("⚡ Caché de IA", expanded=False):
+        metrics = get_llm_cache_metrics()
+        hits = sum(m['hits'] for m in metrics['sources'])
+        misses = sum(m['misses'] for m in metrics['sources'])
+        saved = sum(m['saved_seconds'] for m in metrics['sources'])
+        st.metric("Aciertos", f"{hits}/{hits + misses}")
+        st.metric("Tiempo ahorrado", f"{saved:.1f} s")
+        for m in metrics['sources']:
+            st.caption(
+                f"{m['source'] or 'otros'}: {m['hit_rate']:.0%} aciertos, "
+                f"{m['saved_seconds']:.1f} s ahorrados (respuesta media {m['avg_miss_seconds']:.1f} s)"
+            )
+        st.caption(f"{metrics['entries']} respuestas guardadas")
+        if st.button("Vaciar caché de IA", key="clear_llm_cache"):
+            clear_llm_cache()
+            st.rerun()
+
 def main():
     st.title("CRM-GPT: Navegación")
 
@@ -23,5 +43,7 @@ def main():
     elif tab == "Content Manager":
         content_manager_dashboard()
 
+    show_llm_cache_metrics()
+
 if __name__ == "__main__":
     main()
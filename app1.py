@@ -19,12 +19,22 @@ JWT_EXPIRATION_HOURS = 24
 # ----------------------
 # Database utilities
 # ----------------------
-DB_PATH = "muyu_crm.db"
-
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-    conn.row_factory = sqlite3.Row
-    return conn
+from db.aggregates import get_pipeline_aggregates
+from db.alerts import create_follow_up_tasks, get_last_alert_run, get_stale_lead_alerts, start_alert_scheduler
+from db.bulk_import import import_institutions
+from db.connection import get_conn
+from db.migrations import apply_migrations
+from db.filter_options import get_filter_options
+from db.search import search_institutions_sql
+from db.task_assignees import resolve_assignee
+from db.query_log import collect_queries
+from dashboards.render_profiler import finish_render_profile, show_render_profile, start_render_profile
+from dashboards.streaming_import import STREAMING_SUGGESTED_BYTES, show_streaming_import
+
+# Estadísticas de las consultas SQL de la sesión (pestaña "Consultas SQL" del admin)
+collect_queries(st.session_state.setdefault('query_stats', {}))
+# Tiempos de render por sección (panel "Perfil de render" del sidebar)
+start_render_profile()
 
 def init_db():
     conn = get_conn()
@@ -130,7 +140,11 @@ def init_db():
     conn.commit()
     conn.close()
 
+    # Índices y cambios de esquema versionados
+    apply_migrations()
+
 init_db()
+start_alert_scheduler()
 
 # ----------------------
 # JWT Authentication Functions  
@@ -514,6 +528,20 @@ def fetch_institutions_df():
     return df
 
 
+def search_institutions_df(q, limit=200):
+    """Buscar instituciones en el índice FTS5 (prefijos, sin acentos) ordenadas por relevancia"""
+    sql, params = search_institutions_sql(q, limit)
+    if sql is None:
+        return pd.DataFrame()
+    conn = get_conn()
+    df = pd.read_sql_query(sql, conn, params=params)
+    for col in ['created_contact', 'last_interaction']:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    conn.close()
+    return df
+
+
 def add_interaction(institution_id, medium, notes, date=None):
     conn = get_conn()
     c = conn.cursor()
@@ -526,11 +554,11 @@ def add_interaction(institution_id, medium, notes, date=None):
     conn.close()
 
 
-def create_task(institution_id, title, due_date, notes=None):
+def create_task(institution_id, title, due_date, notes=None, assignee_username=None, assignee_email=None):
     conn = get_conn()
     c = conn.cursor()
     tid = str(uuid.uuid4())
-    c.execute('INSERT INTO tasks (id,institution_id,title,due_date,done,created_at,notes) VALUES (?,?,?,?,?,?,?)', (tid,institution_id,title,str(due_date),0,str(now_date()), notes))
+    c.execute('INSERT INTO tasks (id,institution_id,title,due_date,done,created_at,notes,assignee_username,assignee_email) VALUES (?,?,?,?,?,?,?,?,?)', (tid,institution_id,title,str(due_date),0,str(now_date()), notes, assignee_username, assignee_email))
     conn.commit()
     conn.close()
 
@@ -694,26 +722,32 @@ st.sidebar.markdown("---")
 
 # Quick filters (stored in session state for dashboard access)
 st.sidebar.header('Filtros rápidos')
-filter_stage = st.sidebar.multiselect('Etapa', options=['En cola','En Proceso','Ganado','No interesado'], default=None)
-filter_medium = st.sidebar.multiselect('Medio contacto', options=['Whatsapp','Correo electrónico','Llamada','Evento','Referido','Reunión virtual','Reunión presencial','Email marketing','Redes Sociales'], default=None)
+
+# Opciones desde la caché de valores distintos (solo se recalcula si cambian los datos)
+try:
+    filter_options = get_filter_options()
+except sqlite3.Error:
+    # In case there's an issue with the database
+    filter_options = {'pais': [], 'ciudad': [], 'stage': [], 'medium': []}
+
+def merge_filter_options(base_options, db_values):
+    """Opciones fijas primero y después cualquier otro valor presente en la base"""
+    return base_options + [value for value in db_values if value not in base_options]
+
+filter_stage = st.sidebar.multiselect('Etapa', options=merge_filter_options(['En cola','En Proceso','Ganado','No interesado'], filter_options['stage']), default=None)
+filter_medium = st.sidebar.multiselect('Medio contacto', options=merge_filter_options(['Whatsapp','Correo electrónico','Llamada','Evento','Referido','Reunión virtual','Reunión presencial','Email marketing','Redes Sociales'], filter_options['medium']), default=None)
 
 # Store filters in session state for dashboard access
 st.session_state.filter_stage = filter_stage
 st.session_state.filter_medium = filter_medium
 
 # Filtros rápidos por país y ciudad
-try:
-    df_all = fetch_institutions_df()
-    filter_pais = st.sidebar.multiselect('País', options=sorted(df_all['pais'].dropna().unique()), default=None)
-    filter_ciudad = st.sidebar.multiselect('Ciudad', options=sorted(df_all['ciudad'].dropna().unique()), default=None)
-    
-    # Store in session state
-    st.session_state.filter_pais = filter_pais
-    st.session_state.filter_ciudad = filter_ciudad
-except:
-    # In case there's an issue with the database
-    st.session_state.filter_pais = []
-    st.session_state.filter_ciudad = []
+filter_pais = st.sidebar.multiselect('País', options=filter_options['pais'], default=None)
+filter_ciudad = st.sidebar.multiselect('Ciudad', options=filter_options['ciudad'], default=None)
+
+# Store in session state
+st.session_state.filter_pais = filter_pais
+st.session_state.filter_ciudad = filter_ciudad
 
 st.sidebar.markdown("---")
 
@@ -722,12 +756,21 @@ user_role = current_user['role']
 if user_role == 'admin':
     # Admin gets access to specialized dashboard
     from dashboards.admin_dashboard import show_admin_dashboard
-    show_admin_dashboard()
+    try:
+        show_admin_dashboard()
+    finally:
+        # También si el dashboard llama a st.rerun(): el perfil de ese rerun se registra igual
+        finish_render_profile()
+    show_render_profile()
     st.stop()  # Don't show the rest of the interface
 elif user_role == 'sales':
     # Sales gets access to specialized sales dashboard
     from dashboards.sales_dashboard import render_sales_dashboard
-    render_sales_dashboard(current_user)
+    try:
+        render_sales_dashboard(current_user)
+    finally:
+        finish_render_profile()
+    show_render_profile(show_panel=False)
     st.stop()  # Don't show the rest of the interface
 else:  # support
     menu_options = ['Dashboard', 'Tareas & Alertas', 'Panel Admin']
@@ -966,7 +1009,15 @@ if menu == 'Registrar institución':
             help="Formatos soportados: CSV, Excel (xlsx, xls)"
         )
         
-        if uploaded_file is not None:
+        streaming_mode = st.checkbox(
+            "⚡ Modo streaming (archivos muy grandes)",
+            value=uploaded_file is not None and uploaded_file.size > STREAMING_SUGGESTED_BYTES,
+            help="Lee, valida e inserta el archivo por bloques sin cargarlo completo en memoria (sin vista previa)"
+        )
+        
+        if uploaded_file is not None and streaming_mode:
+            show_streaming_import(uploaded_file)
+        elif uploaded_file is not None:
             try:
                 # Read the file based on its type
                 if uploaded_file.name.endswith('.csv'):
@@ -1084,82 +1135,23 @@ if menu == 'Registrar institución':
                         
                         if st.button("🚀 Procesar y cargar instituciones", type="primary"):
                             progress_bar = st.progress(0)
-                            success_count = 0
-                            error_count = 0
-                            errors = []
-                            warnings = []
                             
-                            # Process rows with names
+                            # Process rows with names: normalización vectorizada + inserción
+                            # por bloques en una sola transacción
                             valid_df = df_upload.dropna(subset=['name'])
+                            result = import_institutions(
+                                valid_df,
+                                progress_callback=lambda done, total: progress_bar.progress(done / total)
+                            )
+                            progress_bar.progress(1.0)
                             
-                            for index, row in valid_df.iterrows():
-                                try:
-                                    # Create institution dict - only name is truly required
-                                    inst = {
-                                        'id': str(uuid.uuid4()),
-                                        'name': str(row['name']).strip(),
-                                    }
-                                    
-                                    # Add required fields with defaults if missing
-                                    inst['rector_name'] = str(row.get('rector_name', 'Rector Sin Definir')).strip() if pd.notna(row.get('rector_name')) else 'Rector Sin Definir'
-                                    inst['rector_email'] = str(row.get('rector_email', 'rector-sin-email@temp.com')).strip() if pd.notna(row.get('rector_email')) else 'rector-sin-email@temp.com'
-                                    inst['rector_phone'] = str(row.get('rector_phone', '+593 000000000')).strip() if pd.notna(row.get('rector_phone')) else '+593 000000000'
-                                    inst['contraparte_name'] = str(row.get('contraparte_name', 'Contraparte Sin Definir')).strip() if pd.notna(row.get('contraparte_name')) else 'Contraparte Sin Definir'
-                                    inst['contraparte_email'] = str(row.get('contraparte_email', 'contraparte-sin-email@temp.com')).strip() if pd.notna(row.get('contraparte_email')) else 'contraparte-sin-email@temp.com'
-                                    inst['contraparte_phone'] = str(row.get('contraparte_phone', '+593 000000000')).strip() if pd.notna(row.get('contraparte_phone')) else '+593 000000000'
-                                    
-                                    # Track what was filled with defaults
-                                    defaults_used = []
-                                    if inst['rector_name'] == 'Rector Sin Definir':
-                                        defaults_used.append('rector_name')
-                                    if 'sin-email@temp.com' in inst['rector_email']:
-                                        defaults_used.append('rector_email')
-                                    if '000000000' in inst['rector_phone']:
-                                        defaults_used.append('rector_phone')
-                                    if inst['contraparte_name'] == 'Contraparte Sin Definir':
-                                        defaults_used.append('contraparte_name')
-                                    if 'sin-email@temp.com' in inst['contraparte_email']:
-                                        defaults_used.append('contraparte_email')
-                                    if '000000000' in inst['contraparte_phone']:
-                                        defaults_used.append('contraparte_phone')
-                                    
-                                    if defaults_used:
-                                        warnings.append(f"Institución '{inst['name']}': Se usaron valores por defecto para: {', '.join(defaults_used)}")
-                                    
-                                    # Add optional fields with defaults
-                                    inst.update({
-                                        'website': str(row.get('website', '')).strip() if pd.notna(row.get('website')) else '',
-                                        'pais': str(row.get('pais', 'Ecuador')).strip() if pd.notna(row.get('pais')) else 'Ecuador',
-                                        'ciudad': str(row.get('ciudad', '')).strip() if pd.notna(row.get('ciudad')) else '',
-                                        'direccion': str(row.get('direccion', '')).strip() if pd.notna(row.get('direccion')) else '',
-                                        'created_contact': str(now_date()),
-                                        'last_interaction': str(now_date()),
-                                        'num_teachers': int(float(row.get('num_teachers', 0))) if pd.notna(row.get('num_teachers')) and str(row.get('num_teachers')).replace('.','').replace(',','').isdigit() else 0,
-                                        'num_students': int(float(row.get('num_students', 0))) if pd.notna(row.get('num_students')) and str(row.get('num_students')).replace('.','').replace(',','').isdigit() else 0,
-                                        'avg_fee': float(str(row.get('avg_fee', 0)).replace(',', '.')) if pd.notna(row.get('avg_fee')) else 0.0,
-                                        'initial_contact_medium': str(row.get('initial_contact_medium', 'Whatsapp')).strip() if pd.notna(row.get('initial_contact_medium')) else 'Whatsapp',
-                                        'stage': str(row.get('stage', 'En cola')).strip() if pd.notna(row.get('stage')) else 'En cola',
-                                        'substage': str(row.get('substage', 'Primera reunión')).strip() if pd.notna(row.get('substage')) else 'Primera reunión',
-                                        'program_proposed': str(row.get('program_proposed', 'Demo')).strip() if pd.notna(row.get('program_proposed')) else 'Demo',
-                                        'proposal_value': float(str(row.get('proposal_value', 0)).replace(',', '.')) if pd.notna(row.get('proposal_value')) else 0.0,
-                                        'contract_start_date': str(row.get('contract_start_date')) if pd.notna(row.get('contract_start_date')) else None,
-                                        'contract_end_date': str(row.get('contract_end_date')) if pd.notna(row.get('contract_end_date')) else None,
-                                        'observations': str(row.get('observations', '')).strip() if pd.notna(row.get('observations')) else '',
-                                        'assigned_commercial': str(row.get('assigned_commercial', '')).strip() if pd.notna(row.get('assigned_commercial')) else '',
-                                        'no_interest_reason': None
-                                    })
-                                    
-                                    # Save institution
-                                    save_institution(inst)
-                                    success_count += 1
-                                    
-                                except Exception as e:
-                                    error_count += 1
-                                    errors.append(f"Fila {index + 2}: {str(e)}")
-                                
-                                # Update progress
-                                progress = (index + 1) / len(valid_df)
-                                progress_bar.progress(progress)
+                            success_count = result['inserted']
+                            error_count = len(result['errors'])
+                            errors = [f"Fila {row_number}: {message}" for row_number, message in result['errors']]
+                            warnings = [
+                                f"Institución '{name}': Se usaron valores por defecto para: {', '.join(columns)}"
+                                for _, name, columns in result['defaults_used']
+                            ]
                             
 
                             # Show results
@@ -1374,9 +1366,12 @@ if menu == 'Panel Admin':
                         responsable_email = st.text_input('Email responsable', key=f'task_responsable_email_{row["id"]}')
                         responsable_whatsapp = st.text_input('Whatsapp responsable', key=f'task_responsable_whatsapp_{row["id"]}')
                         if st.button('Crear tarea', key=f'create_task_{row["id"]}'):
-                            # Combina los datos en notes para almacenarlos
-                            full_notes = f"{notes}\nResponsable: {responsable}\nEmail: {responsable_email}\nWhatsapp: {responsable_whatsapp}"
-                            create_task(row['id'], title, due_date, full_notes)
+                            # El responsable va en sus columnas; el Whatsapp se conserva en las notas
+                            full_notes = f"{notes}\nWhatsapp: {responsable_whatsapp}" if responsable_whatsapp else notes
+                            assignee_username, assignee_email = resolve_assignee(responsable.strip(), responsable_email.strip())
+                            create_task(row['id'], title, due_date, full_notes,
+                                        assignee_username=assignee_username or responsable.strip() or None,
+                                        assignee_email=assignee_email)
                             st.success('Tarea creada correctamente')
                             st.rerun()
     else:
@@ -1393,19 +1388,13 @@ if menu == 'Buscar / Editar':
         st.stop()
     
     st.header('Buscar o editar instituciones')
-    q = st.text_input('Buscar por nombre, rector o email')
-    df = fetch_institutions_df()
+    q = st.text_input('Buscar por nombre, contacto, email, ciudad u observaciones')
+    # Con texto de búsqueda se consulta el índice FTS5 en lugar de cargar toda la tabla
+    df = search_institutions_df(q) if q else fetch_institutions_df()
+    if q and df.empty:
+        st.info(f'No se encontraron instituciones para "{q}"')
     if not df.empty:
-        if q:
-            # Updated search mask to include new contact fields
-            mask = (df['name'].str.contains(q, case=False, na=False) | 
-                   df['rector_name'].str.contains(q, case=False, na=False) | 
-                   df['rector_email'].str.contains(q, case=False, na=False) | 
-                   df['contraparte_name'].str.contains(q, case=False, na=False) | 
-                   df['contraparte_email'].str.contains(q, case=False, na=False))
-            results = df[mask]
-        else:
-            results = df
+        results = df
         
         # Display all columns in the dataframe
         st.dataframe(results, use_container_width=True)
@@ -1553,15 +1542,16 @@ if menu == 'Buscar / Editar':
 # ----------------------
 if menu == 'Dashboard':
     st.header('Dashboard — Métricas clave')
-    df = fetch_institutions_df()
-    if df.empty:
+    # Métricas desde los agregados materializados (O(grupos), sin cargar institutions)
+    stage_rows = get_pipeline_aggregates(group_by=('stage',))
+    if not stage_rows:
         st.info('No hay datos para mostrar')
     else:
-        total = len(df)
+        total = sum(row['lead_count'] for row in stage_rows)
         col1, col2, col3, col4 = st.columns(4)
         col1.metric('Total de leads', total)
         # % por etapa
-        stage_counts = df['stage'].value_counts().reindex(['En cola','En Proceso','Ganado','No interesado']).fillna(0)
+        stage_counts = {row['stage']: row['lead_count'] for row in stage_rows}
         col2.metric('En cola', int(stage_counts.get('En cola',0)))
         col3.metric('En proceso', int(stage_counts.get('En Proceso',0)))
         col4.metric('Ganados', int(stage_counts.get('Ganado',0)))
@@ -1573,26 +1563,26 @@ if menu == 'Dashboard':
         st.write('Tasa conversión (En cola → Ganado):', f"{conv:.1f}%" if conv is not None else 'N/A')
 
         # Medio de contacto mas efectivo
-        med_counts = df['initial_contact_medium'].value_counts()
-        if not med_counts.empty:
-            med_df = med_counts.reset_index()
-            med_df.columns = ['medium','count']
+        med_df = pd.DataFrame(
+            [(row['medium'], row['lead_count']) for row in get_pipeline_aggregates(group_by=('medium',)) if row['medium']],
+            columns=['medium','count']
+        ).sort_values('count', ascending=False)
+        if not med_df.empty:
             chart = alt.Chart(med_df).mark_bar().encode(x='medium', y='count')
             st.altair_chart(chart, use_container_width=True)
 
         # Tiempo promedio en cada etapa (approx using last_interaction - created_contact)
-        df2 = df.copy()
-        df2['created_contact'] = pd.to_datetime(df2['created_contact'], errors='coerce')
-        df2['last_interaction'] = pd.to_datetime(df2['last_interaction'], errors='coerce')
-        df2['days_in_pipeline'] = (df2['last_interaction'] - df2['created_contact']).dt.days
-        avg_days_by_stage = df2.groupby('stage')['days_in_pipeline'].mean().reset_index()
+        avg_days_by_stage = pd.DataFrame(
+            [(row['stage'], row['avg_pipeline_days']) for row in stage_rows
+             if row['stage'] and row['avg_pipeline_days'] is not None],
+            columns=['stage','days_in_pipeline']
+        )
         if not avg_days_by_stage.empty:
             chart2 = alt.Chart(avg_days_by_stage).mark_bar().encode(x='stage', y='days_in_pipeline')
             st.altair_chart(chart2, use_container_width=True)
 
         # Valor potencial acumulado (approx num_teachers * avg_fee)
-        df['potential_value'] = df['num_teachers'].fillna(0) * df['avg_fee'].fillna(0)
-        total_potential = df['potential_value'].sum()
+        total_potential = sum(row['potential_value'] for row in stage_rows)
         st.metric('Valor potencial acumulado (estimado)', f"{total_potential:,.2f}")
 
 # ----------------------
@@ -1664,29 +1654,18 @@ if menu == 'Tareas & Alertas':
         # Si prefieres mostrar también el dataframe:
         # st.dataframe(tasks)
 
-    # Alerts: leads without contact > 7 días
-    df = fetch_institutions_df()
-    if not df.empty:
-        df['last_interaction'] = pd.to_datetime(df['last_interaction'], errors='coerce')
-        # Convert last_interaction to naive datetime (remove timezone) for comparison
-        if pd.api.types.is_datetime64_any_dtype(df['last_interaction']):
-            df['last_interaction'] = df['last_interaction'].dt.tz_localize(None)
-        stale = df[df['last_interaction'] < (pd.Timestamp.now().tz_localize(None) - pd.Timedelta(days=7))]
-        if not stale.empty:
-            st.warning('Leads sin contacto > 7 días:')
-            for i,row in stale.iterrows():
-                st.write(f"{row['name']} — Última interacción: {row['last_interaction'].date() if not pd.isna(row['last_interaction']) else 'N/A'} — Responsable: {row.get('assigned_commercial')}")
-                if st.button(f'Marcar tarea de seguimiento ({row["id"]})'):
-                    create_task(row['id'], 'Seguimiento - Lead sin contacto >7d', pd.Timestamp.now().date() + timedelta(days=1), notes='Generado desde alerta')
-                    st.success('Tarea creada')
-                    st.rerun()
-        stale = df[df['last_interaction'] < (pd.Timestamp.now() - pd.Timedelta(days=7))]
-        if not stale.empty:
-            st.warning('Leads sin contacto > 7 días:')
-            for i,row in stale.iterrows():
-                st.write(f"{row['name']} — Última interacción: {row['last_interaction'].date() if not pd.isna(row['last_interaction']) else 'N/A'} — Responsable: {row.get('assigned_commercial')}")
-                if st.button(f'Marcar tarea de seguimiento ({row["id"]})'):
-                    create_task(row['id'], 'Seguimiento - Lead sin contacto >7d', pd.Timestamp.now().date() + timedelta(days=1), notes='Generado desde alerta')
-                    st.success('Tarea creada')
-                    st.rerun()
-
+    # Alerts: leads sin contacto, precalculadas por el job de alertas (db/alerts.py)
+    stale_alerts = get_stale_lead_alerts(limit=200)
+    if stale_alerts:
+        st.warning(f'Leads sin contacto (actualizado: {get_last_alert_run() or "N/A"}):')
+        for alert in stale_alerts:
+            st.write(f"{alert['institution_name']} — Última interacción: {str(alert['last_interaction'])[:10]} ({alert['days_since_contact']} días) — Responsable: {alert['assigned_commercial']}")
+        # Cualquier usuario que llega a esta página (soporte) puede crear los seguimientos
+        if st.button('Crear tareas de seguimiento pendientes'):
+            created = create_follow_up_tasks()
+            st.success(f'{created} tareas creadas')
+            st.rerun()
+
+
+# Registrar el perfil de render de las demás páginas
+show_render_profile(show_panel=False)
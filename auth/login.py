@@ -1,16 +1,8 @@
 import streamlit as st
-import sqlite3
 import uuid
 from datetime import date
 from auth.jwt_manager import JWTManager
-
-DB_PATH = "muyu_crm.db"
-
-def get_conn():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-    conn.row_factory = sqlite3.Row
-    return conn
+from db.connection import get_conn
 
 def init_auth_db():
     """Initialize authentication tables"""
@@ -4,24 +4,36 @@ Incluye todas las funcionalidades del CRM para administradores
 """
 
 import streamlit as st
-import sqlite3
 from datetime import datetime, timedelta, date
 import pandas as pd
 import altair as alt
 import uuid
 import io
-import zipfile
+import os
+import tempfile
 from pytz import timezone
 import urllib.parse
-import smtplib
-import email.mime.text
-import email.mime.multipart
 
 
 # ----------------------
 # Database utilities
 # ----------------------
-DB_PATH = "muyu_crm.db"
+from db.aggregates import get_pipeline_aggregates
+from db.alerts import (create_follow_up_tasks, get_last_alert_run, get_stale_alert_summary,
+                       get_stale_lead_alerts, get_stale_thresholds, refresh_stale_lead_alerts,
+                       set_stale_threshold, start_alert_scheduler)
+from db.backup import (BACKUP_TABLES, create_binary_backup, get_backup_watermark,
+                       record_backup_watermark, write_leads_backup_zip)
+from db.bulk_import import import_institutions
+from db.connection import get_conn
+from db.data_version import get_data_version
+from db.email_outbox import (enqueue_email, get_outbox_counts, register_smtp_account,
+                             retry_failed_emails, start_email_worker)
+from db.filter_options import get_filter_options
+from db.query_log import SLOW_QUERY_MS, get_slow_queries, top_queries
+from db.search import search_institutions_sql
+from dashboards.render_profiler import profile_section, profile_step
+from dashboards.streaming_import import STREAMING_SUGGESTED_BYTES, show_streaming_import
 
 # Crear tabla de alertas si no existe
 def ensure_admin_alerts_table():
@@ -50,13 +62,20 @@ def ensure_admin_alerts_table():
 # ----------------------
 ADMIN_EMAIL = st.secrets["ADMIN_EMAIL"]  # Se obtiene de .streamlit/secrets.toml
 ADMIN_APP_PASSWORD = st.secrets["ADMIN_APP_PASSWORD"]  # Se obtiene de .streamlit/secrets.toml
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-    conn.row_factory = sqlite3.Row
-    return conn
 
 ensure_admin_alerts_table()
 
+# Los emails se encolan y los envía un worker en segundo plano con una sesión SMTP reutilizada
+# (SMTP_HOST/SMTP_PORT/SMTP_STARTTLS permiten apuntar a un servidor local de pruebas)
+register_smtp_account(
+    'admin', ADMIN_EMAIL, ADMIN_APP_PASSWORD,
+    host=st.secrets.get("SMTP_HOST", "smtp.gmail.com"),
+    port=st.secrets.get("SMTP_PORT", 587),
+    starttls=st.secrets.get("SMTP_STARTTLS", True)
+)
+start_email_worker()
+start_alert_scheduler()
+
 # ----------------------
 # Helpers
 # ----------------------
@@ -204,6 +223,20 @@ def fetch_institutions_df(columns=None, where_clause=None, limit=None):
     conn.close()
     return df
 
+def search_institutions_df(q, limit=200):
+    """Busca instituciones en el índice FTS5 (prefijos, sin acentos) ordenadas por relevancia"""
+    sql, params = search_institutions_sql(q, limit)
+    if sql is None:
+        return pd.DataFrame()
+    
+    conn = get_conn()
+    df = pd.read_sql_query(sql, conn, params=params)
+    for col in ['created_contact', 'last_interaction']:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    conn.close()
+    return df
+
 def add_interaction(institution_id, medium, notes, date=None):
     conn = get_conn()
     c = conn.cursor()
@@ -219,25 +252,15 @@ def add_interaction(institution_id, medium, notes, date=None):
 
 def get_institutions_metrics():
     """Get basic metrics without loading full dataset"""
-    conn = get_conn()
-    c = conn.cursor()
-    
-    # Count by stage
-    c.execute('SELECT stage, COUNT(*) as count FROM institutions GROUP BY stage')
-    stage_counts = dict(c.fetchall())
-    
-    # Total count
-    c.execute('SELECT COUNT(*) as total FROM institutions')
-    total = c.fetchone()[0]
-    
-    # Get unique values for filters without loading full data
-    c.execute('SELECT DISTINCT pais FROM institutions WHERE pais IS NOT NULL ORDER BY pais')
-    paises = [row[0] for row in c.fetchall()]
+    # Count by stage from the materialized pipeline aggregates
+    stage_rows = get_pipeline_aggregates(group_by=('stage',))
+    stage_counts = {row['stage']: row['lead_count'] for row in stage_rows}
+    total = sum(stage_counts.values())
     
-    c.execute('SELECT DISTINCT ciudad FROM institutions WHERE ciudad IS NOT NULL ORDER BY ciudad')
-    ciudades = [row[0] for row in c.fetchall()]
-    
-    conn.close()
+    # Get unique values for filters from the invalidation-aware cache
+    filter_options = get_filter_options()
+    paises = filter_options['pais']
+    ciudades = filter_options['ciudad']
     
     return {
         'total': total,
@@ -300,17 +323,16 @@ def get_sales_support_users():
     return user_options, user_data
 
 def send_task_email(task_data, responsable_info):
-    """Enviar tarea por email al responsable usando SMTP directo"""
+    """Encolar el email de la tarea para el responsable (lo envía el worker de la cola)"""
     try:
         # Validar configuración
         if ADMIN_EMAIL == "tu_email@gmail.com" or ADMIN_APP_PASSWORD == "tu_contraseña_app":
             return False, "⚠️ Configura primero ADMIN_EMAIL y ADMIN_APP_PASSWORD en el código"
         
-        # Configurar el mensaje
-        msg = email.mime.multipart.MIMEMultipart()
-        msg['From'] = ADMIN_EMAIL
-        msg['To'] = responsable_info.get('email', '')
-        msg['Subject'] = f"Nueva Tarea Asignada: {task_data['title']}"
+        recipient = responsable_info.get('email', '')
+        if not recipient:
+            return False, "❌ El responsable no tiene email registrado"
+        subject = f"Nueva Tarea Asignada: {task_data['title']}"
         
         # Crear el cuerpo del email con formato HTML
         html_body = f"""
@@ -350,27 +372,11 @@ def send_task_email(task_data, responsable_info):
         </html>
         """
         
-        # Adjuntar el cuerpo HTML
-        msg.attach(email.mime.text.MIMEText(html_body, 'html', 'utf-8'))
-        
-        # Conectar y enviar
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(ADMIN_EMAIL, ADMIN_APP_PASSWORD)
-        
-        # Enviar el mensaje
-        text = msg.as_string()
-        server.sendmail(ADMIN_EMAIL, responsable_info.get('email', ''), text)
-        server.quit()
+        enqueue_email(recipient, subject, html_body, account='admin')
+        return True, "📬 Email en cola de envío"
         
-        return True, "✅ Email enviado correctamente"
-        
-    except smtplib.SMTPAuthenticationError:
-        return False, "❌ Error de autenticación. Verifica el email y contraseña de aplicación"
-    except smtplib.SMTPException as e:
-        return False, f"❌ Error SMTP: {str(e)}"
     except Exception as e:
-        return False, f"❌ Error al enviar email: {str(e)}"
+        return False, f"❌ Error al encolar email: {str(e)}"
 
 def send_task_whatsapp(task_data, responsable_info):
     """Crear mensaje de WhatsApp para enviar tarea al responsable"""
@@ -420,30 +426,21 @@ _Mensaje enviado por Admin CRM Muyu_
     except Exception as e:
         return False, f"Error al generar WhatsApp: {str(e)}"
 
-def extract_responsable_info_from_notes(notes):
-    """Extraer información del responsable de las notas de la tarea"""
-    if not notes:
+def get_task_assignee_info(assignee_username, assignee_email=None):
+    """Datos del responsable de una tarea (nombre y rol desde la tabla users)"""
+    if not assignee_username and not assignee_email:
         return {}
     
-    info = {}
-    lines = str(notes).split('\n')
-    
-    for line in lines:
-        if line.startswith('Responsable:') and '(' in line and ')' in line:
-            # Extraer nombre y username: "Responsable: Juan Pérez (jperez)"
-            responsable_part = line.replace('Responsable:', '').strip()
-            if '(' in responsable_part:
-                full_name = responsable_part.split('(')[0].strip()
-                username = responsable_part.split('(')[1].replace(')', '').strip()
-                info['full_name'] = full_name
-                info['username'] = username
-        elif line.startswith('Email:'):
-            info['email'] = line.replace('Email:', '').strip()
-        elif line.startswith('Rol:'):
-            info['role'] = line.replace('Rol:', '').strip()
-        elif line.startswith('WhatsApp:'):
-            info['whatsapp'] = line.replace('WhatsApp:', '').strip()
-    
+    info = {'username': assignee_username or '', 'email': assignee_email or ''}
+    if assignee_username:
+        conn = get_conn()
+        user = conn.execute('SELECT full_name, email, role FROM users WHERE username = ?', (assignee_username,)).fetchone()
+        conn.close()
+        if user:
+            info['full_name'] = user[0] or assignee_username
+            info['email'] = info['email'] or user[1] or ''
+            info['role'] = (user[2] or '').title()
+    info.setdefault('full_name', assignee_username or assignee_email)
     return info
 
 # ----------------------
@@ -470,14 +467,15 @@ def show_admin_dashboard():
             st.rerun()
     
     # Crear tabs para organizar funcionalidades
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs([
         "🏢 Panel Admin", 
         "➕ Registrar Institución", 
         "🔍 Buscar/Editar", 
         "📊 Dashboard", 
         "📋 Tareas & Alertas",
         "👥 Gestión Usuarios",
-        "🧹 Limpiar Leads"
+        "🧹 Limpiar Leads",
+        "⏱️ Consultas SQL"
     ])
     
     # Obtener filtros del sidebar
@@ -486,26 +484,130 @@ def show_admin_dashboard():
     filter_pais = st.session_state.get('filter_pais', [])
     filter_ciudad = st.session_state.get('filter_ciudad', [])
     
-    with tab1:
+    # Streamlit ejecuta todas las pestañas en cada rerun: cada una se mide como una sección
+    with tab1, profile_section('Panel Admin'):
         show_panel_admin(filter_stage, filter_medium, filter_pais, filter_ciudad)
     
-    with tab2:
+    with tab2, profile_section('Registrar Institución'):
         show_registrar_institucion()
     
-    with tab3:
+    with tab3, profile_section('Buscar/Editar'):
         show_buscar_editar()
     
-    with tab4:
+    with tab4, profile_section('Dashboard'):
         show_dashboard_metrics()
     
-    with tab5:
+    with tab5, profile_section('Tareas & Alertas'):
         show_tareas_alertas()
     
-    with tab6:
+    with tab6, profile_section('Gestión Usuarios'):
         show_gestion_usuarios()
     
-    with tab7:
+    with tab7, profile_section('Limpiar Leads'):
         show_clean_leads()
+    
+    # Última pestaña: así incluye las consultas de las demás pestañas de este rerun
+    with tab8, profile_section('Consultas SQL'):
+        show_query_stats()
+
+# Etapas del Kanban en orden de visualización
+KANBAN_STAGES = ['En cola', 'En Proceso', 'Ganado', 'No interesado']
+KANBAN_DATE_COLUMNS = ['last_interaction', 'created_contact', 'contract_start_date', 'contract_end_date']
+
+def build_institution_filters(filter_stage, filter_medium, filter_pais, filter_ciudad):
+    """Construye condiciones WHERE parametrizadas a partir de los filtros del sidebar"""
+    conditions = []
+    params = []
+    for column, values in (('stage', filter_stage), ('initial_contact_medium', filter_medium),
+                           ('pais', filter_pais), ('ciudad', filter_ciudad)):
+        if values:
+            conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+    return conditions, params
+
+def convert_kanban_dates(df):
+    """Convierte las columnas de fecha del Kanban de forma segura"""
+    if not df.empty:
+        for col in KANBAN_DATE_COLUMNS:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
+def fetch_stage_page(stage, limit, cursor=None, conditions=None, params=None):
+    """Obtiene una página de una etapa con keyset pagination sobre (last_interaction, id).
+
+    El orden es last_interaction DESC, id DESC, con las instituciones sin
+    last_interaction al final. `cursor` es la tupla (last_interaction, id) de
+    la última fila de la página anterior; así cada página es una búsqueda en
+    idx_institutions_stage_last_interaction en lugar de un OFFSET que recorre
+    todas las filas previas.
+
+    Returns:
+        (DataFrame, next_cursor) donde next_cursor es None si no hay más filas.
+    """
+    # Fechas como texto: el cursor debe compararse con el valor crudo guardado
+    conn = get_conn(parse_types=False)
+    base_conditions = ['stage = ?'] + list(conditions or [])
+    base_params = [stage] + list(params or [])
+    fetch_limit = limit + 1  # Una fila extra para saber si hay página siguiente
+    frames = []
+    
+    # Tramo 1: instituciones con last_interaction
+    if cursor is None or cursor[0] is not None:
+        query_conditions = base_conditions + ['last_interaction IS NOT NULL']
+        query_params = list(base_params)
+        if cursor is not None:
+            query_conditions += ['last_interaction <= ?', '(last_interaction < ? OR id < ?)']
+            query_params += [cursor[0], cursor[0], cursor[1]]
+        query = (f"SELECT * FROM institutions WHERE {' AND '.join(query_conditions)} "
+                 "ORDER BY last_interaction DESC, id DESC LIMIT ?")
+        frames.append(pd.read_sql_query(query, conn, params=query_params + [fetch_limit]))
+        fetch_limit -= len(frames[-1])
+    
+    # Tramo 2: instituciones sin last_interaction
+    if fetch_limit > 0:
+        query_conditions = base_conditions + ['last_interaction IS NULL']
+        query_params = list(base_params)
+        if cursor is not None and cursor[0] is None:
+            query_conditions.append('id < ?')
+            query_params.append(cursor[1])
+        query = (f"SELECT * FROM institutions WHERE {' AND '.join(query_conditions)} "
+                 "ORDER BY id DESC LIMIT ?")
+        frames.append(pd.read_sql_query(query, conn, params=query_params + [fetch_limit]))
+    
+    conn.close()
+    
+    page_df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    next_cursor = None
+    if len(page_df) > limit:
+        page_df = page_df.head(limit)
+        last_row = page_df.iloc[-1]
+        last_value = last_row['last_interaction']
+        next_cursor = (None if pd.isna(last_value) else last_value, last_row['id'])
+    return page_df, next_cursor
+
+def reset_kanban_pagination(stage=None):
+    """Vuelve a la primera página y descarta cursores y tramos cargados (de una etapa o de todas)"""
+    if 'current_page' not in st.session_state:
+        st.session_state.current_page = {}
+    for state_key in ('kanban_cursors', 'kanban_next_cursor', 'kanban_slices'):
+        if state_key not in st.session_state:
+            st.session_state[state_key] = {}
+    
+    for stage_name in ([stage] if stage else KANBAN_STAGES):
+        st.session_state.current_page[stage_name] = 1
+        st.session_state.kanban_cursors[stage_name] = [None]  # Pila de cursores de inicio de página
+        st.session_state.kanban_next_cursor[stage_name] = None
+        st.session_state.kanban_slices[stage_name] = []  # Tramos ya cargados en modo incremental
+
+def advance_kanban_page(stage, pagination_mode):
+    """Avanza una página/nivel en una etapa si quedan instituciones por mostrar"""
+    next_cursor = st.session_state.kanban_next_cursor.get(stage)
+    if next_cursor is None:
+        return
+    if pagination_mode == "paginas":
+        st.session_state.kanban_cursors[stage].append(next_cursor)
+    st.session_state.current_page[stage] += 1
 
 def show_panel_admin(filter_stage, filter_medium, filter_pais, filter_ciudad):
     """Panel Admin - Kanban board con ciclo de vida de leads con carga lazy"""
@@ -535,30 +637,18 @@ def show_panel_admin(filter_stage, filter_medium, filter_pais, filter_ciudad):
             st.rerun()
         return
     
-    # Build optimized WHERE clause based on filters
-    where_conditions = []
-    if filter_stage:
-        stage_list = "','".join(filter_stage)
-        where_conditions.append(f"stage IN ('{stage_list}')")
-    if filter_medium:
-        medium_list = "','".join(filter_medium)
-        where_conditions.append(f"initial_contact_medium IN ('{medium_list}')")
-    if filter_pais:
-        pais_list = "','".join(filter_pais)
-        where_conditions.append(f"pais IN ('{pais_list}')")
-    if filter_ciudad:
-        ciudad_list = "','".join(filter_ciudad)
-        where_conditions.append(f"ciudad IN ('{ciudad_list}')")
-    
-    where_clause = " AND ".join(where_conditions) if where_conditions else None
+    # Filtros del sidebar como condiciones parametrizadas
+    filter_conditions, filter_params = build_institution_filters(filter_stage, filter_medium, filter_pais, filter_ciudad)
+    where_clause = " AND ".join(filter_conditions) if filter_conditions else None
     
     # Configuración avanzada de paginación
     if 'items_per_stage' not in st.session_state:
         st.session_state.items_per_stage = 10  # Aumentar default a 10
     if 'current_page' not in st.session_state:
-        st.session_state.current_page = {stage: 1 for stage in ['En cola','En Proceso','Ganado','No interesado']}
+        reset_kanban_pagination()
     if 'pagination_mode' not in st.session_state:
         st.session_state.pagination_mode = 'paginas'  # 'paginas' o 'incremental'
+    items_per_stage = st.session_state.items_per_stage
     
     # Controles de paginación y configuración
     with st.expander('⚙️ Configuración de Vista', expanded=False):
@@ -595,8 +685,8 @@ def show_panel_admin(filter_stage, filter_medium, filter_pais, filter_ciudad):
         
         with col3:
             if st.button("🔄 Actualizar"):
-                # Reset páginas al actualizar
-                st.session_state.current_page = {stage: 1 for stage in ['En cola','En Proceso','Ganado','No interesado']}
+                # Reset páginas y cursores al actualizar
+                reset_kanban_pagination()
                 st.rerun()
         
         with col4:
@@ -604,83 +694,93 @@ def show_panel_admin(filter_stage, filter_medium, filter_pais, filter_ciudad):
                 st.session_state.show_summary_only = not st.session_state.get('show_summary_only', False)
                 st.rerun()
     
+    # Si cambian filtros, modo o tamaño de página los cursores guardados ya no valen
+    kanban_signature = (pagination_mode, items_per_stage, tuple(filter_conditions), tuple(filter_params))
+    if st.session_state.get('kanban_signature') != kanban_signature:
+        reset_kanban_pagination()
+        st.session_state.kanban_signature = kanban_signature
+    
+    # Si cambian los datos (también por otros usuarios) se vuelven a pedir los
+    # tramos del modo incremental desde el principio; los cursores de página siguen siendo válidos
+    data_version = get_data_version('institutions')
+    if st.session_state.get('kanban_data_version') != data_version:
+        for stage in KANBAN_STAGES:
+            st.session_state.kanban_slices[stage] = []
+            st.session_state.kanban_next_cursor[stage] = None
+        st.session_state.kanban_data_version = data_version
+    
     # Fetch only necessary data with filters applied at database level
+    profile_step('Consulta')
     with st.spinner('⏳ Cargando vista optimizada...'):
         # Primero obtener conteos para cada etapa
-        conn = get_conn()
-        count_query = "SELECT stage, COUNT(*) as count FROM institutions"
-        if where_clause:
-            count_query += f" WHERE {where_clause}"
-        count_query += " GROUP BY stage"
-        
-        stage_counts = pd.read_sql_query(count_query, conn)
-        conn.close()
+        if not filter_ciudad:
+            # Desde los agregados materializados (ciudad no forma parte de su clave)
+            stage_rows = get_pipeline_aggregates(
+                group_by=('stage',),
+                filters={'stage': filter_stage, 'medium': filter_medium, 'pais': filter_pais}
+            )
+            stage_counts = pd.DataFrame(
+                [(row['stage'], row['lead_count']) for row in stage_rows], columns=['stage', 'count']
+            )
+        else:
+            conn = get_conn()
+            count_query = "SELECT stage, COUNT(*) as count FROM institutions"
+            if where_clause:
+                count_query += f" WHERE {where_clause}"
+            count_query += " GROUP BY stage"
+            
+            stage_counts = pd.read_sql_query(count_query, conn, params=filter_params)
+            conn.close()
         
         # Solo cargar datos detallados si no está en modo resumen
         if not st.session_state.get('show_summary_only', False):
-            conn = get_conn()
-            
             if pagination_mode == "todo":
                 # Cargar todas las instituciones (sin límite)
+                conn = get_conn()
                 query = "SELECT * FROM institutions"
                 if where_clause:
                     query += f" WHERE {where_clause}"
                 query += " ORDER BY stage, last_interaction DESC"
-                df = pd.read_sql_query(query, conn)
-                # Convertir fechas de forma segura
-                if not df.empty:
-                    for col in ['last_interaction', 'created_contact', 'contract_start_date', 'contract_end_date']:
-                        if col in df.columns:
-                            df[col] = pd.to_datetime(df[col], errors='coerce')
+                df = convert_kanban_dates(pd.read_sql_query(query, conn, params=filter_params))
+                conn.close()
             
             elif pagination_mode == "incremental":
-                # Para modo incremental, cargar más datos de los necesarios para todas las páginas actuales
-                max_page = max(st.session_state.current_page.values())
-                total_limit = items_per_stage * 4 * max_page  # Suficiente para todas las etapas y páginas
+                # Para modo incremental, conservar los tramos ya cargados y
+                # pedir a la base solo el siguiente tramo desde el último cursor
+                all_dfs = []
+                for stage in KANBAN_STAGES:
+                    slices = st.session_state.kanban_slices[stage]
+                    while len(slices) < st.session_state.current_page[stage]:
+                        cursor = st.session_state.kanban_next_cursor[stage]
+                        if slices and cursor is None:
+                            break  # No quedan más instituciones en esta etapa
+                        slice_df, next_cursor = fetch_stage_page(stage, items_per_stage, cursor, filter_conditions, filter_params)
+                        slices.append(convert_kanban_dates(slice_df))
+                        st.session_state.kanban_next_cursor[stage] = next_cursor
+                        if next_cursor is None:
+                            break
+                    all_dfs.extend(slices)
                 
-                query = "SELECT * FROM institutions"
-                if where_clause:
-                    query += f" WHERE {where_clause}"
-                query += f" ORDER BY stage, last_interaction DESC LIMIT {total_limit}"
-                df = pd.read_sql_query(query, conn)
-                # Convertir fechas de forma segura
-                if not df.empty:
-                    for col in ['last_interaction', 'created_contact', 'contract_start_date', 'contract_end_date']:
-                        if col in df.columns:
-                            df[col] = pd.to_datetime(df[col], errors='coerce')
+                df = pd.concat(all_dfs, ignore_index=True) if all_dfs else pd.DataFrame()
             
             else:  # modo "paginas"
-                # Para modo páginas, cargar datos por etapa con OFFSET
+                # Para modo páginas, cargar cada etapa desde su cursor (keyset pagination)
                 all_dfs = []
-                for stage in ['En cola','En Proceso','Ganado','No interesado']:
-                    page = st.session_state.current_page[stage]
-                    offset = (page - 1) * items_per_stage
-                    
-                    stage_query = "SELECT * FROM institutions WHERE stage = ?"
-                    params = [stage]
-                    
-                    if where_clause:
-                        stage_query += f" AND ({where_clause})"
-                    
-                    stage_query += f" ORDER BY last_interaction DESC LIMIT {items_per_stage} OFFSET {offset}"
-                    stage_df = pd.read_sql_query(stage_query, conn, params=params)
-                    # Convertir fechas de forma segura
-                    if not stage_df.empty:
-                        for col in ['last_interaction', 'created_contact', 'contract_start_date', 'contract_end_date']:
-                            if col in stage_df.columns:
-                                stage_df[col] = pd.to_datetime(stage_df[col], errors='coerce')
-                    all_dfs.append(stage_df)
+                for stage in KANBAN_STAGES:
+                    cursor = st.session_state.kanban_cursors[stage][-1]
+                    stage_df, next_cursor = fetch_stage_page(stage, items_per_stage, cursor, filter_conditions, filter_params)
+                    st.session_state.kanban_next_cursor[stage] = next_cursor
+                    all_dfs.append(convert_kanban_dates(stage_df))
                 
                 df = pd.concat(all_dfs, ignore_index=True) if all_dfs else pd.DataFrame()
-            
-            conn.close()
         else:
             df = pd.DataFrame()  # DataFrame vacío para modo resumen
     
     # Mostrar resumen de conteos por etapa
+    profile_step('Resumen')
     with st.expander("📊 Resumen por Etapas"):
         cols = st.columns([1,1,1,1])
-        stages = ['En cola','En Proceso','Ganado','No interesado']
+        stages = KANBAN_STAGES
         
         for col, stage_name in zip(cols, stages):
             with col:
@@ -688,6 +788,7 @@ def show_panel_admin(filter_stage, filter_medium, filter_pais, filter_ciudad):
                 st.metric(stage_name, count)
     
     # Solo mostrar detalles si no está en modo resumen y hay datos
+    profile_step('Kanban')
     if not st.session_state.get('show_summary_only', False) and not df.empty:
         st.markdown("---")
         st.subheader("🏢 Vista Detallada por Etapas")
@@ -775,20 +876,20 @@ def show_panel_admin(filter_stage, filter_medium, filter_pais, filter_ciudad):
         
         with col1:
             if st.button("⏮️ Todas a página 1", help="Resetear todas las etapas a la primera página"):
-                st.session_state.current_page = {stage: 1 for stage in ['En cola','En Proceso','Ganado','No interesado']}
+                reset_kanban_pagination()
                 st.rerun()
         
         with col2:
             if st.button("⏭️ Avanzar todas", help="Avanzar una página/nivel en todas las etapas"):
-                for stage in st.session_state.current_page:
-                    st.session_state.current_page[stage] += 1
+                for stage in KANBAN_STAGES:
+                    advance_kanban_page(stage, pagination_mode)
                 st.rerun()
         
         with col3:
             if pagination_mode == "incremental":
                 if st.button("🚀 Cargar más en todas", help="Mostrar más elementos en todas las etapas"):
-                    for stage in st.session_state.current_page:
-                        st.session_state.current_page[stage] += 1
+                    for stage in KANBAN_STAGES:
+                        advance_kanban_page(stage, pagination_mode)
                     st.rerun()
 
     # Botón para cerrar el panel admin
@@ -799,7 +900,7 @@ def show_panel_admin(filter_stage, filter_medium, filter_pais, filter_ciudad):
         if 'show_summary_only' in st.session_state:
             del st.session_state.show_summary_only
         # Resetear paginación
-        st.session_state.current_page = {stage: 1 for stage in ['En cola','En Proceso','Ganado','No interesado']}
+        reset_kanban_pagination()
         st.rerun()
 
 def render_stage_navigation(stage_name, total_in_stage, items_per_stage, pagination_mode):
@@ -815,6 +916,8 @@ def render_stage_navigation(stage_name, total_in_stage, items_per_stage, paginat
             with col1:
                 if current_page > 1:
                     if st.button(f"⬅️", key=f"prev_{stage_name}", help="Página anterior"):
+                        # Volver al cursor de la página anterior
+                        st.session_state.kanban_cursors[stage_name].pop()
                         st.session_state.current_page[stage_name] -= 1
                         st.rerun()
             
@@ -822,26 +925,26 @@ def render_stage_navigation(stage_name, total_in_stage, items_per_stage, paginat
                 st.markdown(f"<div style='text-align: center'>Página {current_page} de {total_pages}</div>", unsafe_allow_html=True)
             
             with col3:
-                if current_page < total_pages:
+                if st.session_state.kanban_next_cursor.get(stage_name) is not None:
                     if st.button(f"➡️", key=f"next_{stage_name}", help="Página siguiente"):
-                        st.session_state.current_page[stage_name] += 1
+                        advance_kanban_page(stage_name, pagination_mode)
                         st.rerun()
     
     elif pagination_mode == "incremental":
         current_page = st.session_state.current_page[stage_name]
         current_showing = items_per_stage * current_page
         
-        if current_showing < total_in_stage:
+        if current_showing < total_in_stage and st.session_state.kanban_next_cursor.get(stage_name) is not None:
             remaining = total_in_stage - current_showing
             next_batch = min(items_per_stage, remaining)
             if st.button(f"➕ Mostrar {next_batch} más", key=f"more_{stage_name}", use_container_width=True):
-                st.session_state.current_page[stage_name] += 1
+                advance_kanban_page(stage_name, pagination_mode)
                 st.rerun()
         
         # Botón para resetear vista
         if current_page > 1:
             if st.button(f"🔄 Volver al inicio", key=f"reset_{stage_name}", use_container_width=True):
-                st.session_state.current_page[stage_name] = 1
+                reset_kanban_pagination(stage_name)
                 st.rerun()
 
 def render_full_edit_form(row):
@@ -1015,13 +1118,14 @@ def render_full_edit_form(row):
         
         # Mostrar tareas existentes - evitar conversión automática de fechas
         try:
-            conn = sqlite3.connect(DB_PATH, detect_types=0)  # No auto-conversión de tipos
+            conn = get_conn(parse_types=False)  # No auto-conversión de tipos
             c = conn.cursor()
             c.execute('''
                 SELECT id, title, 
                        CAST(due_date AS TEXT) as due_date_str, 
                        done, notes, 
-                       CAST(created_at AS TEXT) as created_at_str
+                       CAST(created_at AS TEXT) as created_at_str,
+                       assignee_username, assignee_email
                 FROM tasks WHERE institution_id = ?
                 ORDER BY id DESC
             ''', (row['id'],))
@@ -1031,7 +1135,7 @@ def render_full_edit_form(row):
             
             # Crear DataFrame manualmente
             if task_rows:
-                existing_tasks = pd.DataFrame(task_rows, columns=['id', 'title', 'due_date', 'done', 'notes', 'created_at'])
+                existing_tasks = pd.DataFrame(task_rows, columns=['id', 'title', 'due_date', 'done', 'notes', 'created_at', 'assignee_username', 'assignee_email'])
                 # Convertir fechas de forma muy segura
                 for col in ['due_date', 'created_at']:
                     if col in existing_tasks.columns:
@@ -1040,11 +1144,11 @@ def render_full_edit_form(row):
                         existing_tasks[col] = existing_tasks[col].str.replace(r'[^\d\-:\s]', '', regex=True)
                         existing_tasks[col] = pd.to_datetime(existing_tasks[col], errors='coerce')
             else:
-                existing_tasks = pd.DataFrame(columns=['id', 'title', 'due_date', 'done', 'notes', 'created_at'])
+                existing_tasks = pd.DataFrame(columns=['id', 'title', 'due_date', 'done', 'notes', 'created_at', 'assignee_username', 'assignee_email'])
                 
         except Exception as e:
             st.warning(f"⚠️ Problema al cargar tareas: {str(e)}")
-            existing_tasks = pd.DataFrame(columns=['id', 'title', 'due_date', 'done', 'notes', 'created_at'])
+            existing_tasks = pd.DataFrame(columns=['id', 'title', 'due_date', 'done', 'notes', 'created_at', 'assignee_username', 'assignee_email'])
         
         if not existing_tasks.empty:
             st.markdown("**📋 Tareas Existentes:**")
@@ -1054,25 +1158,9 @@ def render_full_edit_form(row):
                     status_icon = "✅" if task['done'] else "⏳"
                     st.write(f"{status_icon} **{task['title']}** - Vence: {safe_date_display(task['due_date'])}")
                     if task['notes']:
-                        # Extraer información del responsable de las notas para mejor visualización
-                        notes_text = str(task['notes'])
-                        if "Responsable:" in notes_text:
-                            lines = notes_text.split('\n')
-                            task_notes = []
-                            responsable_info = []
-                            
-                            for line in lines:
-                                if line.startswith('Responsable:') or line.startswith('Email:') or line.startswith('Rol:'):
-                                    responsable_info.append(line)
-                                elif line.strip():  # Solo líneas no vacías que no sean info del responsable
-                                    task_notes.append(line)
-                            
-                            if task_notes:
-                                st.caption(f"📝 {' '.join(task_notes)}")
-                            if responsable_info:
-                                st.caption(f"👤 {' | '.join(responsable_info)}")
-                        else:
-                            st.caption(f"📝 {notes_text}")
+                        st.caption(f"📝 {task['notes']}")
+                    if task['assignee_username'] or task['assignee_email']:
+                        st.caption(f"👤 {task['assignee_username'] or 'Sin usuario'} | {task['assignee_email'] or 'Sin email'}")
                 with col2:
                     if st.button("✏️", key=f"edit_form_edit_task_{task['id']}", help="Editar tarea"):
                         st.session_state[f"editing_task_{task['id']}"] = True
@@ -1116,15 +1204,11 @@ def render_full_edit_form(row):
             
             if st.form_submit_button('➕ Crear Tarea'):
                 if task_title:
-                    # Preparar datos del responsable
-                    if selected_user != "Sin asignar" and selected_user in user_data:
-                        user_info = user_data[selected_user]
-                        responsable_info = f"Responsable: {user_info['full_name'] or user_info['username']} ({user_info['username']})\nEmail: {user_info['email']}\nRol: {user_info['role'].title()}"
-                    else:
-                        responsable_info = "Responsable: Sin asignar"
-                    
-                    full_notes = f"{task_notes}\n\n{responsable_info}"
-                    create_task(row['id'], task_title, task_due_date, full_notes)
+                    # Responsable en columnas propias (assignee_username / assignee_email)
+                    user_info = user_data.get(selected_user, {}) if selected_user != "Sin asignar" else {}
+                    create_task(row['id'], task_title, task_due_date, task_notes,
+                                assignee_username=user_info.get('username'),
+                                assignee_email=user_info.get('email'))
                     st.success('✅ Tarea creada correctamente')
                     st.rerun()
                 else:
@@ -1263,8 +1347,8 @@ def save_institution_changes(institution_id, changes):
             conn.close()
         return False
 
-def create_task(institution_id, title, due_date, notes=''):
-    """Crea una nueva tarea para una institución"""
+def create_task(institution_id, title, due_date, notes='', assignee_username=None, assignee_email=None):
+    """Crea una nueva tarea para una institución y avisa por email al responsable"""
     try:
         conn = get_conn()
         c = conn.cursor()
@@ -1279,29 +1363,15 @@ def create_task(institution_id, title, due_date, notes=''):
             due_date_str = str(due_date)
         
         c.execute('''
-            INSERT INTO tasks (id, institution_id, title, due_date, notes, done, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (task_id, institution_id, title, due_date_str, notes, 0, created_at))
+            INSERT INTO tasks (id, institution_id, title, due_date, notes, done, created_at, assignee_username, assignee_email)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (task_id, institution_id, title, due_date_str, notes, 0, created_at, assignee_username, assignee_email))
         conn.commit()
         conn.close()
 
         # --- Notificación por email al responsable si está asignado ---
-        # Buscar email del responsable en las notas (formato: Email: ...)
-        import re
-        email_match = re.search(r"Email:\s*([\w\.-]+@[\w\.-]+)", notes or "")
-        if email_match:
-            responsable_email = email_match.group(1)
-            # Buscar nombre/usuario
-            name_match = re.search(r"Responsable:\s*([^\n]+)", notes or "")
-            responsable_name = name_match.group(1) if name_match else responsable_email
-            # Construir info para email
-            responsable_info = {
-                'email': responsable_email,
-                'full_name': responsable_name,
-                'username': responsable_email,
-                'role': ''
-            }
-            # Construir datos de la tarea
+        if assignee_email:
+            responsable_info = get_task_assignee_info(assignee_username, assignee_email)
             task_data = {
                 'title': title,
                 'institucion': institution_id,
@@ -1523,7 +1593,14 @@ def show_registrar_institucion():
             type=['csv', 'xlsx', 'xls'],
             help="Formatos soportados: CSV, Excel (xlsx, xls)"
         )
-        if uploaded_file is not None:
+        streaming_mode = st.checkbox(
+            "⚡ Modo streaming (archivos muy grandes)",
+            value=uploaded_file is not None and uploaded_file.size > STREAMING_SUGGESTED_BYTES,
+            help="Lee, valida e inserta el archivo por bloques sin cargarlo completo en memoria (sin vista previa)"
+        )
+        if uploaded_file is not None and streaming_mode:
+            show_streaming_import(uploaded_file)
+        elif uploaded_file is not None:
             import pandas as pd
             import uuid
             import datetime
@@ -1600,50 +1677,15 @@ def show_registrar_institucion():
                         st.info(f"🚀 Listo para procesar {len(valid_rows)} instituciones")
                         if st.button("🚀 Procesar y cargar instituciones", type="primary"):
                             progress_bar = st.progress(0)
-                            success_count = 0
-                            error_count = 0
-                            errors = []
-                            warnings = []
-                            for index, row in valid_rows.iterrows():
-                                try:
-                                    inst = {
-                                        'id': str(uuid.uuid4()),
-                                        'name': str(row['name']).strip(),
-                                    }
-                                    inst['rector_name'] = str(row.get('rector_name', 'Rector Sin Definir')).strip() if pd.notna(row.get('rector_name')) else 'Rector Sin Definir'
-                                    inst['rector_email'] = str(row.get('rector_email', 'rector-sin-email@temp.com')).strip() if pd.notna(row.get('rector_email')) else 'rector-sin-email@temp.com'
-                                    inst['rector_phone'] = str(row.get('rector_phone', '+593 000000000')).strip() if pd.notna(row.get('rector_phone')) else '+593 000000000'
-                                    inst['contraparte_name'] = str(row.get('contraparte_name', 'Contraparte Sin Definir')).strip() if pd.notna(row.get('contraparte_name')) else 'Contraparte Sin Definir'
-                                    inst['contraparte_email'] = str(row.get('contraparte_email', 'contraparte-sin-email@temp.com')).strip() if pd.notna(row.get('contraparte_email')) else 'contraparte-sin-email@temp.com'
-                                    inst['contraparte_phone'] = str(row.get('contraparte_phone', '+593 000000000')).strip() if pd.notna(row.get('contraparte_phone')) else '+593 000000000'
-                                    inst.update({
-                                        'website': str(row.get('website', '')).strip() if pd.notna(row.get('website')) else '',
-                                        'pais': str(row.get('pais', 'Ecuador')).strip() if pd.notna(row.get('pais')) else 'Ecuador',
-                                        'ciudad': str(row.get('ciudad', '')).strip() if pd.notna(row.get('ciudad')) else '',
-                                        'direccion': str(row.get('direccion', '')).strip() if pd.notna(row.get('direccion')) else '',
-                                        'created_contact': str(datetime.date.today()),
-                                        'last_interaction': str(datetime.date.today()),
-                                        'num_teachers': int(float(row.get('num_teachers', 0))) if pd.notna(row.get('num_teachers')) and str(row.get('num_teachers')).replace('.','').replace(',','').isdigit() else 0,
-                                        'num_students': int(float(row.get('num_students', 0))) if pd.notna(row.get('num_students')) and str(row.get('num_students')).replace('.','').replace(',','').isdigit() else 0,
-                                        'avg_fee': float(str(row.get('avg_fee', 0)).replace(',', '.')) if pd.notna(row.get('avg_fee')) else 0.0,
-                                        'initial_contact_medium': str(row.get('initial_contact_medium', 'Whatsapp')).strip() if pd.notna(row.get('initial_contact_medium')) else 'Whatsapp',
-                                        'stage': str(row.get('stage', 'En cola')).strip() if pd.notna(row.get('stage')) else 'En cola',
-                                        'substage': str(row.get('substage', 'Primera reunión')).strip() if pd.notna(row.get('substage')) else 'Primera reunión',
-                                        'program_proposed': str(row.get('program_proposed', 'Demo')).strip() if pd.notna(row.get('program_proposed')) else 'Demo',
-                                        'proposal_value': float(str(row.get('proposal_value', 0)).replace(',', '.')) if pd.notna(row.get('proposal_value')) else 0.0,
-                                        'contract_start_date': str(row.get('contract_start_date')) if pd.notna(row.get('contract_start_date')) else None,
-                                        'contract_end_date': str(row.get('contract_end_date')) if pd.notna(row.get('contract_end_date')) else None,
-                                        'observations': str(row.get('observations', '')).strip() if pd.notna(row.get('observations')) else '',
-                                        'assigned_commercial': str(row.get('assigned_commercial', '')).strip() if pd.notna(row.get('assigned_commercial')) else '',
-                                        'no_interest_reason': None
-                                    })
-                                    save_institution(inst)
-                                    success_count += 1
-                                except Exception as e:
-                                    error_count += 1
-                                    errors.append(f"Fila {index + 2}: {str(e)}")
-                                progress = (index + 1) / len(valid_rows)
-                                progress_bar.progress(progress)
+                            # Normalización vectorizada + inserción por bloques en una sola transacción
+                            result = import_institutions(
+                                valid_rows,
+                                progress_callback=lambda done, total: progress_bar.progress(done / total)
+                            )
+                            progress_bar.progress(1.0)
+                            success_count = result['inserted']
+                            error_count = len(result['errors'])
+                            errors = [f"Fila {row_number}: {message}" for row_number, message in result['errors']]
                             st.success(f"✅ Proceso completado! {success_count} instituciones cargadas.")
                             if error_count > 0:
                                 st.error(f"❌ {error_count} errores durante la carga.")
@@ -1659,14 +1701,15 @@ def show_buscar_editar():
     """Página para buscar y editar instituciones optimizada"""
     st.header('Buscar o editar instituciones')
     
-    q = st.text_input('Buscar por nombre, rector o email')
+    q = st.text_input('Buscar por nombre, contacto, email, ciudad u observaciones')
     
     # Only load data when there's a search query or when explicitly requested
     if q:
-        # Search with database-level filtering for better performance
-        search_query = f"%{q}%"
-        where_clause = f"name LIKE '{search_query}' OR rector_name LIKE '{search_query}' OR rector_email LIKE '{search_query}' OR contraparte_name LIKE '{search_query}' OR contraparte_email LIKE '{search_query}'"
-        results = fetch_institutions_df(where_clause=where_clause)
+        # Búsqueda en el índice FTS5: prefijos, sin distinguir acentos y ordenada por relevancia
+        results = search_institutions_df(q)
+        if results.empty:
+            st.info(f'🔍 No se encontraron instituciones para "{q}"')
+            return
     else:
         # Show option to load all data or provide search hint
         if st.button("📋 Mostrar todas las instituciones", help="Cargar todas las instituciones (puede ser lento)"):
@@ -1741,33 +1784,35 @@ def show_dashboard_metrics():
             st.subheader("📊 Gráficos Detallados")
             if st.button("🔄 Cargar Gráficos Detallados"):
                 with st.spinner("Cargando datos para gráficos..."):
-                    # Only load data when user requests detailed charts
-                    df_charts = fetch_institutions_df(
-                        columns=['initial_contact_medium', 'stage', 'created_contact', 'last_interaction', 'num_teachers', 'avg_fee']
-                    )
+                    # Los gráficos salen de los agregados materializados, sin recorrer institutions
+                    medium_rows = get_pipeline_aggregates(group_by=('medium',))
+                    stage_rows = get_pipeline_aggregates(group_by=('stage',))
                     
-                    if not df_charts.empty:
+                    if medium_rows or stage_rows:
                         # Medio de contacto mas efectivo
                         st.subheader("📞 Medios de Contacto Más Efectivos")
-                        med_counts = df_charts['initial_contact_medium'].value_counts()
-                        if not med_counts.empty:
-                            med_df = med_counts.reset_index()
-                            med_df.columns = ['medium','count']
+                        med_df = pd.DataFrame(
+                            [(row['medium'], row['lead_count']) for row in medium_rows if row['medium']],
+                            columns=['medium', 'count']
+                        ).sort_values('count', ascending=False)
+                        if not med_df.empty:
                             chart = alt.Chart(med_df).mark_bar().encode(x='medium', y='count')
                             st.altair_chart(chart, use_container_width=True)
 
                         # Tiempo promedio en cada etapa
                         st.subheader("⏱️ Tiempo Promedio por Etapa")
-                        df_charts['days_in_pipeline'] = (df_charts['last_interaction'] - df_charts['created_contact']).dt.days
-                        avg_days_by_stage = df_charts.groupby('stage')['days_in_pipeline'].mean().reset_index()
+                        avg_days_by_stage = pd.DataFrame(
+                            [(row['stage'], row['avg_pipeline_days']) for row in stage_rows
+                             if row['stage'] and row['avg_pipeline_days'] is not None],
+                            columns=['stage', 'days_in_pipeline']
+                        )
                         if not avg_days_by_stage.empty:
                             chart2 = alt.Chart(avg_days_by_stage).mark_bar().encode(x='stage', y='days_in_pipeline')
                             st.altair_chart(chart2, use_container_width=True)
 
                         # Valor potencial acumulado
                         st.subheader("💰 Valor Potencial")
-                        df_charts['potential_value'] = df_charts['num_teachers'].fillna(0) * df_charts['avg_fee'].fillna(0)
-                        total_potential = df_charts['potential_value'].sum()
+                        total_potential = sum(row['potential_value'] for row in stage_rows)
                         st.metric('💰 Valor potencial acumulado (estimado)', f"${total_potential:,.2f}")
             else:
                 st.info("💡 Haz clic en 'Cargar Gráficos Detallados' para ver análisis completos")
@@ -1800,16 +1845,17 @@ def show_tareas_alertas():
         return
     
     # Cargar tareas solo cuando se necesiten - sin auto-conversión de fechas
+    profile_step('Consulta tareas')
     with st.spinner('⏳ Cargando tareas...'):
         try:
-            conn = sqlite3.connect(DB_PATH, detect_types=0)  # No auto-conversión de tipos
+            conn = get_conn(parse_types=False)  # No auto-conversión de tipos
             c = conn.cursor()
             c.execute('''
                 SELECT t.id, i.name as institucion, t.title, 
                        CAST(t.due_date AS TEXT) as due_date_str, 
                        t.done, 
                        CAST(t.created_at AS TEXT) as created_at_str, 
-                       t.notes
+                       t.notes, t.assignee_username, t.assignee_email
                 FROM tasks t LEFT JOIN institutions i ON t.institution_id = i.id
                 ORDER BY t.id DESC
             ''')
@@ -1819,7 +1865,7 @@ def show_tareas_alertas():
             
             # Crear DataFrame manualmente
             if task_rows:
-                tasks = pd.DataFrame(task_rows, columns=['id', 'institucion', 'title', 'due_date', 'done', 'created_at', 'notes'])
+                tasks = pd.DataFrame(task_rows, columns=['id', 'institucion', 'title', 'due_date', 'done', 'created_at', 'notes', 'assignee_username', 'assignee_email'])
                 # Convertir fechas de forma segura
                 for col in ['due_date', 'created_at']:
                     if col in tasks.columns:
@@ -1828,12 +1874,13 @@ def show_tareas_alertas():
                         tasks[col] = tasks[col].str.replace(r'[^\d\-:\s]', '', regex=True)
                         tasks[col] = pd.to_datetime(tasks[col], errors='coerce')
             else:
-                tasks = pd.DataFrame(columns=['id', 'institucion', 'title', 'due_date', 'done', 'created_at', 'notes'])
+                tasks = pd.DataFrame(columns=['id', 'institucion', 'title', 'due_date', 'done', 'created_at', 'notes', 'assignee_username', 'assignee_email'])
                 
         except Exception as e:
             st.error(f"❌ Error al cargar tareas: {str(e)}")
-            tasks = pd.DataFrame(columns=['id', 'institucion', 'title', 'due_date', 'done', 'created_at', 'notes'])
+            tasks = pd.DataFrame(columns=['id', 'institucion', 'title', 'due_date', 'done', 'created_at', 'notes', 'assignee_username', 'assignee_email'])
     
+    profile_step('Lista de tareas')
     if tasks.empty:
         st.info('ℹ️ No hay tareas registradas')
     else:
@@ -1847,8 +1894,8 @@ def show_tareas_alertas():
                     st.write(f"**Creada:** {row['created_at'].date() if not pd.isna(row['created_at']) else 'N/A'}")
                     st.write(f"**Notas:** {row['notes'] or 'Sin notas'}")
                     
-                    # Extraer y mostrar información del responsable
-                    responsable_info = extract_responsable_info_from_notes(row['notes'])
+                    # Información del responsable desde las columnas de la tarea
+                    responsable_info = get_task_assignee_info(row['assignee_username'], row['assignee_email'])
                     if responsable_info:
                         st.write(f"**👤 Responsable:** {responsable_info.get('full_name', 'N/A')} ({responsable_info.get('username', 'N/A')})")
                         st.write(f"**📧 Email:** {responsable_info.get('email', 'N/A')}")
@@ -1887,13 +1934,11 @@ def show_tareas_alertas():
                     
                     with col1:
                         if st.button('📧 Enviar Email', key=f'email_task_{row["id"]}', use_container_width=True):
-                            with st.spinner('📧 Enviando email...'):
-                                success, message = send_task_email(row, responsable_info)
-                                if success:
-                                    st.success(message)
-                                    st.balloons()
-                                else:
-                                    st.error(message)
+                            success, message = send_task_email(row, responsable_info)
+                            if success:
+                                st.success(message)
+                            else:
+                                st.error(message)
                     
                     with col2:
                         if st.button('💬 Enviar WhatsApp', key=f'whatsapp_task_{row["id"]}', use_container_width=True):
@@ -1914,46 +1959,11 @@ def show_tareas_alertas():
                 else:
                     st.warning("⚠️ No se puede enviar notificación: falta información del responsable")
 
-    # Alerts: leads without contact > 7 días (optimized with database query)
-    st.subheader("⚠️ Alertas de Seguimiento")
-    conn = get_conn()
-    try:
-        # Get stale leads directly from database with date calculation
-        stale_query = '''
-            SELECT id, name, last_interaction, assigned_commercial
-            FROM institutions 
-            WHERE last_interaction < datetime('now', '-7 days')
-            ORDER BY last_interaction ASC
-        '''
-        stale_df = pd.read_sql_query(stale_query, conn)
-        # Convertir fechas de forma segura
-        if not stale_df.empty:
-            stale_df['last_interaction'] = pd.to_datetime(stale_df['last_interaction'], errors='coerce')
-        
-        if not stale_df.empty:
-            st.warning(f'⚠️ {len(stale_df)} leads sin contacto > 7 días:')
-            for i, row in stale_df.iterrows():
-                st.write(f"{row['name']} — Última interacción: {row['last_interaction'].date() if not pd.isna(row['last_interaction']) else 'N/A'} — Responsable: {row.get('assigned_commercial', 'No asignado')}")
-                if st.button(f'📝 Marcar tarea de seguimiento', key=f'follow_{row["id"]}'):
-                    create_task(row['id'], 'Seguimiento - Lead sin contacto >7d', pd.Timestamp.now().date() + timedelta(days=1), notes='Generado desde alerta')
-                    st.success('✅ Tarea creada')
-                    st.rerun()
-            # Botón para eliminar todas las alertas de seguimiento
-            if st.button('🗑️ Eliminar todas las Alertas de Seguimiento'):
-                with get_conn() as conn_del:
-                    conn_del.execute("""
-                        UPDATE institutions SET last_interaction = datetime('now')
-                        WHERE last_interaction < datetime('now', '-7 days')
-                    """)
-                    conn_del.commit()
-                st.success('Todas las alertas de seguimiento han sido eliminadas (se actualizó la fecha de última interacción).')
-                st.rerun()
-        else:
-            st.success("✅ Todos los leads tienen contacto reciente")
-    finally:
-        conn.close()
+    profile_step('Leads sin contacto')
+    show_stale_lead_alerts()
 
     # Mostrar alertas de cambios de descripción
+    profile_step('Alertas de descripción')
     st.subheader("🔔 Alertas de cambios de descripción (ventas)")
     # Forzar refresco de la sección de alertas si se ha guardado una nueva
     if 'alertas_descripcion_refresh' not in st.session_state:
@@ -1970,12 +1980,105 @@ def show_tareas_alertas():
         for idx, alert in alerts_df.iterrows():
             st.warning(f"[{alert['change_date']}] {alert['changed_by']} modificó la descripción de '{alert['institution_name']}'\n\n**Antes:** {alert['old_value']}\n**Ahora:** {alert['new_value']}")
     
+    profile_step('Cola de emails')
+    show_email_outbox_status()
+    
     # Botón para limpiar cache de tareas
     st.markdown('---')
     if st.button('🧹 Cerrar Panel de Tareas'):
         st.session_state.tasks_loaded = False
         st.rerun()
 
+def show_stale_lead_alerts():
+    """Alertas de leads sin contacto precalculadas por el job de alertas"""
+    st.subheader("⚠️ Alertas de Seguimiento")
+    st.caption(f"Última actualización: {get_last_alert_run() or 'pendiente'} · se recalculan en segundo plano")
+    
+    summary = get_stale_alert_summary()
+    if not summary:
+        st.success("✅ Todos los leads tienen contacto reciente")
+    else:
+        total_alerts = sum(item['alerts'] for item in summary)
+        without_task = sum(item['alerts'] - item['with_task'] for item in summary)
+        st.warning(f'⚠️ {total_alerts} leads sin contacto por encima del umbral de su etapa ({without_task} sin tarea de seguimiento)')
+        
+        summary_df = pd.DataFrame(summary).rename(columns={
+            'assigned_commercial': 'Comercial', 'alerts': 'Alertas', 'with_task': 'Con tarea'
+        })
+        summary_df['Comercial'] = summary_df['Comercial'].fillna('Sin asignar')
+        st.dataframe(summary_df, use_container_width=True, hide_index=True)
+        
+        alerts_df = pd.DataFrame(get_stale_lead_alerts(limit=200))
+        with st.expander(f"Ver leads sin contacto ({min(len(alerts_df), 200)} más antiguos)"):
+            st.dataframe(
+                alerts_df[['institution_name', 'stage', 'assigned_commercial', 'last_interaction', 'days_since_contact']].rename(columns={
+                    'institution_name': 'Institución', 'stage': 'Etapa', 'assigned_commercial': 'Responsable',
+                    'last_interaction': 'Última interacción', 'days_since_contact': 'Días sin contacto'
+                }),
+                use_container_width=True, hide_index=True
+            )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if without_task and st.button(f'📝 Crear {without_task} tareas de seguimiento', use_container_width=True):
+                created = create_follow_up_tasks()
+                st.success(f'✅ {created} tareas creadas')
+                st.rerun()
+        with col2:
+            # Botón para eliminar todas las alertas de seguimiento
+            if st.button('🗑️ Eliminar todas las Alertas de Seguimiento', use_container_width=True):
+                conn = get_conn()
+                conn.execute("""
+                    UPDATE institutions SET last_interaction = datetime('now', 'localtime')
+                    WHERE id IN (SELECT institution_id FROM stale_lead_alerts)
+                """)
+                conn.commit()
+                refresh_stale_lead_alerts(conn, create_tasks=False)
+                st.success('Todas las alertas de seguimiento han sido eliminadas (se actualizó la fecha de última interacción).')
+                st.rerun()
+    
+    with st.expander("⚙️ Umbrales por etapa"):
+        thresholds = get_stale_thresholds()
+        with st.form('stale_thresholds_form'):
+            new_values = {}
+            for stage in sorted(set(KANBAN_STAGES) | set(thresholds)):
+                max_days, auto_follow_up = thresholds.get(stage, (7, False))
+                col1, col2, col3 = st.columns([2, 1, 2])
+                col1.markdown(f"**{stage}**")
+                enabled = col2.checkbox('Activa', value=max_days is not None, key=f'stale_enabled_{stage}')
+                days = col3.number_input('Días sin contacto', min_value=1, value=max_days or 7, key=f'stale_days_{stage}')
+                auto = st.checkbox(f'Crear tarea de seguimiento automáticamente ({stage})', value=auto_follow_up, key=f'stale_auto_{stage}')
+                new_values[stage] = (int(days) if enabled else None, auto)
+            if st.form_submit_button('💾 Guardar umbrales'):
+                for stage, (days, auto) in new_values.items():
+                    set_stale_threshold(stage, days, auto)
+                refresh_stale_lead_alerts()
+                st.success('✅ Umbrales guardados y alertas recalculadas')
+                st.rerun()
+
+def show_email_outbox_status():
+    """Estado de la cola de emails salientes"""
+    st.subheader("📬 Cola de emails")
+    counts = get_outbox_counts()
+    col1, col2, col3 = st.columns(3)
+    col1.metric('⏳ Pendientes', counts.get('pendiente', 0) + counts.get('enviando', 0))
+    col2.metric('✅ Enviados', counts.get('enviado', 0))
+    col3.metric('❌ Con error', counts.get('error', 0))
+    
+    if counts.get('error'):
+        conn = get_conn()
+        failed_df = pd.read_sql_query('''
+            SELECT recipient, subject, attempts, last_error, created_at
+            FROM email_outbox WHERE status = 'error'
+            ORDER BY id DESC LIMIT 20
+        ''', conn)
+        conn.close()
+        st.dataframe(failed_df, use_container_width=True, hide_index=True)
+        if st.button('🔁 Reintentar emails con error'):
+            retried = retry_failed_emails()
+            st.success(f'✅ {retried} emails vuelven a la cola')
+            st.rerun()
+
 def show_gestion_usuarios():
     """Gestión completa de usuarios del sistema con CRUD optimizada"""
     st.header('👥 Gestión de Usuarios')
@@ -2125,48 +2228,103 @@ def mostrar_lista_usuarios():
             conn.close()
 
 
-def create_leads_backup_bytes():
-    """Genera un ZIP en memoria con CSVs de institutions, interactions, tasks y admin_alerts."""
+BACKUP_KINDS = {
+    'completo': ('📦 Completo (ZIP con CSVs)', 'zip', 'application/zip'),
+    'incremental': ('➕ Incremental (cambios desde el último backup)', 'zip', 'application/zip'),
+    'binario': ('💾 Binario compacto (SQLite, sin usuarios)', 'db', 'application/x-sqlite3'),
+}
+
+def prepare_leads_backup(kind):
+    """Genera el backup en un archivo temporal y devuelve sus datos para descargarlo"""
+    suffix = BACKUP_KINDS[kind][1]
+    fd, path = tempfile.mkstemp(prefix='backup_leads_', suffix=f'.{suffix}')
+    os.close(fd)
     try:
-        conn = get_conn()
-        dfs = {}
-        try:
-            dfs['institutions'] = pd.read_sql_query('SELECT * FROM institutions', conn)
-        except Exception:
-            dfs['institutions'] = pd.DataFrame()
-        try:
-            dfs['interactions'] = pd.read_sql_query('SELECT * FROM interactions', conn)
-        except Exception:
-            dfs['interactions'] = pd.DataFrame()
-        try:
-            dfs['tasks'] = pd.read_sql_query('SELECT * FROM tasks', conn)
-        except Exception:
-            dfs['tasks'] = pd.DataFrame()
+        if kind == 'binario':
+            stats = {'last_seq': create_binary_backup(path)}
+        else:
+            since_seq = get_backup_watermark() if kind == 'incremental' else None
+            stats = write_leads_backup_zip(path, since_seq=since_seq)
+    except Exception:
+        os.remove(path)
+        raise
+    return {'kind': kind, 'path': path, 'stats': stats,
+            'file_name': f"backup_leads_{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{suffix}"}
+
+def show_backup_options():
+    """Opciones de backup: ZIP completo, incremental desde la última marca de agua o binario"""
+    backup_kind = st.radio(
+        'Tipo de backup',
+        list(BACKUP_KINDS),
+        format_func=lambda kind: BACKUP_KINDS[kind][0],
+        horizontal=True
+    )
+    if backup_kind == 'incremental' and get_backup_watermark() == 0:
+        st.info('ℹ️ Aún no se ha descargado ningún backup; el incremental solo incluirá los cambios registrados desde que se activó el registro de cambios. Se recomienda un backup completo primero.')
+    
+    if st.button('⚙️ Preparar backup'):
+        previous = st.session_state.pop('leads_backup', None)
+        if previous and os.path.exists(previous['path']):
+            os.remove(previous['path'])
         try:
-            dfs['admin_alerts'] = pd.read_sql_query('SELECT * FROM admin_alerts', conn)
-        except Exception:
-            dfs['admin_alerts'] = pd.DataFrame()
-        conn.close()
+            with st.spinner('⏳ Generando backup...'):
+                st.session_state.leads_backup = prepare_leads_backup(backup_kind)
+        except Exception as e:
+            st.error(f"❌ Error al generar el backup: {str(e)}")
+    
+    backup = st.session_state.get('leads_backup')
+    if backup and backup['kind'] == backup_kind and os.path.exists(backup['path']):
+        stats = backup['stats']
+        exported = ', '.join(f"{table}: {stats[table]}" for table in BACKUP_TABLES if table in stats)
+        if exported:
+            st.caption(f"Filas exportadas — {exported}" + (f", borradas: {stats['deleted']}" if 'deleted' in stats else ''))
+        size_mb = os.path.getsize(backup['path']) / (1024 * 1024)
+        with open(backup['path'], 'rb') as backup_file:
+            # Al descargar se registra la marca de agua para el siguiente incremental
+            st.download_button(
+                f'📥 Descargar Backup ({size_mb:.1f} MB)',
+                data=backup_file,
+                file_name=backup['file_name'],
+                mime=BACKUP_KINDS[backup_kind][2],
+                on_click=record_backup_watermark,
+                args=(stats['last_seq'], backup_kind)
+            )
+        st.info('Descarga el backup antes de proceder a la eliminación.')
 
-        buf = io.BytesIO()
-        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
-            for name, df in dfs.items():
-                try:
-                    csv_bytes = df.to_csv(index=False).encode('utf-8')
-                except Exception:
-                    # If DataFrame cannot be serialized, store an empty file with message
-                    csv_bytes = f"# No se pudo exportar {name}\n".encode('utf-8')
-                z.writestr(f"{name}.csv", csv_bytes)
 
-        buf.seek(0)
-        return buf.getvalue()
+def show_query_stats():
+    """Consultas SQL de la sesión que más tiempo consumen y registro de consultas lentas"""
+    st.header('⏱️ Consultas SQL')
+    stats = st.session_state.get('query_stats')
+    if not stats:
+        st.info('La instrumentación de consultas no está activa en esta sesión.')
+        return
+
+    rerun = stats['rerun']
+    col1, col2 = st.columns(2)
+    col1.metric('Consultas en este rerun', rerun['count'])
+    col2.metric('Tiempo en SQL (este rerun)', f"{rerun['total_ms']:.0f} ms")
+
+    limit = st.slider('Consultas a mostrar', 5, 100, 15, key='query_stats_limit')
+    rows = top_queries(stats, limit)
+    if rows:
+        st.caption('Acumulado de la sesión, ordenado por tiempo total')
+        st.dataframe(pd.DataFrame(rows)[['total_ms', 'calls', 'avg_ms', 'max_ms', 'rows', 'caller', 'sql', 'last_params']]
+                     .round(1), use_container_width=True, hide_index=True)
+    if st.button('🔄 Reiniciar estadísticas de la sesión', key='reset_query_stats'):
+        stats['queries'].clear()
+        st.rerun()
 
+    st.subheader(f'🐢 Consultas lentas (≥ {SLOW_QUERY_MS:.0f} ms, todas las sesiones)')
+    try:
+        slow = get_slow_queries(50)
     except Exception as e:
-        try:
-            conn.close()
-        except Exception:
-            pass
-        raise
+        st.error(f"❌ Error al leer el registro de consultas lentas: {str(e)}")
+        return
+    if slow:
+        st.dataframe(pd.DataFrame(slow).round(1), use_container_width=True, hide_index=True)
+    else:
+        st.success('No hay consultas lentas registradas.')
 
 
 def show_clean_leads():
@@ -2202,13 +2360,7 @@ def show_clean_leads():
     # Backup option
     backup_before = st.checkbox('📦 Hacer backup descargable antes de eliminar (recomendado)', value=True)
     if backup_before:
-        try:
-            backup_bytes = create_leads_backup_bytes()
-            fname = f"backup_leads_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-            st.download_button('📥 Descargar Backup (ZIP)', data=backup_bytes, file_name=fname, mime='application/zip')
-            st.info('Descarga el backup antes de proceder a la eliminación.')
-        except Exception as e:
-            st.error(f"❌ Error al generar el backup: {str(e)}")
+        show_backup_options()
 
     st.markdown('---')
     st.markdown('### Confirmaciones')
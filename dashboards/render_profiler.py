@@ -0,0 +1,209 @@
+"""
+Perfil de tiempos de render de los dashboards.
+
+Cada rerun se divide en secciones: profile_section('Panel Admin') como
+context manager alrededor de una pestaña, y profile_step('Consulta') para
+marcar dentro de ella el siguiente paso (consulta, transformación, render)
+sin reindentar el código; un paso termina al empezar el siguiente o al
+cerrarse su sección. De cada sección se mide el tiempo, el tiempo en SQL
+(db.query_log) y los elementos de Streamlit emitidos: widgets, bloques
+(expanders, columnas, contenedores) y el resto. finish_render_profile()
+cierra el rerun y lo añade como una línea JSON a RENDER_LOG_PATH (también
+si el script se interrumpe con st.rerun(), llamándola en un finally), y
+show_render_profile() lo muestra además en un panel del sidebar.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+RENDER_LOG_PATH = os.environ.get('MUYU_RENDER_LOG', os.path.join('.cache', 'render_profile.jsonl'))
+ALWAYS_ON = os.environ.get('MUYU_RENDER_PROFILE') == '1'
+SEPARATOR = ' › '
+COUNTERS = ('widgets', 'blocks', 'elements')
+
+# Tipos de delta de Streamlit que son widgets (el resto son elementos de solo lectura)
+WIDGET_TYPES = frozenset({
+    'button', 'download_button', 'checkbox', 'radio', 'selectbox', 'multiselect', 'slider',
+    'text_input', 'text_area', 'number_input', 'date_input', 'time_input', 'file_uploader',
+    'color_picker', 'camera_input', 'chat_input', 'arrow_data_editor',
+})
+
+# El perfil vive en el hilo del script (un rerun a la vez por sesión)
+_local = threading.local()
+_counter_lock = threading.Lock()
+_counter_installed = False
+
+
+def _counting(original, is_block):
+    @functools.wraps(original)
+    def wrapper(self, *args, **kwargs):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None:
+            if is_block:
+                kind = 'blocks'
+            else:
+                delta_type = args[0] if args else kwargs.get('delta_type')
+                kind = 'widgets' if delta_type in WIDGET_TYPES else 'elements'
+            for section in profile['stack']:
+                section[kind] += 1
+        return original(self, *args, **kwargs)
+    return wrapper
+
+
+def _install_element_counter():
+    """Contar los elementos que emite Streamlit envolviendo DeltaGenerator (una vez por proceso)"""
+    global _counter_installed
+    with _counter_lock:
+        if _counter_installed:
+            return
+        _counter_installed = True
+        from streamlit.delta_generator import DeltaGenerator
+        for method_name in ('_enqueue', '_block'):
+            original = getattr(DeltaGenerator, method_name, None)
+            if original is not None:
+                # En otras versiones de Streamlit puede no existir: el perfil queda sin ese conteo
+                setattr(DeltaGenerator, method_name, _counting(original, method_name == '_block'))
+
+
+def _sql_totals():
+    rerun = st.session_state.get('query_stats', {}).get('rerun') or {}
+    return rerun.get('count', 0), rerun.get('total_ms', 0.0)
+
+
+def _open(profile, name, is_step):
+    parent = profile['stack'][-1] if profile['stack'] else None
+    section = {
+        'section': name if parent is None or parent is profile['root'] else parent['section'] + SEPARATOR + name,
+        'depth': len(profile['stack']) - 1,
+        'is_step': is_step,
+        'start': time.perf_counter(),
+        'sql_start': _sql_totals(),
+        'ms': 0.0, 'sql_ms': 0.0, 'sql_count': 0,
+        'widgets': 0, 'blocks': 0, 'elements': 0,
+    }
+    profile['stack'].append(section)
+    if parent is not None:
+        profile['sections'].append(section)
+    return section
+
+
+def _close_until(profile, section):
+    """Cerrar las secciones abiertas hasta section (incluida)"""
+    while profile['stack']:
+        current = profile['stack'].pop()
+        current['ms'] = (time.perf_counter() - current['start']) * 1000
+        sql_count, sql_ms = _sql_totals()
+        current['sql_count'] = sql_count - current['sql_start'][0]
+        current['sql_ms'] = sql_ms - current['sql_start'][1]
+        if current is section:
+            return
+
+
+def start_render_profile():
+    """Empezar el perfil del rerun (llamar al inicio del script) si está activado"""
+    _local.profile = None
+    if not (ALWAYS_ON or st.session_state.get('render_profile_enabled')):
+        return
+    _install_element_counter()
+    profile = {'started_at': datetime.now().isoformat(timespec='seconds'), 'stack': [], 'sections': []}
+    profile['root'] = None
+    profile['root'] = _open(profile, 'Rerun', is_step=False)
+    _local.profile = profile
+
+
+@contextmanager
+def profile_section(name):
+    """Medir el bloque como una sección del rerun"""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        yield
+        return
+    section = _open(profile, name, is_step=False)
+    try:
+        yield
+    finally:
+        if any(open_section is section for open_section in profile['stack']):
+            _close_until(profile, section)
+
+
+def profile_step(name):
+    """Cerrar el paso anterior de la sección actual y empezar otro"""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return
+    if profile['stack'][-1]['is_step']:
+        _close_until(profile, profile['stack'][-1])
+    _open(profile, name, is_step=True)
+
+
+def _report(profile):
+    root = profile['root']
+    _close_until(profile, root)
+    # Secciones con el mismo nombre (p. ej. dentro de un bucle) se suman
+    sections = {}
+    for section in profile['sections']:
+        totals = sections.setdefault(section['section'], {
+            'section': section['section'], 'depth': section['depth'], 'calls': 0,
+            'ms': 0.0, 'sql_ms': 0.0, 'sql_count': 0, 'widgets': 0, 'blocks': 0, 'elements': 0,
+        })
+        totals['calls'] += 1
+        for field in ('ms', 'sql_ms', 'sql_count') + COUNTERS:
+            totals[field] += section[field]
+    report = {'ts': profile['started_at'], 'total_ms': root['ms'], 'sql_ms': root['sql_ms'],
+              'sql_count': root['sql_count']}
+    report.update({field: root[field] for field in COUNTERS})
+    report['sections'] = list(sections.values())
+    return report
+
+
+def _write_log(report):
+    try:
+        os.makedirs(os.path.dirname(RENDER_LOG_PATH) or '.', exist_ok=True)
+        with open(RENDER_LOG_PATH, 'a', encoding='utf-8') as log_file:
+            log_file.write(json.dumps(report, ensure_ascii=False) + '\n')
+    except OSError:
+        pass  # Sin permiso de escritura: el perfil sigue visible en el panel
+
+
+def finish_render_profile():
+    """Cerrar el perfil del rerun y registrarlo (sin nada que hacer si ya se cerró)"""
+    profile = getattr(_local, 'profile', None)
+    _local.profile = None
+    if profile is not None:
+        report = _report(profile)
+        st.session_state.render_profile_last = report
+        _write_log(report)
+
+
+def show_render_profile(show_panel=True):
+    """Cerrar el perfil del rerun, registrarlo y mostrar el panel de depuración.
+
+    Llamar al final del script (antes de st.stop()); show_panel=False solo
+    registra el perfil salvo que MUYU_RENDER_PROFILE=1.
+    """
+    finish_render_profile()
+    if not (show_panel or ALWAYS_ON):
+        return
+    with st.sidebar.expander('🛠️ Perfil de render', expanded=False):
+        st.checkbox('Medir cada rerun', key='render_profile_enabled',
+                    help=f'Tiempos por sección en este panel y en {RENDER_LOG_PATH}')
+        report = st.session_state.get('render_profile_last')
+        if not report:
+            st.caption('Activa la medición y vuelve a interactuar con la página.')
+            return
+        st.metric('Rerun', f"{report['total_ms']:.0f} ms")
+        st.caption(f"SQL: {report['sql_count']} consultas, {report['sql_ms']:.0f} ms · "
+                   f"{report['widgets']} widgets, {report['blocks']} bloques, {report['elements']} elementos")
+        if report['sections']:
+            table = pd.DataFrame(report['sections'])
+            table['section'] = ['  ' * depth + name.split(SEPARATOR)[-1]
+                                for depth, name in zip(table['depth'], table['section'])]
+            st.dataframe(table.drop(columns='depth').round(1), use_container_width=True, hide_index=True)
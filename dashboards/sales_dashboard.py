@@ -4,19 +4,19 @@ Permite ver instituciones asignadas y comunicarse con clientes
 """
 
 import streamlit as st
-import sqlite3
 from datetime import datetime, timedelta, date
 import pandas as pd
 import uuid
 import urllib.parse
-import smtplib
-import email.mime.text
-import email.mime.multipart
 
 # ----------------------
 # Database utilities
 # ----------------------
-DB_PATH = "muyu_crm.db"
+from db.aggregates import get_pipeline_aggregates
+from db.alerts import get_stale_lead_alerts, start_alert_scheduler
+from db.connection import get_conn as get_pooled_conn
+from db.email_outbox import enqueue_email, register_smtp_account, start_email_worker
+from dashboards.render_profiler import profile_section, profile_step
 
 # ----------------------
 # Email Configuration (Hardcoded) - Para ventas
@@ -24,8 +24,13 @@ DB_PATH = "muyu_crm.db"
 SALES_EMAIL = "ventas@muyu.com"  # Cambia por el email real de ventas
 SALES_APP_PASSWORD = "tu_contraseña_app"  # Cambia por la contraseña de aplicación real
 
+register_smtp_account('ventas', SALES_EMAIL, SALES_APP_PASSWORD)
+start_email_worker()
+start_alert_scheduler()
+
 def get_conn():
-    return sqlite3.connect(DB_PATH)
+    # Las fechas se leen como texto: tasks.created_at guarda fecha y hora en una columna DATE
+    return get_pooled_conn(parse_types=False)
 
 def now_date():
     return datetime.now().date()
@@ -85,15 +90,20 @@ def get_sales_tasks(username):
     conn = get_conn()
     
     try:
-        # Buscar tareas donde el usuario aparezca en las notas como responsable
+        # Tareas asignadas al usuario o de sus instituciones (dos búsquedas por índice)
         c = conn.cursor()
         c.execute('''
             SELECT t.id, i.name as institucion, t.title, t.due_date, t.done, t.created_at, t.notes
             FROM tasks t 
             LEFT JOIN institutions i ON t.institution_id = i.id
-            WHERE t.notes LIKE ? OR i.assigned_commercial = ?
-            ORDER BY t.due_date ASC
-        ''', (f'%{username}%', username))
+            WHERE t.assignee_username = ?
+            UNION
+            SELECT t.id, i.name as institucion, t.title, t.due_date, t.done, t.created_at, t.notes
+            FROM institutions i
+            JOIN tasks t ON t.institution_id = i.id
+            WHERE i.assigned_commercial = ?
+            ORDER BY due_date ASC
+        ''', (username, username))
         
         task_rows = c.fetchall()
         conn.close()
@@ -115,7 +125,7 @@ def get_sales_tasks(username):
     return tasks
 
 def send_client_email(institution_data, contact_type='rector'):
-    """Enviar email al cliente (rector o contraparte)"""
+    """Encolar email al cliente (rector o contraparte)"""
     try:
         # Validar configuración
         if SALES_EMAIL == "ventas@muyu.com" or SALES_APP_PASSWORD == "tu_contraseña_app":
@@ -134,11 +144,7 @@ def send_client_email(institution_data, contact_type='rector'):
         if not client_email:
             return False, f"❌ No hay email registrado para {client_position}"
         
-        # Configurar mensaje
-        msg = email.mime.multipart.MIMEMultipart()
-        msg['From'] = SALES_EMAIL
-        msg['To'] = client_email
-        msg['Subject'] = f"Seguimiento Comercial - {institution_data['name']}"
+        subject = f"Seguimiento Comercial - {institution_data['name']}"
         
         # Cuerpo HTML del email
         html_body = f"""
@@ -189,22 +195,12 @@ def send_client_email(institution_data, contact_type='rector'):
         </html>
         """
         
-        # Adjuntar cuerpo
-        msg.attach(email.mime.text.MIMEText(html_body, 'html', 'utf-8'))
-        
-        # Enviar
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(SALES_EMAIL, SALES_APP_PASSWORD)
-        server.sendmail(SALES_EMAIL, client_email, msg.as_string())
-        server.quit()
-        
-        return True, f"✅ Email enviado a {client_name} ({client_email})"
+        # Se encola; el worker en segundo plano lo envía con la sesión SMTP de ventas
+        enqueue_email(client_email, subject, html_body, account='ventas')
+        return True, f"📬 Email para {client_name} ({client_email}) en cola de envío"
         
-    except smtplib.SMTPAuthenticationError:
-        return False, "❌ Error de autenticación. Verifica email y contraseña"
     except Exception as e:
-        return False, f"❌ Error al enviar: {str(e)}"
+        return False, f"❌ Error al encolar: {str(e)}"
 
 def create_client_whatsapp(institution_data, contact_type='rector'):
     """Crear mensaje de WhatsApp para cliente"""
@@ -251,7 +247,7 @@ Saludos cordiales,
     except Exception as e:
         return False, f"❌ Error: {str(e)}"
 
-def create_task(institution_id, title, due_date, notes=''):
+def create_task(institution_id, title, due_date, notes='', assignee_username=None, assignee_email=None):
     """Crear una nueva tarea"""
     try:
         conn = get_conn()
@@ -266,9 +262,9 @@ def create_task(institution_id, title, due_date, notes=''):
             due_date_str = str(due_date)
         
         c.execute('''
-            INSERT INTO tasks (id, institution_id, title, due_date, notes, done, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (task_id, institution_id, title, due_date_str, notes, 0, created_at))
+            INSERT INTO tasks (id, institution_id, title, due_date, notes, done, created_at, assignee_username, assignee_email)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (task_id, institution_id, title, due_date_str, notes, 0, created_at, assignee_username, assignee_email))
         
         conn.commit()
         conn.close()
@@ -303,13 +299,13 @@ def render_sales_dashboard(current_user_data=None):
         "📊 Mi Dashboard"
     ])
     
-    with tab1:
+    with tab1, profile_section('Mis Instituciones'):
         show_my_institutions(current_user)
     
-    with tab2:
+    with tab2, profile_section('Mis Tareas'):
         show_my_tasks(current_user)
     
-    with tab3:
+    with tab3, profile_section('Mi Dashboard'):
         show_my_metrics(current_user)
 
 def show_my_institutions(username):
@@ -317,6 +313,7 @@ def show_my_institutions(username):
     st.header('🏢 Mis Instituciones Asignadas')
     
     # Cargar instituciones
+    profile_step('Consulta')
     df = get_sales_institutions(username)
     
     if df.empty:
@@ -345,6 +342,7 @@ def show_my_institutions(username):
     st.markdown("---")
     
     # Mostrar instituciones por etapa
+    profile_step('Kanban')
     stages = ['En cola', 'En Proceso', 'Ganado', 'No interesado']
     cols = st.columns(len(stages))
     
@@ -398,13 +396,11 @@ def show_my_institutions(username):
                         with col1:
                             st.markdown("**👨‍💼 Rector:**")
                             if st.button(f'📧 Email Rector', key=f'email_rector_{row["id"]}', use_container_width=True):
-                                with st.spinner('📧 Enviando email...'):
-                                    success, message = send_client_email(row, 'rector')
-                                    if success:
-                                        st.success(message)
-                                        st.balloons()
-                                    else:
-                                        st.error(message)
+                                success, message = send_client_email(row, 'rector')
+                                if success:
+                                    st.success(message)
+                                else:
+                                    st.error(message)
                             if st.button(f'💬 WhatsApp Rector', key=f'wa_rector_{row["id"]}', use_container_width=True):
                                 success, result = create_client_whatsapp(row, 'rector')
                                 if success:
@@ -416,13 +412,11 @@ def show_my_institutions(username):
                         with col2:
                             st.markdown("**🤝 Contraparte:**")
                             if st.button(f'📧 Email Contraparte', key=f'email_contra_{row["id"]}', use_container_width=True):
-                                with st.spinner('📧 Enviando email...'):
-                                    success, message = send_client_email(row, 'contraparte')
-                                    if success:
-                                        st.success(message)
-                                        st.balloons()
-                                    else:
-                                        st.error(message)
+                                success, message = send_client_email(row, 'contraparte')
+                                if success:
+                                    st.success(message)
+                                else:
+                                    st.error(message)
                             if st.button(f'💬 WhatsApp Contraparte', key=f'wa_contra_{row["id"]}', use_container_width=True):
                                 success, result = create_client_whatsapp(row, 'contraparte')
                                 if success:
@@ -437,6 +431,7 @@ def show_my_tasks(username):
     st.header('📋 Mis Tareas')
     
     # Cargar tareas
+    profile_step('Consulta')
     tasks = get_sales_tasks(username)
     
     if tasks.empty:
@@ -461,6 +456,7 @@ def show_my_tasks(username):
     st.markdown("---")
     
     # Mostrar tareas
+    profile_step('Lista de tareas')
     for idx, row in tasks.iterrows():
         with st.expander(f"{'✅' if row['done'] else '⏳'} {row['title']} - {row['institucion']}", expanded=False):
             
@@ -498,19 +494,24 @@ def show_my_metrics(username):
         st.info('ℹ️ No tienes datos para mostrar métricas')
         return
     
+    # Conteos y sumas desde los agregados materializados del pipeline
+    own_filter = {'assigned_commercial': [username]}
+    stage_rows = get_pipeline_aggregates(group_by=('stage',), filters=own_filter)
+    country_rows = get_pipeline_aggregates(group_by=('pais',), filters=own_filter)
+    
     # Métricas principales
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        total_institutions = len(df)
+        total_institutions = sum(row['lead_count'] for row in stage_rows)
         st.metric("🏢 Instituciones", total_institutions)
     
     with col2:
-        total_value = df['proposal_value'].fillna(0).sum()
+        total_value = sum(row['proposal_value'] for row in stage_rows)
         st.metric("💰 Valor Total", f"${total_value:,.0f}")
     
     with col3:
-        won_count = len(df[df['stage'] == 'Ganado'])
+        won_count = sum(row['lead_count'] for row in stage_rows if row['stage'] == 'Ganado')
         conversion_rate = (won_count / total_institutions * 100) if total_institutions > 0 else 0
         st.metric("📈 Tasa Conversión", f"{conversion_rate:.1f}%")
     
@@ -525,34 +526,29 @@ def show_my_metrics(username):
     
     with col1:
         st.subheader("📊 Distribución por Etapa")
-        if not df.empty:
-            stage_counts = df['stage'].value_counts()
-            st.bar_chart(stage_counts)
+        stage_counts = pd.Series({row['stage']: row['lead_count'] for row in stage_rows if row['stage']})
+        if not stage_counts.empty:
+            st.bar_chart(stage_counts.sort_values(ascending=False))
     
     with col2:
         st.subheader("🌍 Distribución por País")
-        if not df.empty:
-            country_counts = df['pais'].value_counts()
-            st.bar_chart(country_counts)
+        country_counts = pd.Series({row['pais']: row['lead_count'] for row in country_rows if row['pais']})
+        if not country_counts.empty:
+            st.bar_chart(country_counts.sort_values(ascending=False))
     
     # Instituciones próximas a vencer sin contacto
     st.subheader("⚠️ Instituciones que Requieren Seguimiento")
     
-    if not df.empty:
-        # Filtrar instituciones sin contacto reciente (más de 7 días)
-        # Ensure both datetime objects are timezone-naive for proper subtraction
-        current_time = datetime.now()
-        df['last_interaction_dt'] = pd.to_datetime(df['last_interaction']).dt.tz_localize(None)
-        df['days_since_contact'] = (current_time - df['last_interaction_dt']).dt.days
-        stale_institutions = df[df['days_since_contact'] > 7]
+    # Alertas precalculadas por el job de alertas (umbral de días según la etapa)
+    stale_alerts = get_stale_lead_alerts(commercial=username)
+    if stale_alerts:
+        st.warning(f"⚠️ {len(stale_alerts)} instituciones sin contacto por encima del umbral de su etapa")
         
-        if not stale_institutions.empty:
-            st.warning(f"⚠️ {len(stale_institutions)} instituciones sin contacto > 7 días")
-            
-            for idx, row in stale_institutions.iterrows():
-                st.write(f"🏢 **{row['name']}** - Último contacto: {safe_date_display(row['last_interaction'])} ({row['days_since_contact']} días)")
-        else:
-            st.success("✅ Todas las instituciones tienen contacto reciente")
+        for alert in stale_alerts:
+            task_note = " — 📝 tarea de seguimiento creada" if alert['follow_up_task_id'] else ""
+            st.write(f"🏢 **{alert['institution_name']}** - Último contacto: {safe_date_display(alert['last_interaction'])} ({alert['days_since_contact']} días){task_note}")
+    else:
+        st.success("✅ Todas las instituciones tienen contacto reciente")
 
 # Función principal exportada para app1.py
 def show_sales_dashboard():
@@ -0,0 +1,59 @@
+"""
+Carga masiva de instituciones en streaming (compartida por el panel de
+admin y el de soporte): lee, valida e inserta el archivo por bloques con
+db.bulk_import.stream_import_institutions, sin vista previa completa.
+"""
+
+import streamlit as st
+
+from db.bulk_import import stream_import_institutions
+
+# Tamaño a partir del cual se sugiere la carga en streaming
+STREAMING_SUGGESTED_BYTES = 20 * 1024 * 1024
+
+def show_streaming_import(uploaded_file):
+    """Carga masiva en streaming: lee, valida e inserta el archivo por bloques"""
+    size_mb = uploaded_file.size / (1024 * 1024)
+    st.info(f"**Archivo:** {uploaded_file.name} | **Tamaño:** {size_mb:.1f} MB — se procesará por bloques, sin vista previa completa")
+    if uploaded_file.name.lower().endswith('.xls'):
+        st.warning("⚠️ Los archivos .xls no se pueden leer en streaming; se cargarán completos. Guarda el archivo como .xlsx o .csv para archivos muy grandes.")
+    
+    if not st.button("🚀 Procesar en modo streaming", type="primary"):
+        return
+    
+    progress_bar = st.progress(0)
+    status = st.empty()
+    
+    def on_progress(bytes_read, total_bytes, summary):
+        if total_bytes:
+            progress_bar.progress(min(bytes_read / total_bytes, 1.0))
+        status.caption(
+            f"📥 {bytes_read / (1024 * 1024):.1f} de {size_mb:.1f} MB leídos | "
+            f"{summary['inserted']} cargadas | {summary['error_count']} errores"
+        )
+    
+    try:
+        uploaded_file.seek(0)
+        summary = stream_import_institutions(
+            uploaded_file, uploaded_file.name,
+            total_bytes=uploaded_file.size, progress_callback=on_progress
+        )
+    except Exception as e:
+        st.error(f"❌ Error al procesar el archivo: {str(e)}")
+        st.info("💡 Verifica que el archivo no esté corrupto y tenga el formato correcto.")
+        return
+    
+    st.success("✅ Proceso completado!")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("✅ Instituciones cargadas", summary['inserted'])
+    col2.metric("❌ Errores", summary['error_count'])
+    col3.metric("⏭️ Filas sin nombre omitidas", summary['skipped'])
+    col4.metric("⚠️ Con valores por defecto", summary['defaults_count'])
+    
+    if summary['errors']:
+        with st.expander(f"❌ Detalle de errores ({summary['error_count']})"):
+            for row_number, message in summary['errors']:
+                st.error(f"Fila {row_number}: {message}")
+            if summary['error_count'] > len(summary['errors']):
+                st.caption(f"Se muestran los primeros {len(summary['errors'])} errores.")
+    st.info("🔄 Recarga la página para ver las nuevas instituciones en el sistema.")
@@ -0,0 +1 @@
+# Capa de acceso a datos compartida de Muyu CRM
@@ -0,0 +1,162 @@
+"""
+Agregados materializados del pipeline de ventas.
+
+pipeline_aggregates guarda, por (etapa, comercial, país, medio), el número
+de leads, la suma de propuestas, el valor potencial (docentes x pensión) y
+los días en pipeline (last_interaction - created_contact). Los triggers
+creados por la migración 4 la actualizan de forma incremental en cada
+INSERT/UPDATE/DELETE de institutions, así que los dashboards leen
+O(grupos) filas en lugar de recorrer todas las instituciones.
+
+Los valores NULL de las columnas clave se guardan como '' (forman parte
+de la clave primaria) y se devuelven como None.
+"""
+
+from db.connection import get_conn
+
+# Clave pública -> columna de institutions
+AGGREGATE_KEYS = {
+    'stage': 'stage',
+    'assigned_commercial': 'assigned_commercial',
+    'pais': 'pais',
+    'medium': 'initial_contact_medium',
+}
+
+# Columnas de institutions que afectan a algún agregado
+_TRACKED_COLUMNS = list(AGGREGATE_KEYS.values()) + [
+    'proposal_value', 'num_teachers', 'avg_fee', 'created_contact', 'last_interaction'
+]
+
+
+def _key_values(ref):
+    return [f"COALESCE({ref}.{column}, '')" for column in AGGREGATE_KEYS.values()]
+
+
+def _measure_values(ref):
+    days = f"CAST(julianday({ref}.last_interaction) - julianday({ref}.created_contact) AS INTEGER)"
+    return [
+        '1',
+        f"COALESCE({ref}.proposal_value, 0)",
+        f"COALESCE({ref}.num_teachers, 0) * COALESCE({ref}.avg_fee, 0)",
+        f"COALESCE({days}, 0)",
+        f"({days} IS NOT NULL)",
+    ]
+
+
+_MEASURES = ['lead_count', 'proposal_value_sum', 'potential_value_sum', 'pipeline_days_sum', 'pipeline_days_count']
+
+
+def _add_statement(ref):
+    columns = ', '.join(list(AGGREGATE_KEYS) + _MEASURES)
+    values = ', '.join(_key_values(ref) + _measure_values(ref))
+    updates = ', '.join(f"{m} = {m} + excluded.{m}" for m in _MEASURES)
+    return (f"INSERT INTO pipeline_aggregates ({columns}) VALUES ({values}) "
+            f"ON CONFLICT({', '.join(AGGREGATE_KEYS)}) DO UPDATE SET {updates};")
+
+
+def _subtract_statements(ref):
+    key_match = ' AND '.join(f"{key} = {value}" for key, value in zip(AGGREGATE_KEYS, _key_values(ref)))
+    updates = ', '.join(f"{m} = {m} - {value}" for m, value in zip(_MEASURES, _measure_values(ref)))
+    return (f"UPDATE pipeline_aggregates SET {updates} WHERE {key_match};\n"
+            f"DELETE FROM pipeline_aggregates WHERE {key_match} AND lead_count <= 0;")
+
+
+def create_pipeline_aggregates(conn):
+    """Crear la tabla de agregados y los triggers que la mantienen (idempotente)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pipeline_aggregates (
+            stage TEXT NOT NULL,
+            assigned_commercial TEXT NOT NULL,
+            pais TEXT NOT NULL,
+            medium TEXT NOT NULL,
+            lead_count INTEGER NOT NULL DEFAULT 0,
+            proposal_value_sum REAL NOT NULL DEFAULT 0,
+            potential_value_sum REAL NOT NULL DEFAULT 0,
+            pipeline_days_sum INTEGER NOT NULL DEFAULT 0,
+            pipeline_days_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (stage, assigned_commercial, pais, medium)
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS institutions_aggregates_ai AFTER INSERT ON institutions BEGIN
+            {_add_statement('new')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS institutions_aggregates_ad AFTER DELETE ON institutions BEGIN
+            {_subtract_statements('old')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS institutions_aggregates_au
+        AFTER UPDATE OF {', '.join(_TRACKED_COLUMNS)} ON institutions BEGIN
+            {_subtract_statements('old')}
+            {_add_statement('new')}
+        END
+    ''')
+
+
+def rebuild_pipeline_aggregates(conn=None):
+    """Recalcular todos los agregados desde institutions (carga inicial o reparación)"""
+    own_transaction = conn is None
+    conn = conn or get_conn()
+    create_pipeline_aggregates(conn)
+    conn.execute('DELETE FROM pipeline_aggregates')
+    keys = _key_values('i')
+    measures = ', '.join(f"SUM({value})" for value in _measure_values('i'))
+    conn.execute(f'''
+        INSERT INTO pipeline_aggregates ({', '.join(list(AGGREGATE_KEYS) + _MEASURES)})
+        SELECT {', '.join(keys)}, {measures}
+        FROM institutions i
+        GROUP BY {', '.join(keys)}
+    ''')
+    if own_transaction:
+        conn.commit()
+
+
+def get_pipeline_aggregates(group_by=('stage',), filters=None, conn=None):
+    """Agregados del pipeline agrupados por las claves indicadas.
+
+    Args:
+        group_by: claves de AGGREGATE_KEYS por las que agrupar (vacío = total).
+        filters: {clave: lista de valores} para restringir los grupos.
+
+    Returns:
+        Lista de dicts con las claves agrupadas más lead_count,
+        proposal_value, potential_value y avg_pipeline_days.
+    """
+    group_by = list(group_by)
+    unknown = [key for key in group_by + list(filters or {}) if key not in AGGREGATE_KEYS]
+    if unknown:
+        raise ValueError(f"Claves de agregación no válidas: {unknown}")
+
+    conditions = []
+    params = []
+    for key, values in (filters or {}).items():
+        if values:
+            conditions.append(f"{key} IN ({','.join('?' * len(values))})")
+            params.extend('' if value is None else value for value in values)
+
+    query = f'''
+        SELECT {''.join(f'{key}, ' for key in group_by)}
+               SUM(lead_count) AS lead_count,
+               SUM(proposal_value_sum) AS proposal_value,
+               SUM(potential_value_sum) AS potential_value,
+               SUM(pipeline_days_sum) * 1.0 / NULLIF(SUM(pipeline_days_count), 0) AS avg_pipeline_days
+        FROM pipeline_aggregates
+    '''
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    if group_by:
+        query += f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}"
+
+    conn = conn or get_conn()
+    cursor = conn.execute(query, params)
+    columns = [description[0] for description in cursor.description]
+    results = []
+    for row in cursor.fetchall():
+        record = {column: (None if column in AGGREGATE_KEYS and value == '' else value)
+                  for column, value in zip(columns, row)}
+        if record['lead_count']:  # Total sin grupos devuelve una fila NULL si no hay datos
+            results.append(record)
+    return results
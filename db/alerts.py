@@ -0,0 +1,281 @@
+"""
+Alertas precalculadas de leads sin contacto.
+
+Un único job (refresh_stale_lead_alerts) calcula qué instituciones llevan
+más días sin contacto que el umbral de su etapa (stale_lead_thresholds) y
+guarda el resultado en stale_lead_alerts, indexada por comercial. Los
+dashboards solo leen esa tabla. El job lo ejecuta periódicamente un hilo
+en segundo plano (start_alert_scheduler) y, para las etapas que lo tienen
+activado, crea en lote las tareas de seguimiento que falten.
+"""
+
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from db.connection import get_conn
+from db.data_version import get_data_version
+
+DEFAULT_STALE_DAYS = 7
+REFRESH_SECONDS = 15 * 60
+VERSION_CHECK_SECONDS = 60    # Cada cuánto se mira si institutions cambió
+FOLLOW_UP_TITLE = 'Seguimiento - Lead sin contacto >{days}d'
+
+logger = logging.getLogger(__name__)
+
+# Umbrales iniciales: (días sin contacto, crear tarea de seguimiento automáticamente)
+DEFAULT_THRESHOLDS = {
+    'En cola': (DEFAULT_STALE_DAYS, 1),
+    'En Proceso': (DEFAULT_STALE_DAYS, 1),
+    'Ganado': (DEFAULT_STALE_DAYS, 0),
+    'No interesado': (DEFAULT_STALE_DAYS, 0),
+}
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_refresh_now = threading.Event()
+
+
+def create_alert_tables(conn):
+    """Crear umbrales, tabla de alertas y registro de ejecuciones (idempotente)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stale_lead_thresholds (
+            stage TEXT PRIMARY KEY,
+            max_days INTEGER,
+            auto_follow_up INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.executemany(
+        'INSERT OR IGNORE INTO stale_lead_thresholds (stage, max_days, auto_follow_up) VALUES (?, ?, ?)',
+        [(stage, days, auto) for stage, (days, auto) in DEFAULT_THRESHOLDS.items()]
+    )
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stale_lead_alerts (
+            institution_id TEXT PRIMARY KEY,
+            institution_name TEXT,
+            stage TEXT,
+            assigned_commercial TEXT,
+            last_interaction TEXT,
+            days_since_contact INTEGER NOT NULL,
+            threshold_days INTEGER NOT NULL,
+            follow_up_task_id TEXT,
+            computed_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stale_alerts_commercial '
+                 'ON stale_lead_alerts(assigned_commercial, days_since_contact DESC)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stale_alerts_days ON stale_lead_alerts(days_since_contact DESC)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS alert_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            finished_at TEXT NOT NULL,
+            alerts INTEGER NOT NULL,
+            tasks_created INTEGER NOT NULL
+        )
+    ''')
+
+
+def get_stale_thresholds(conn=None):
+    """{etapa: (días, crear tarea automática)}; días None = etapa sin alertas"""
+    conn = conn or get_conn()
+    rows = conn.execute('SELECT stage, max_days, auto_follow_up FROM stale_lead_thresholds ORDER BY stage')
+    return {stage: (max_days, bool(auto)) for stage, max_days, auto in rows}
+
+
+def set_stale_threshold(stage, max_days, auto_follow_up=False, conn=None):
+    """Guardar el umbral de una etapa y recalcular las alertas en segundo plano"""
+    conn = conn or get_conn()
+    conn.execute('''
+        INSERT INTO stale_lead_thresholds (stage, max_days, auto_follow_up) VALUES (?, ?, ?)
+        ON CONFLICT(stage) DO UPDATE SET max_days = excluded.max_days, auto_follow_up = excluded.auto_follow_up
+    ''', (stage, max_days, int(bool(auto_follow_up))))
+    conn.commit()
+    request_alert_refresh()
+
+
+def refresh_stale_lead_alerts(conn=None, now=None, create_tasks=True):
+    """Recalcular stale_lead_alerts y crear las tareas de seguimiento pendientes.
+
+    Returns:
+        (número de alertas, tareas creadas)
+    """
+    conn = conn or get_conn()
+    now = now or datetime.now()
+    now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+    # Sello único de esta ejecución para borrar después las alertas que ya no aplican
+    run_stamp = now.strftime('%Y-%m-%d %H:%M:%S.%f')
+    contact = 'COALESCE(i.last_interaction, i.created_contact)'
+
+    try:
+        # Las alertas que siguen vigentes conservan su tarea de seguimiento
+        conn.execute(f'''
+            INSERT INTO stale_lead_alerts (institution_id, institution_name, stage, assigned_commercial,
+                                           last_interaction, days_since_contact, threshold_days, computed_at)
+            SELECT i.id, i.name, i.stage, i.assigned_commercial, {contact},
+                   CAST(julianday(?) - julianday({contact}) AS INTEGER),
+                   COALESCE(t.max_days, ?), ?
+            FROM institutions i
+            LEFT JOIN stale_lead_thresholds t ON t.stage = i.stage
+            WHERE julianday({contact}) IS NOT NULL
+              AND (t.stage IS NULL OR t.max_days IS NOT NULL)
+              AND julianday(?) - julianday({contact}) > COALESCE(t.max_days, ?)
+            ON CONFLICT(institution_id) DO UPDATE SET
+                institution_name = excluded.institution_name,
+                stage = excluded.stage,
+                assigned_commercial = excluded.assigned_commercial,
+                last_interaction = excluded.last_interaction,
+                days_since_contact = excluded.days_since_contact,
+                threshold_days = excluded.threshold_days,
+                computed_at = excluded.computed_at
+        ''', (now_str, DEFAULT_STALE_DAYS, run_stamp, now_str, DEFAULT_STALE_DAYS))
+        conn.execute('DELETE FROM stale_lead_alerts WHERE computed_at != ?', (run_stamp,))
+
+        tasks_created = create_follow_up_tasks(conn, auto_only=True, now=now) if create_tasks else 0
+        alerts = conn.execute('SELECT COUNT(*) FROM stale_lead_alerts').fetchone()[0]
+        conn.execute('INSERT INTO alert_runs (finished_at, alerts, tasks_created) VALUES (?, ?, ?)',
+                     (now_str, alerts, tasks_created))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return alerts, tasks_created
+
+
+def create_follow_up_tasks(conn=None, auto_only=False, commercial=None, now=None):
+    """Crear en lote una tarea de seguimiento por alerta que aún no la tenga.
+
+    Args:
+        auto_only: solo las etapas con creación automática activada y
+            leads con comercial asignado.
+        commercial: limitar a las alertas de un comercial.
+    """
+    own_transaction = conn is None
+    conn = conn or get_conn()
+    now = now or datetime.now()
+
+    conditions = ['a.follow_up_task_id IS NULL']
+    params = []
+    if auto_only:
+        # Automáticamente solo para leads con comercial asignado (alguien que haga la tarea)
+        conditions.append("t.auto_follow_up = 1 AND COALESCE(a.assigned_commercial, '') != ''")
+    if commercial is not None:
+        conditions.append('a.assigned_commercial = ?')
+        params.append(commercial)
+    pending = conn.execute(f'''
+        SELECT a.institution_id, a.threshold_days, a.assigned_commercial, u.email
+        FROM stale_lead_alerts a
+        LEFT JOIN stale_lead_thresholds t ON t.stage = a.stage
+        LEFT JOIN users u ON u.username = a.assigned_commercial
+        WHERE {' AND '.join(conditions)}
+    ''', params).fetchall()
+    if not pending:
+        return 0
+
+    created_at = now.strftime('%Y-%m-%d %H:%M:%S')
+    due_date = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+    tasks = [(str(uuid.uuid4()), institution_id, FOLLOW_UP_TITLE.format(days=threshold_days), due_date,
+              'Generado desde alerta', 0, created_at, commercial_user or None, email)
+             for institution_id, threshold_days, commercial_user, email in pending]
+    conn.executemany('''
+        INSERT INTO tasks (id, institution_id, title, due_date, notes, done, created_at, assignee_username, assignee_email)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', tasks)
+    conn.executemany('UPDATE stale_lead_alerts SET follow_up_task_id = ? WHERE institution_id = ?',
+                     [(task[0], task[1]) for task in tasks])
+    if own_transaction:
+        conn.commit()
+    return len(tasks)
+
+
+def get_stale_lead_alerts(commercial=None, limit=None, conn=None):
+    """Alertas vigentes (todas o de un comercial), de la más antigua a la más reciente"""
+    conn = conn or get_conn()
+    query = '''
+        SELECT institution_id, institution_name, stage, assigned_commercial, last_interaction,
+               days_since_contact, threshold_days, follow_up_task_id
+        FROM stale_lead_alerts
+    '''
+    params = []
+    if commercial is not None:
+        query += ' WHERE assigned_commercial = ?'
+        params.append(commercial)
+    query += ' ORDER BY days_since_contact DESC'
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+    cursor = conn.execute(query, params)
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def get_stale_alert_summary(conn=None):
+    """Número de alertas y de tareas de seguimiento por comercial"""
+    conn = conn or get_conn()
+    rows = conn.execute('''
+        SELECT COALESCE(assigned_commercial, ''), COUNT(*), COUNT(follow_up_task_id)
+        FROM stale_lead_alerts GROUP BY assigned_commercial ORDER BY COUNT(*) DESC
+    ''')
+    return [{'assigned_commercial': commercial or None, 'alerts': alerts, 'with_task': with_task}
+            for commercial, alerts, with_task in rows]
+
+
+def get_last_alert_run(conn=None):
+    """Fecha de la última ejecución del job (None si nunca se ejecutó)"""
+    conn = conn or get_conn()
+    row = conn.execute('SELECT finished_at FROM alert_runs ORDER BY id DESC LIMIT 1').fetchone()
+    return row[0] if row else None
+
+
+class AlertScheduler(threading.Thread):
+    """Hilo que recalcula las alertas cada `interval` segundos, o antes si
+    cambia la versión de datos de institutions o se pide explícitamente"""
+
+    def __init__(self, interval=REFRESH_SECONDS):
+        super().__init__(name='stale-alerts-scheduler', daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+        _refresh_now.set()
+
+    def run(self):
+        last_version = None
+        last_refresh = None
+        while not self.stop_event.is_set():
+            try:
+                version = get_data_version('institutions')
+                due = last_refresh is None or (datetime.now() - last_refresh).total_seconds() >= self.interval
+                if due or version != last_version or _refresh_now.is_set():
+                    _refresh_now.clear()
+                    refresh_stale_lead_alerts()
+                    last_version, last_refresh = version, datetime.now()
+            except Exception:
+                # Tablas aún sin migrar o base ocupada: se registra y se reintenta en la siguiente vuelta
+                logger.exception('Error al recalcular las alertas de leads sin contacto')
+            _refresh_now.wait(min(VERSION_CHECK_SECONDS, self.interval))
+
+
+def request_alert_refresh():
+    """Pedir al scheduler que recalcule las alertas sin esperar al intervalo"""
+    _refresh_now.set()
+
+
+def start_alert_scheduler(interval=REFRESH_SECONDS):
+    """Arrancar el job periódico de alertas si no está en marcha (idempotente)"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = AlertScheduler(interval)
+            _scheduler.start()
+    return _scheduler
+
+
+def stop_alert_scheduler(timeout=None):
+    global _scheduler
+    with _scheduler_lock:
+        scheduler, _scheduler = _scheduler, None
+    if scheduler is not None:
+        scheduler.stop()
+        scheduler.join(timeout)
@@ -0,0 +1,189 @@
+"""
+Backups de los datos de leads (institutions, interactions, tasks, admin_alerts).
+
+- Completo: cada tabla se escribe fila a fila desde el cursor a su entrada
+  CSV dentro del ZIP, en bloques de FETCH_BATCH filas, sin DataFrames.
+- Incremental: solo las filas cambiadas desde la última marca de agua
+  (watermark). Los cambios se registran en change_log mediante triggers
+  (migración 5); las filas borradas van en deleted.csv.
+- Binario: copia compacta con la API de backup en línea de SQLite, sin la
+  tabla de usuarios.
+"""
+
+import csv
+import io
+import sqlite3
+import zipfile
+from datetime import datetime
+
+from db.connection import get_conn
+
+BACKUP_TABLES = ['institutions', 'interactions', 'tasks', 'admin_alerts']
+FETCH_BATCH = 1000
+
+
+def create_change_log(conn):
+    """Crear change_log, backup_runs y los triggers de seguimiento (idempotente)"""
+    # admin_alerts la crea el dashboard de admin; se asegura aquí para poder ponerle triggers
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS admin_alerts (
+            id TEXT PRIMARY KEY,
+            institution_id TEXT,
+            institution_name TEXT,
+            changed_by TEXT,
+            change_type TEXT,
+            old_value TEXT,
+            new_value TEXT,
+            change_date TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id TEXT NOT NULL,
+            operation TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_change_log_table_seq ON change_log(table_name, seq)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS backup_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            last_seq INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    for table in BACKUP_TABLES:
+        for event, ref in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_change_log_{event.lower()}
+                AFTER {event} ON {table} BEGIN
+                    INSERT INTO change_log (table_name, row_id, operation)
+                    VALUES ('{table}', {ref}.id, '{event}');
+                END
+            ''')
+
+
+def get_current_change_seq(conn=None):
+    """Último número de secuencia registrado en change_log"""
+    conn = conn or get_conn()
+    row = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()
+    return row[0]
+
+
+def get_backup_watermark(conn=None):
+    """Secuencia cubierta por el último backup descargado (0 si no hay ninguno)"""
+    conn = conn or get_conn()
+    row = conn.execute('SELECT COALESCE(MAX(last_seq), 0) FROM backup_runs').fetchone()
+    return row[0]
+
+
+def record_backup_watermark(last_seq, kind, conn=None):
+    """Registrar que se descargó un backup hasta last_seq.
+
+    Tras un backup completo (ZIP o binario) ya no hacen falta las entradas
+    anteriores del change_log, así que se eliminan.
+    """
+    conn = conn or get_conn()
+    conn.execute(
+        'INSERT INTO backup_runs (kind, last_seq, created_at) VALUES (?, ?, ?)',
+        (kind, last_seq, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    if kind in ('completo', 'binario'):
+        conn.execute('DELETE FROM change_log WHERE seq <= ?', (last_seq,))
+    conn.commit()
+
+
+def _write_cursor_csv(zf, entry_name, cursor):
+    """Escribir el resultado de un cursor como CSV dentro del ZIP, por bloques"""
+    rows_written = 0
+    with zf.open(entry_name, 'w') as raw:
+        with io.TextIOWrapper(raw, encoding='utf-8', newline='') as text:
+            writer = csv.writer(text)
+            writer.writerow([description[0] for description in cursor.description])
+            while True:
+                batch = cursor.fetchmany(FETCH_BATCH)
+                if not batch:
+                    break
+                writer.writerows(tuple(row) for row in batch)
+                rows_written += len(batch)
+    return rows_written
+
+
+def write_leads_backup_zip(target, since_seq=None, conn=None):
+    """Escribir el backup de leads en `target` (ruta o archivo binario).
+
+    Args:
+        since_seq: None para un backup completo; si se indica, solo se
+            exportan las filas cambiadas con seq > since_seq.
+
+    Returns:
+        dict con las filas exportadas por tabla, 'deleted' y 'last_seq'
+        (la nueva marca de agua a registrar cuando se descargue).
+    """
+    # Conexión sin conversión de tipos: se exporta el valor tal como está guardado
+    conn = conn or get_conn(parse_types=False)
+    stats = {}
+
+    if conn.in_transaction:
+        conn.commit()
+    # Una única transacción de lectura: todas las tablas salen del mismo instante
+    conn.execute('BEGIN')
+    try:
+        last_seq = get_current_change_seq(conn)
+        with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for table in BACKUP_TABLES:
+                try:
+                    if since_seq is None:
+                        cursor = conn.execute(f'SELECT * FROM {table}')
+                    else:
+                        cursor = conn.execute(f'''
+                            SELECT * FROM {table} WHERE id IN (
+                                SELECT row_id FROM change_log
+                                WHERE table_name = ? AND seq > ? AND seq <= ?
+                            )
+                        ''', (table, since_seq, last_seq))
+                except sqlite3.OperationalError:
+                    # La tabla no existe en esta base de datos
+                    zf.writestr(f"{table}.csv", f"# No se pudo exportar {table}\n")
+                    stats[table] = 0
+                    continue
+                stats[table] = _write_cursor_csv(zf, f"{table}.csv", cursor)
+
+            if since_seq is not None:
+                deleted_cursor = conn.execute('''
+                    SELECT table_name, row_id, MAX(seq) AS seq FROM change_log
+                    WHERE operation = 'DELETE' AND seq > ? AND seq <= ?
+                    GROUP BY table_name, row_id
+                ''', (since_seq, last_seq))
+                stats['deleted'] = _write_cursor_csv(zf, 'deleted.csv', deleted_cursor)
+    finally:
+        conn.rollback()
+
+    stats['last_seq'] = last_seq
+    return stats
+
+
+def create_binary_backup(target_path, db_conn=None):
+    """Copia binaria de la base con la API de backup de SQLite.
+
+    La copia excluye la tabla users (contraseñas) y se compacta con VACUUM.
+    Devuelve la marca de agua incluida en la copia.
+    """
+    source = db_conn or get_conn(parse_types=False)
+    if source.in_transaction:
+        source.commit()
+    last_seq = get_current_change_seq(source)
+
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+        # La copia hereda el modo WAL del origen; se deja como archivo único
+        target.execute('PRAGMA journal_mode = DELETE')
+        target.execute('DROP TABLE IF EXISTS users')
+        target.commit()
+        target.execute('VACUUM')
+    finally:
+        target.close()
+    return last_seq
@@ -0,0 +1,359 @@
+"""
+Motor de carga masiva de instituciones (Excel/CSV).
+
+Normaliza todas las columnas con operaciones vectorizadas de pandas y
+las inserta por bloques con executemany dentro de una única transacción,
+reportando las filas con error sin abortar el resto de la carga.
+"""
+
+import sqlite3
+import uuid
+from datetime import date
+
+import pandas as pd
+
+from db.connection import get_conn
+
+# Orden de columnas del INSERT (mismo que save_institution)
+INSTITUTION_COLUMNS = [
+    'id', 'name', 'rector_name', 'rector_email', 'rector_phone',
+    'contraparte_name', 'contraparte_email', 'contraparte_phone',
+    'website', 'pais', 'ciudad', 'direccion', 'created_contact', 'last_interaction',
+    'num_teachers', 'num_students', 'avg_fee', 'initial_contact_medium',
+    'stage', 'substage', 'program_proposed', 'proposal_value',
+    'contract_start_date', 'contract_end_date', 'observations',
+    'assigned_commercial', 'no_interest_reason',
+]
+
+# Contactos obligatorios: valor temporal si faltan (se reportan como "valores por defecto")
+CONTACT_DEFAULTS = {
+    'rector_name': 'Rector Sin Definir',
+    'rector_email': 'rector-sin-email@temp.com',
+    'rector_phone': '+593 000000000',
+    'contraparte_name': 'Contraparte Sin Definir',
+    'contraparte_email': 'contraparte-sin-email@temp.com',
+    'contraparte_phone': '+593 000000000',
+}
+
+TEXT_DEFAULTS = {
+    'website': '',
+    'pais': 'Ecuador',
+    'ciudad': '',
+    'direccion': '',
+    'initial_contact_medium': 'Whatsapp',
+    'stage': 'En cola',
+    'substage': 'Primera reunión',
+    'program_proposed': 'Demo',
+    'observations': '',
+    'assigned_commercial': '',
+}
+
+INTEGER_COLUMNS = ['num_teachers', 'num_students']
+DECIMAL_COLUMNS = ['avg_fee', 'proposal_value']
+DATE_COLUMNS = ['contract_start_date', 'contract_end_date']
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def _column(df, name):
+    """Columna del archivo o una serie vacía si no existe"""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(pd.NA, index=df.index, dtype='object')
+
+
+def _as_text(series):
+    """Texto sin espacios; NaN/vacíos -> NA. Los floats enteros de Excel pierden el '.0'"""
+    if pd.api.types.is_float_dtype(series):
+        non_null = series.dropna()
+        if not non_null.empty and (non_null == non_null.round()).all():
+            series = series.astype('Int64')
+    text = series.astype('string').str.strip()
+    return text.mask((text == '').fillna(False))
+
+
+def _as_number(series):
+    """Número con coma o punto decimal; lo que no se pueda convertir queda NaN"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    text = series.astype('string').str.strip().str.replace(',', '.', regex=False)
+    return pd.to_numeric(text.mask((text == '').fillna(False)).astype('object'), errors='coerce')
+
+
+def normalize_institutions_frame(df, today=None):
+    """Convertir el archivo subido en filas listas para insertar.
+
+    Args:
+        df: DataFrame leído del Excel/CSV (el índice se usa para numerar filas).
+        today: fecha para created_contact/last_interaction (por defecto hoy).
+
+    Returns:
+        (normalized, errors, defaults_used) donde normalized tiene las
+        columnas INSTITUTION_COLUMNS, errors es una lista de
+        (fila, mensaje) de las filas descartadas y defaults_used una lista
+        de (fila, nombre, [columnas con valor temporal]).
+    """
+    today = str(today or date.today())
+    # Número de fila en la hoja: encabezado + índice base 0
+    row_numbers = pd.Series(df.index, index=df.index) + 2
+    normalized = pd.DataFrame(index=df.index)
+    problems = pd.Series('', index=df.index, dtype='object')
+
+    normalized['name'] = _as_text(_column(df, 'name'))
+    problems = problems.mask(normalized['name'].isna(), 'la institución no tiene nombre')
+
+    defaults_mask = pd.DataFrame(index=df.index)
+    for col, default in CONTACT_DEFAULTS.items():
+        values = _as_text(_column(df, col))
+        defaults_mask[col] = values.isna()
+        normalized[col] = values.fillna(default)
+
+    for col, default in TEXT_DEFAULTS.items():
+        normalized[col] = _as_text(_column(df, col)).fillna(default)
+
+    for col in INTEGER_COLUMNS:
+        # Valores no numéricos o negativos se cargan como 0 (igual que antes)
+        numbers = _as_number(_column(df, col))
+        normalized[col] = numbers.where(numbers >= 0, 0).fillna(0).astype(int)
+
+    for col in DECIMAL_COLUMNS:
+        raw = _as_text(_column(df, col))
+        numbers = _as_number(_column(df, col))
+        invalid = raw.notna() & numbers.isna()
+        problems = problems.mask(invalid & (problems == ''), f"valor no numérico en {col}: " + raw.fillna(''))
+        normalized[col] = numbers.fillna(0.0)
+
+    for col in DATE_COLUMNS:
+        text = _as_text(_column(df, col).astype('object'))
+        # Se parsea cada valor distinto una sola vez (admite formatos mezclados)
+        parsed_values = {value: pd.to_datetime(value, errors='coerce') for value in text.dropna().unique()}
+        parsed = pd.to_datetime(text.astype('object').map(parsed_values), errors='coerce')
+        invalid = text.notna() & parsed.isna()
+        problems = problems.mask(invalid & (problems == ''), f"fecha no válida en {col}: " + text.fillna(''))
+        normalized[col] = parsed.dt.strftime('%Y-%m-%d').astype('object').where(parsed.notna(), None)
+
+    normalized['created_contact'] = today
+    normalized['last_interaction'] = today
+    normalized['no_interest_reason'] = None
+    normalized['id'] = [str(uuid.uuid4()) for _ in range(len(normalized))]
+
+    failed = problems != ''
+    errors = list(zip(row_numbers[failed].tolist(), problems[failed].astype(str).tolist()))
+
+    ok = normalized[~failed]
+    used = defaults_mask[~failed]
+    has_defaults = used.any(axis=1)
+    defaults_used = [
+        (int(row_numbers[idx]), str(ok.at[idx, 'name']), [col for col in CONTACT_DEFAULTS if used.at[idx, col]])
+        for idx in used.index[has_defaults]
+    ]
+
+    ok = ok[INSTITUTION_COLUMNS].astype('object').where(ok[INSTITUTION_COLUMNS].notna(), None)
+    return ok, errors, defaults_used
+
+
+def insert_institution_rows(rows, row_numbers, conn=None, chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None):
+    """Insertar tuplas (en el orden de INSTITUTION_COLUMNS) en una sola transacción.
+
+    Si una fila falla solo se descarta esa fila: executemany consume los
+    parámetros de forma perezosa, así que la última fila entregada es la que
+    produjo el error y la carga continúa desde la siguiente.
+
+    Returns:
+        (insertadas, [(fila, mensaje)]) con las filas rechazadas por la base.
+    """
+    conn = conn or get_conn()
+    insert_sql = (
+        f"INSERT OR REPLACE INTO institutions ({', '.join(INSTITUTION_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(INSTITUTION_COLUMNS))})"
+    )
+    inserted = 0
+    errors = []
+    total = len(rows)
+
+    def params_from(position, end, current):
+        for index in range(position, end):
+            current[0] = index
+            yield rows[index]
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN')
+    try:
+        for start in range(0, total, chunk_size):
+            end = min(start + chunk_size, total)
+            position = start
+            while position < end:
+                current = [position]
+                try:
+                    conn.executemany(insert_sql, params_from(position, end, current))
+                    inserted += end - position
+                    position = end
+                except sqlite3.Error as e:
+                    # Las filas anteriores a la fallida ya quedaron insertadas
+                    inserted += current[0] - position
+                    errors.append((row_numbers[current[0]], str(e)))
+                    position = current[0] + 1
+            if progress_callback:
+                progress_callback(end, total)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return inserted, errors
+
+
+def import_institutions(df, chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None, conn=None):
+    """Normalizar e insertar un DataFrame de instituciones.
+
+    Args:
+        df: filas del archivo subido.
+        chunk_size: filas por executemany.
+        progress_callback: función (procesadas, total) para la barra de progreso.
+
+    Returns:
+        dict con 'inserted', 'errors' [(fila, mensaje)] ordenados por fila y
+        'defaults_used' [(fila, nombre, columnas)].
+    """
+    normalized, errors, defaults_used = normalize_institutions_frame(df)
+    row_numbers = (pd.Series(normalized.index, index=normalized.index) + 2).tolist()
+    rows = list(normalized.itertuples(index=False, name=None))
+
+    inserted, db_errors = insert_institution_rows(
+        rows, row_numbers, conn=conn, chunk_size=chunk_size, progress_callback=progress_callback
+    )
+    return {
+        'inserted': inserted,
+        'errors': sorted(errors + db_errors),
+        'defaults_used': defaults_used,
+    }
+
+
+# ----------------------
+# Carga en streaming para archivos muy grandes
+# ----------------------
+
+STREAM_CHUNK_ROWS = 5000
+MAX_REPORTED_ROWS = 1000  # Errores/avisos detallados que se conservan (el resto solo se cuenta)
+PREFERRED_SHEET = 'Plantilla_Vacia'
+
+
+def iter_csv_chunks(file, chunk_rows=STREAM_CHUNK_ROWS):
+    """Leer un CSV en bloques de chunk_rows filas (el índice continúa entre bloques)"""
+    yield from pd.read_csv(file, chunksize=chunk_rows)
+
+
+def _xlsx_sheet(workbook):
+    """Hoja a importar: Plantilla_Vacia si tiene filas de datos, si no la primera"""
+    if PREFERRED_SHEET in workbook.sheetnames:
+        sheet = workbook[PREFERRED_SHEET]
+        for values in sheet.iter_rows(min_row=2, max_row=2, values_only=True):
+            if any(value is not None for value in values):
+                return sheet
+    return workbook.worksheets[0]
+
+
+def iter_xlsx_chunks(file, chunk_rows=STREAM_CHUNK_ROWS):
+    """Leer un xlsx fila por fila (openpyxl read-only) en bloques de chunk_rows.
+
+    El índice de cada bloque es la fila de la hoja menos 2, igual que el de
+    un DataFrame leído con pd.read_excel, para numerar los errores igual.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = _xlsx_sheet(workbook).iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(value).strip() if value is not None else f'col_{i}' for i, value in enumerate(header)]
+
+        width = len(columns)
+        buffer, index = [], []
+        for position, values in enumerate(rows):
+            # Las filas de openpyxl pueden venir más cortas que el encabezado
+            buffer.append(tuple(values[:width]) + (None,) * (width - len(values)))
+            index.append(position)
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=columns, index=index)
+                buffer, index = [], []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns, index=index)
+    finally:
+        workbook.close()
+
+
+def iter_upload_chunks(file, file_name, chunk_rows=STREAM_CHUNK_ROWS):
+    """Bloques de un archivo subido según su extensión.
+
+    Los .xls antiguos no se pueden leer en streaming (openpyxl solo soporta
+    xlsx), así que se cargan completos y se entregan por bloques.
+    """
+    name = file_name.lower()
+    if name.endswith('.csv'):
+        return iter_csv_chunks(file, chunk_rows)
+    if name.endswith('.xlsx'):
+        return iter_xlsx_chunks(file, chunk_rows)
+    df = pd.read_excel(file, sheet_name=0)
+    return (df.iloc[start:start + chunk_rows] for start in range(0, len(df), chunk_rows))
+
+
+def _file_position(file):
+    try:
+        return file.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def stream_import_institutions(file, file_name, total_bytes=None, chunk_rows=STREAM_CHUNK_ROWS,
+                               progress_callback=None, conn=None):
+    """Importar un archivo bloque a bloque sin cargarlo entero en memoria.
+
+    Cada bloque se valida, se normaliza y se inserta (en su propia
+    transacción) apenas se lee, así que la memoria depende de chunk_rows y
+    no del tamaño del archivo.
+
+    Args:
+        file: archivo subido (objeto binario con read/seek/tell).
+        file_name: nombre para detectar el formato.
+        total_bytes: tamaño del archivo para el progreso (p. ej. uploaded_file.size).
+        progress_callback: función (bytes_leídos, total_bytes, resumen) llamada tras cada bloque.
+
+    Returns:
+        dict con 'inserted', 'skipped' (filas sin nombre), 'total_rows',
+        'error_count', 'errors' y 'defaults_count', 'defaults_used'
+        (estas listas se limitan a MAX_REPORTED_ROWS entradas).
+    """
+    summary = {
+        'inserted': 0, 'skipped': 0, 'total_rows': 0,
+        'error_count': 0, 'errors': [],
+        'defaults_count': 0, 'defaults_used': [],
+    }
+
+    for chunk in iter_upload_chunks(file, file_name, chunk_rows):
+        chunk = chunk.dropna(how='all')
+        if 'name' not in chunk.columns:
+            raise ValueError("La columna 'name' es obligatoria y no se encuentra en el archivo.")
+
+        named = chunk.dropna(subset=['name'])
+        summary['total_rows'] += len(chunk)
+        summary['skipped'] += len(chunk) - len(named)
+
+        if not named.empty:
+            result = import_institutions(named, chunk_size=DEFAULT_CHUNK_SIZE, conn=conn)
+            summary['inserted'] += result['inserted']
+            summary['error_count'] += len(result['errors'])
+            summary['defaults_count'] += len(result['defaults_used'])
+            room = MAX_REPORTED_ROWS - len(summary['errors'])
+            summary['errors'].extend(result['errors'][:max(room, 0)])
+            room = MAX_REPORTED_ROWS - len(summary['defaults_used'])
+            summary['defaults_used'].extend(result['defaults_used'][:max(room, 0)])
+
+        if progress_callback:
+            position = _file_position(file)
+            progress_callback(position if position is not None else 0, total_bytes, summary)
+
+    if progress_callback and total_bytes:
+        progress_callback(total_bytes, total_bytes, summary)
+    return summary
@@ -0,0 +1,185 @@
+"""
+Campañas de email personalizadas sobre la cola email_outbox.
+
+create_campaign() renderiza el asunto y el cuerpo de cada fila del
+DataFrame (marcadores {columna}) y encola todos los mensajes en una sola
+transacción, uno por destinatario, con campaign_id. El envío lo hace el
+pool de db/email_outbox.py respetando el máximo de envíos por minuto de la
+campaña, así que el formulario de Streamlit vuelve al instante y el estado
+de cada destinatario queda guardado: la campaña se puede pausar, reanudar
+(también tras reiniciar el proceso), cancelar y consultar.
+"""
+
+import html
+import string
+from datetime import datetime
+
+from db.connection import get_conn
+from db.email_outbox import STATUS_PENDING, wake_email_worker
+
+CAMPAIGN_ACTIVE = 'activa'
+CAMPAIGN_PAUSED = 'pausada'
+CAMPAIGN_CANCELLED = 'cancelada'
+STATUS_CANCELLED = 'cancelado'
+
+DEFAULT_MAX_PER_MINUTE = 30
+
+
+def create_campaign_tables(conn):
+    """Crear email_campaigns y enlazar email_outbox con su campaña (idempotente)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_campaigns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            account TEXT NOT NULL,
+            subject_template TEXT NOT NULL,
+            body_template TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'activa',
+            max_per_minute INTEGER NOT NULL,
+            total_recipients INTEGER NOT NULL DEFAULT 0,
+            created_by TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(email_outbox)')}
+    if 'campaign_id' not in columns:
+        conn.execute('ALTER TABLE email_outbox ADD COLUMN campaign_id INTEGER')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_campaign_status ON email_outbox(campaign_id, status)')
+
+
+def template_fields(template):
+    """Nombres de los marcadores {columna} usados en una plantilla"""
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field}
+
+
+def text_to_html(text):
+    """Convertir un mensaje de texto plano en HTML conservando los saltos de línea"""
+    return html.escape(text).replace('\n', '<br>\n')
+
+
+def render_campaign_messages(df, email_column, subject_template, body_template):
+    """Renderizar los mensajes de cada fila.
+
+    Returns:
+        (messages, skipped): lista de (email, asunto, cuerpo HTML) con un
+        mensaje por email distinto, y lista de (fila, motivo) descartadas.
+
+    Raises:
+        ValueError: si las plantillas usan columnas que no existen.
+    """
+    fields = template_fields(subject_template) | template_fields(body_template)
+    missing = sorted(fields - set(map(str, df.columns)))
+    if missing:
+        raise ValueError(f"Columnas no encontradas en la tabla: {', '.join(missing)}")
+    try:
+        sample = {field: '' for field in fields}
+        subject_template.format_map(sample)
+        body_template.format_map(sample)
+    except (IndexError, KeyError, ValueError) as e:
+        raise ValueError(f"Plantilla no válida (usa {{columna}}; para llaves literales {{{{ y }}}}): {e}")
+
+    # Solo se convierten a texto las columnas que usan las plantillas
+    columns = sorted(fields)
+    values = df[[email_column] + columns].copy()
+    values.columns = ['__email__'] + columns
+    values = values.astype(object).where(values.notna(), '').astype(str)
+    values['__email__'] = values['__email__'].str.strip()
+
+    messages = []
+    skipped = []
+    seen = set()
+    for position, record in enumerate(values.to_dict('records')):
+        recipient = record.pop('__email__')
+        if '@' not in recipient or '.' not in recipient.split('@')[-1]:
+            skipped.append((position + 1, f"Email no válido: '{recipient}'"))
+            continue
+        key = recipient.lower()
+        if key in seen:
+            skipped.append((position + 1, f"Email duplicado: {recipient}"))
+            continue
+        seen.add(key)
+        subject = subject_template.format_map(record)
+        body = text_to_html(body_template.format_map(record))
+        messages.append((recipient, subject, body))
+    return messages, skipped
+
+
+def create_campaign(df, email_column, subject_template, body_template, name=None,
+                    account='campanas', max_per_minute=DEFAULT_MAX_PER_MINUTE,
+                    created_by=None, conn=None):
+    """Crear una campaña y encolar todos sus mensajes.
+
+    Returns:
+        (campaign_id, skipped)
+    """
+    messages, skipped = render_campaign_messages(df, email_column, subject_template, body_template)
+    if not messages:
+        return None, skipped
+
+    conn = conn or get_conn()
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        cursor = conn.execute('''
+            INSERT INTO email_campaigns (name, account, subject_template, body_template, status,
+                                         max_per_minute, total_recipients, created_by, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (name or f"Campaña {now}", account, subject_template, body_template, CAMPAIGN_ACTIVE,
+              int(max_per_minute), len(messages), created_by, now))
+        campaign_id = cursor.lastrowid
+        conn.executemany('''
+            INSERT INTO email_outbox (account, recipient, subject, html_body, status,
+                                      next_attempt_at, created_at, campaign_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', ((account, recipient, subject, body, STATUS_PENDING, now, now, campaign_id)
+              for recipient, subject, body in messages))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    wake_email_worker()
+    return campaign_id, skipped
+
+
+def set_campaign_status(campaign_id, status, conn=None):
+    """Pausar (CAMPAIGN_PAUSED) o reanudar (CAMPAIGN_ACTIVE) una campaña"""
+    conn = conn or get_conn()
+    conn.execute('UPDATE email_campaigns SET status = ? WHERE id = ? AND status != ?',
+                 (status, campaign_id, CAMPAIGN_CANCELLED))
+    conn.commit()
+    wake_email_worker()
+
+
+def cancel_campaign(campaign_id, conn=None):
+    """Cancelar una campaña: los mensajes aún pendientes no se enviarán"""
+    conn = conn or get_conn()
+    conn.execute('UPDATE email_campaigns SET status = ? WHERE id = ?', (CAMPAIGN_CANCELLED, campaign_id))
+    conn.execute('UPDATE email_outbox SET status = ? WHERE campaign_id = ? AND status = ?',
+                 (STATUS_CANCELLED, campaign_id, STATUS_PENDING))
+    conn.commit()
+
+
+def get_campaign_report(campaign_id, conn=None):
+    """Resumen de una campaña: datos, conteo por estado y si ya terminó"""
+    conn = conn or get_conn()
+    row = conn.execute('''
+        SELECT id, name, status, max_per_minute, total_recipients, created_at
+        FROM email_campaigns WHERE id = ?
+    ''', (campaign_id,)).fetchone()
+    if row is None:
+        return None
+    report = dict(zip(['id', 'name', 'status', 'max_per_minute', 'total_recipients', 'created_at'], row))
+    counts = {status: count for status, count in conn.execute(
+        'SELECT status, COUNT(*) FROM email_outbox WHERE campaign_id = ? GROUP BY status', (campaign_id,)
+    )}
+    report['counts'] = counts
+    report['finished'] = not counts.get('pendiente') and not counts.get('enviando')
+    return report
+
+
+def list_campaigns(limit=20, conn=None):
+    """Últimas campañas creadas (id, nombre, estado, total, fecha)"""
+    conn = conn or get_conn()
+    return conn.execute('''
+        SELECT id, name, status, total_recipients, created_at
+        FROM email_campaigns ORDER BY id DESC LIMIT ?
+    ''', (limit,)).fetchall()
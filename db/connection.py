@@ -0,0 +1,163 @@
+"""
+Pool de conexiones SQLite compartido por todos los dashboards.
+
+Cada hilo (Streamlit ejecuta cada rerun en su propio hilo) reutiliza una
+única conexión por configuración, así que los helpers que antes abrían y
+cerraban varias conexiones por rerun ya no reconectan ni vuelven a parsear
+el esquema en cada llamada. Sus cursores miden cada consulta
+(db.query_log).
+"""
+
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+from db.query_log import InstrumentedCursor
+
+DB_PATH = "muyu_crm.db"
+
+# PRAGMAs aplicados a cada conexión nueva (se pueden cambiar con configure())
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -20000,       # ~20 MB de caché de páginas
+    "mmap_size": 268435456,     # 256 MB mapeados en memoria
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+# PRAGMAs que configure() no puede cambiar: el índice FTS de institutions
+# (y los agregados del pipeline) se sincronizan con triggers de borrado, que
+# INSERT OR REPLACE solo dispara con recursive_triggers activado
+REQUIRED_PRAGMAS = {
+    "recursive_triggers": "ON",
+}
+
+_settings = {
+    "db_path": DB_PATH,
+    "pragmas": dict(DEFAULT_PRAGMAS),
+}
+_local = threading.local()
+_all_connections = weakref.WeakSet()
+_lock = threading.Lock()
+
+
+class PooledConnection(sqlite3.Connection):
+    """Conexión cuyo close() la devuelve al pool en lugar de cerrarla.
+
+    Igual que un cierre real, descarta cualquier transacción sin commit,
+    de modo que el código existente (conn.commit(); conn.close()) mantiene
+    exactamente la misma semántica.
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        # pd.read_sql_query() también pasa por aquí
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def dispose(self):
+        """Cerrar la conexión de verdad"""
+        super().close()
+
+
+def configure(db_path=None, **pragmas):
+    """Cambiar la ruta de la base de datos y/o los PRAGMAs del pool.
+
+    Cierra las conexiones existentes para que la nueva configuración se
+    aplique en la siguiente llamada a get_conn().
+    """
+    if db_path is not None:
+        _settings["db_path"] = db_path
+    _settings["pragmas"].update(pragmas)
+    close_all()
+
+
+def get_db_path():
+    return _settings["db_path"]
+
+
+def _open_connection(parse_types):
+    detect_types = sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES if parse_types else 0
+    conn = sqlite3.connect(
+        _settings["db_path"],
+        detect_types=detect_types,
+        factory=PooledConnection,
+        cached_statements=256,
+    )
+    conn.row_factory = sqlite3.Row
+    for name, value in {**_settings["pragmas"], **REQUIRED_PRAGMAS}.items():
+        try:
+            conn.execute(f"PRAGMA {name} = {value}")
+        except sqlite3.DatabaseError:
+            pass  # PRAGMA no soportado en esta versión de SQLite
+    return conn
+
+
+def get_conn(parse_types=True):
+    """Obtener la conexión del hilo actual (se crea la primera vez).
+
+    Args:
+        parse_types: si es True convierte columnas DATE/TIMESTAMP con
+            PARSE_DECLTYPES|PARSE_COLNAMES (comportamiento histórico de
+            app1.py). Usar False para leer las fechas como texto.
+    """
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = _local.pool = {}
+
+    key = (_settings["db_path"], bool(parse_types))
+    conn = pool.get(key)
+    if conn is None:
+        conn = _open_connection(parse_types)
+        pool[key] = conn
+        with _lock:
+            _all_connections.add(conn)
+    return conn
+
+
+@contextmanager
+def connection(parse_types=True):
+    """Context manager: hace commit al salir o rollback si hay excepción.
+
+    Uso:
+        with connection() as conn:
+            conn.execute("UPDATE ...")
+    """
+    conn = get_conn(parse_types)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def close_all():
+    """Cerrar todas las conexiones del proceso (p. ej. antes de reemplazar el archivo)"""
+    with _lock:
+        connections = list(_all_connections)
+        _all_connections.clear()
+    for conn in connections:
+        try:
+            conn.dispose()
+        except sqlite3.ProgrammingError:
+            pass  # Conexión creada en otro hilo; se libera cuando éste termine
+    pool = getattr(_local, "pool", None)
+    if pool is not None:
+        pool.clear()
+
+
+def pool_stats():
+    """Número de conexiones abiertas en el proceso"""
+    with _lock:
+        return {"open_connections": len(_all_connections)}
@@ -0,0 +1,35 @@
+"""
+Contadores de versión de datos.
+
+La tabla data_versions guarda un contador por tabla que se incrementa en
+cada escritura (los triggers de la migración 3 lo hacen para
+institutions), de modo que las cachés pueden saber con una sola lectura
+por clave primaria si sus datos siguen vigentes.
+"""
+
+from db.connection import get_conn
+
+
+def create_data_versions_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def get_data_version(name='institutions', conn=None):
+    """Versión actual de los datos de una tabla (0 si nunca se registró)"""
+    conn = conn or get_conn()
+    row = conn.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_data_version(name, conn=None):
+    """Incrementar la versión manualmente (para escrituras sin trigger)"""
+    conn = conn or get_conn()
+    conn.execute('''
+        INSERT INTO data_versions (name, version) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1
+    ''', (name,))
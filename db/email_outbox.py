@@ -0,0 +1,436 @@
+"""
+Cola persistente de emails salientes (email_outbox) y worker de envío.
+
+Las acciones de la UI solo llaman a enqueue_email(), que inserta una fila
+y despierta al worker. Un pequeño pool de hilos en segundo plano reutiliza
+sesiones SMTP autenticadas (STARTTLS + login una sola vez por hilo y
+cuenta), respeta un máximo de envíos por minuto por cuenta y por campaña
+(db/campaigns.py) y reintenta los fallos temporales con backoff
+exponencial. Las filas en 'enviando' que quedaron de un proceso anterior
+vuelven a 'pendiente' al arrancar el pool.
+
+Para probar sin Gmail basta con registrar la cuenta contra un servidor SMTP
+local de depuración, p. ej.:
+
+    python -m aiosmtpd -n -l localhost:1025
+
+y en .streamlit/secrets.toml: SMTP_HOST = "localhost", SMTP_PORT = 1025,
+SMTP_STARTTLS = false.
+"""
+
+import smtplib
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from db.connection import get_conn
+
+STATUS_PENDING = 'pendiente'
+STATUS_SENDING = 'enviando'
+STATUS_SENT = 'enviado'
+STATUS_FAILED = 'error'
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+POLL_SECONDS = 10
+BATCH_SIZE = 50
+POOL_SIZE = 3                 # Conexiones SMTP en paralelo
+IDLE_CLOSE_SECONDS = 120      # Gmail corta las sesiones inactivas; se cierra antes
+RATE_LIMIT_PAUSE_SECONDS = 60
+AUTH_PAUSE_SECONDS = 300
+
+# Respuestas SMTP que indican límite de envío o saturación temporal
+_THROTTLE_CODES = {421, 450, 451, 452, 454}
+
+_accounts = {}  # nombre -> configuración SMTP
+_limiters = {}  # ('cuenta', nombre) o ('campaña', id) -> _RateLimiter
+_limiters_lock = threading.Lock()
+_wake = threading.Event()
+_workers = []
+_worker_lock = threading.Lock()
+_recovered_sending = False
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def create_email_outbox(conn):
+    """Crear la tabla email_outbox y su índice de trabajo (idempotente)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            html_body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendiente',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_status_next ON email_outbox(status, next_attempt_at)')
+
+
+def register_smtp_account(name, sender, password, host='smtp.gmail.com', port=587,
+                          starttls=True, max_per_minute=20):
+    """Registrar (o actualizar) una cuenta SMTP que el worker puede usar"""
+    _accounts[name] = {
+        'sender': sender,
+        'password': password,
+        'host': host,
+        'port': int(port),
+        'starttls': bool(starttls),
+        'max_per_minute': max_per_minute,
+    }
+
+
+def enqueue_email(recipient, subject, html_body, account='admin', conn=None):
+    """Encolar un email para envío en segundo plano. Devuelve el id de la fila."""
+    own_transaction = conn is None
+    conn = conn or get_conn()
+    now = _now()
+    cursor = conn.execute('''
+        INSERT INTO email_outbox (account, recipient, subject, html_body, status, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (account, recipient, subject, html_body, STATUS_PENDING, now, now))
+    if own_transaction:
+        conn.commit()
+    _wake.set()
+    return cursor.lastrowid
+
+
+def wake_email_worker():
+    """Avisar al pool de que hay trabajo nuevo sin esperar al siguiente sondeo"""
+    _wake.set()
+
+
+def get_outbox_counts(conn=None):
+    """Número de emails por estado"""
+    conn = conn or get_conn()
+    rows = conn.execute('SELECT status, COUNT(*) FROM email_outbox GROUP BY status')
+    return {status: count for status, count in rows}
+
+
+def retry_failed_emails(conn=None):
+    """Volver a poner en cola los emails que agotaron sus reintentos"""
+    conn = conn or get_conn()
+    cursor = conn.execute('''
+        UPDATE email_outbox SET status = ?, attempts = 0, next_attempt_at = ?
+        WHERE status = ?
+    ''', (STATUS_PENDING, _now(), STATUS_FAILED))
+    conn.commit()
+    _wake.set()
+    return cursor.rowcount
+
+
+class _RateLimiter:
+    """Máximo de envíos por minuto, compartido entre los hilos del pool"""
+
+    def __init__(self, max_per_minute):
+        self.max_per_minute = max_per_minute
+        self.sent_times = deque()
+        self.paused_until = 0.0
+
+    def seconds_until_available(self, now):
+        while self.sent_times and now - self.sent_times[0] >= 60:
+            self.sent_times.popleft()
+        wait = max(0.0, self.paused_until - now)
+        if self.max_per_minute and self.sent_times:
+            # Envíos repartidos de forma uniforme dentro del minuto, sin ráfagas
+            wait = max(wait, self.sent_times[-1] + 60 / self.max_per_minute - now)
+            if len(self.sent_times) >= self.max_per_minute:
+                wait = max(wait, 60 - (now - self.sent_times[0]))
+        return wait
+
+
+def _reserve_send(keys_and_limits):
+    """Reservar un envío en todos los limitadores indicados.
+
+    Devuelve 0 si se puede enviar ya, o los segundos a esperar.
+    """
+    now = time.monotonic()
+    with _limiters_lock:
+        limiters = []
+        for key, max_per_minute in keys_and_limits:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = _limiters[key] = _RateLimiter(max_per_minute)
+            limiter.max_per_minute = max_per_minute
+            limiters.append(limiter)
+        wait = max(limiter.seconds_until_available(now) for limiter in limiters)
+        if wait <= 0:
+            for limiter in limiters:
+                limiter.sent_times.append(now)
+        return wait
+
+
+def _pause_limiter(key, seconds):
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is not None:
+            limiter.paused_until = max(limiter.paused_until, time.monotonic() + seconds)
+
+
+class _SmtpSession:
+    """Sesión SMTP autenticada de una cuenta, reutilizada entre mensajes"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.server = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        settings = self.settings
+        server = smtplib.SMTP(settings['host'], settings['port'], timeout=30)
+        try:
+            if settings['starttls']:
+                server.starttls()
+            if settings['password']:
+                server.login(settings['sender'], settings['password'])
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                self.server.close()
+            self.server = None
+
+    def send(self, recipient, subject, html_body):
+        msg = MIMEMultipart()
+        msg['From'] = self.settings['sender']
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        msg.attach(MIMEText(html_body, 'html', 'utf-8'))
+
+        if self.server is not None and time.monotonic() - self.last_used > IDLE_CLOSE_SECONDS:
+            self.close()
+        if self.server is None:
+            self._connect()
+        try:
+            self.server.sendmail(self.settings['sender'], recipient, msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # El servidor cerró la sesión reutilizada: reconectar una vez
+            self.server = None
+            self._connect()
+            self.server.sendmail(self.settings['sender'], recipient, msg.as_string())
+        self.last_used = time.monotonic()
+
+
+def _smtp_code(error):
+    """Código de respuesta SMTP del error (el del destinatario si fue rechazado)"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return max(codes) if codes else None
+    return getattr(error, 'smtp_code', None)
+
+
+def _is_permanent(error):
+    """Errores 5xx del destinatario/contenido: reintentar no servirá"""
+    code = _smtp_code(error)
+    permanent_types = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+    return isinstance(error, permanent_types) and code is not None and code >= 500
+
+
+class EmailOutboxWorker(threading.Thread):
+    """Hilo del pool de envío: procesa las filas con id % pool_size == slot.
+
+    Cada hilo mantiene su propia sesión SMTP por cuenta, de modo que el pool
+    equivale a pool_size conexiones en paralelo; los límites de envío por
+    cuenta y por campaña se comparten entre todos los hilos.
+    """
+
+    def __init__(self, slot=0, pool_size=1):
+        super().__init__(name=f'email-outbox-worker-{slot}', daemon=True)
+        self.slot = slot
+        self.pool_size = pool_size
+        self.sending_id = None      # Fila que este hilo está enviando ('enviando')
+        self.sessions = {}
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+        _wake.set()
+
+    def run(self):
+        conn = get_conn()
+        while not self.stop_event.is_set():
+            try:
+                wait = self.process_due(conn)
+            except Exception:
+                conn.rollback()
+                wait = POLL_SECONDS
+            if self.stop_event.is_set():
+                break
+            if wait > 0:
+                self._close_idle_sessions()
+                _wake.wait(wait)
+                _wake.clear()
+        for session in self.sessions.values():
+            session.close()
+
+    def _close_idle_sessions(self):
+        for session in self.sessions.values():
+            if session.server is not None and time.monotonic() - session.last_used > IDLE_CLOSE_SECONDS:
+                session.close()
+
+    def _session(self, account):
+        settings = _accounts.get(account)
+        if settings is None:
+            return None
+        session = self.sessions.get(account)
+        if session is None or session.settings != settings:
+            if session is not None:
+                session.close()
+            session = self.sessions[account] = _SmtpSession(settings)
+        return session
+
+    def process_due(self, conn):
+        """Enviar los emails vencidos. Devuelve cuántos segundos esperar (0 = seguir)."""
+        # Los emails transaccionales (sin campaña) van antes que los de campañas
+        rows = conn.execute('''
+            SELECT o.id, o.account, o.recipient, o.subject, o.html_body, o.attempts,
+                   o.campaign_id, c.max_per_minute
+            FROM email_outbox o LEFT JOIN email_campaigns c ON c.id = o.campaign_id
+            WHERE o.status = ? AND o.next_attempt_at <= ? AND o.id % ? = ?
+              AND (o.campaign_id IS NULL OR c.status = 'activa')
+            ORDER BY o.campaign_id IS NOT NULL, o.next_attempt_at, o.id LIMIT ?
+        ''', (STATUS_PENDING, _now(), self.pool_size, self.slot, BATCH_SIZE)).fetchall()
+        if not rows:
+            return self._seconds_until_next(conn)
+
+        min_wait = None
+        sent_any = False
+        for email_id, account, recipient, subject, html_body, attempts, campaign_id, campaign_rate in rows:
+            if self.stop_event.is_set():
+                break
+            session = self._session(account)
+            if session is None:
+                self._mark(conn, email_id, STATUS_FAILED, attempts, f"Cuenta SMTP '{account}' no configurada")
+                continue
+            limits = [(('cuenta', account), session.settings['max_per_minute'])]
+            if campaign_id is not None:
+                limits.append((('campaña', campaign_id), campaign_rate))
+            wait = _reserve_send(limits)
+            if wait > 0:
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+                continue
+
+            claimed = conn.execute(
+                'UPDATE email_outbox SET status = ? WHERE id = ? AND status = ?',
+                (STATUS_SENDING, email_id, STATUS_PENDING)
+            ).rowcount
+            conn.commit()
+            if not claimed:
+                continue
+
+            self.sending_id = email_id
+            try:
+                session.send(recipient, subject, html_body)
+            except Exception as e:
+                self._handle_failure(conn, session, account, email_id, attempts + 1, e)
+            else:
+                conn.execute(
+                    'UPDATE email_outbox SET status = ?, attempts = ?, sent_at = ?, last_error = NULL WHERE id = ?',
+                    (STATUS_SENT, attempts + 1, _now(), email_id)
+                )
+                conn.commit()
+                sent_any = True
+            self.sending_id = None
+
+        if sent_any or len(rows) == BATCH_SIZE and min_wait is None:
+            return 0
+        return min_wait if min_wait is not None else self._seconds_until_next(conn)
+
+    def _seconds_until_next(self, conn):
+        # Mismo filtro que process_due: las campañas pausadas y las filas de otros hilos no despiertan a este
+        row = conn.execute('''
+            SELECT MIN(o.next_attempt_at)
+            FROM email_outbox o LEFT JOIN email_campaigns c ON c.id = o.campaign_id
+            WHERE o.status = ? AND o.id % ? = ?
+              AND (o.campaign_id IS NULL OR c.status = 'activa')
+        ''', (STATUS_PENDING, self.pool_size, self.slot)).fetchone()
+        if not row or row[0] is None:
+            return POLL_SECONDS
+        delta = (datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S') - datetime.now()).total_seconds()
+        return min(max(delta, 1), POLL_SECONDS)
+
+    def _handle_failure(self, conn, session, account, email_id, attempts, error):
+        code = _smtp_code(error)
+        if isinstance(error, smtplib.SMTPAuthenticationError):
+            session.close()
+            _pause_limiter(('cuenta', account), AUTH_PAUSE_SECONDS)
+        elif code in _THROTTLE_CODES:
+            # El servidor pide bajar el ritmo: pausar toda la cuenta
+            session.close()
+            _pause_limiter(('cuenta', account), RATE_LIMIT_PAUSE_SECONDS * attempts)
+        elif not _is_permanent(error):
+            session.close()
+
+        message = f"{type(error).__name__}: {error}"
+        if _is_permanent(error) or attempts >= MAX_ATTEMPTS:
+            self._mark(conn, email_id, STATUS_FAILED, attempts, message)
+        else:
+            delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+            next_attempt = (datetime.now() + timedelta(seconds=delay)).strftime('%Y-%m-%d %H:%M:%S')
+            conn.execute(
+                'UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                (STATUS_PENDING, attempts, next_attempt, message, email_id)
+            )
+            conn.commit()
+
+    def _mark(self, conn, email_id, status, attempts, message):
+        conn.execute(
+            'UPDATE email_outbox SET status = ?, attempts = ?, last_error = ? WHERE id = ?',
+            (status, attempts, message, email_id)
+        )
+        conn.commit()
+
+
+def start_email_worker(pool_size=POOL_SIZE):
+    """Arrancar el pool de envío si no está en marcha (idempotente)"""
+    global _workers, _recovered_sending
+    with _worker_lock:
+        if _workers and all(worker.is_alive() for worker in _workers):
+            return _workers
+        # Solo se devuelven a la cola las filas que nadie puede estar enviando: las de un
+        # proceso anterior (una vez, al arrancar) y la que tenía un hilo muerto de este proceso.
+        # Los hilos que siguen vivos terminan su envío en curso antes de detenerse.
+        stranded = [worker.sending_id for worker in _workers
+                    if not worker.is_alive() and worker.sending_id is not None]
+        for worker in _workers:
+            worker.stop()
+        conn = get_conn()
+        if not _recovered_sending:
+            conn.execute('UPDATE email_outbox SET status = ? WHERE status = ?', (STATUS_PENDING, STATUS_SENDING))
+            _recovered_sending = True
+        conn.executemany('UPDATE email_outbox SET status = ? WHERE id = ? AND status = ?',
+                         [(STATUS_PENDING, email_id, STATUS_SENDING) for email_id in stranded])
+        conn.commit()
+        _workers = [EmailOutboxWorker(slot, pool_size) for slot in range(pool_size)]
+        for worker in _workers:
+            worker.start()
+    return _workers
+
+
+def stop_email_worker(timeout=None):
+    """Detener el pool (cierra las sesiones SMTP abiertas)"""
+    global _workers
+    with _worker_lock:
+        workers, _workers = _workers, []
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join(timeout)
@@ -0,0 +1,63 @@
+"""
+Opciones de los filtros rápidos del sidebar (país, ciudad, etapa, medio).
+
+Los valores distintos se obtienen con SELECT DISTINCT (resueltos por los
+índices de cada columna) y se guardan en memoria junto con la versión de
+datos de institutions. Mientras esa versión no cambie, cada rerun solo
+lee el contador.
+"""
+
+import threading
+
+from db.connection import get_conn, get_db_path
+from db.data_version import get_data_version
+
+# Clave de la opción -> columna de institutions
+FILTER_COLUMNS = {
+    'pais': 'pais',
+    'ciudad': 'ciudad',
+    'stage': 'stage',
+    'medium': 'initial_contact_medium',
+}
+
+_cache = {}  # db_path -> (versión de datos, opciones)
+_lock = threading.Lock()
+
+
+def load_filter_options(conn=None):
+    """Consultar los valores distintos no vacíos de cada columna de filtro"""
+    conn = conn or get_conn()
+    options = {}
+    for key, column in FILTER_COLUMNS.items():
+        rows = conn.execute(
+            f"SELECT DISTINCT {column} FROM institutions "
+            f"WHERE {column} IS NOT NULL AND {column} != '' ORDER BY {column}"
+        )
+        options[key] = [row[0] for row in rows]
+    return options
+
+
+def get_filter_options():
+    """Opciones de filtros, recalculadas solo si los datos cambiaron.
+
+    Returns:
+        dict con listas ordenadas en 'pais', 'ciudad', 'stage' y 'medium'.
+    """
+    conn = get_conn()
+    version = get_data_version('institutions', conn)
+    db_path = get_db_path()
+
+    cached = _cache.get(db_path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    options = load_filter_options(conn)
+    with _lock:
+        _cache[db_path] = (version, options)
+    return options
+
+
+def invalidate_filter_options():
+    """Descartar la caché (p. ej. tras reemplazar el archivo de la base)"""
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,308 @@
+"""
+Migraciones versionadas del esquema de Muyu CRM.
+
+Cada migración se registra con @migration(version, nombre) y se aplica una
+sola vez, dentro de su propia transacción, anotando la versión en la tabla
+schema_migrations. Ejecutar este archivo directamente aplica las
+migraciones pendientes y muestra el reporte de planes de consulta:
+
+    python -m db.migrations
+"""
+
+import sys
+from datetime import datetime
+
+from db.aggregates import rebuild_pipeline_aggregates
+from db.alerts import create_alert_tables
+from db.backup import create_change_log
+from db.campaigns import create_campaign_tables
+from db.connection import get_conn, get_db_path
+from db.data_version import create_data_versions_table
+from db.query_log import create_slow_query_log
+from db.email_outbox import create_email_outbox
+from db.search import create_search_index
+from db.task_assignees import add_task_assignee_columns, backfill_task_assignees
+
+MIGRATIONS = []
+_applied_paths = set()
+
+
+def migration(version, name):
+    """Registrar una función como migración con número de versión"""
+    def decorator(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def ensure_migrations_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def get_applied_versions(conn):
+    ensure_migrations_table(conn)
+    return {row[0] for row in conn.execute('SELECT version FROM schema_migrations')}
+
+
+def apply_migrations(conn=None, force=False):
+    """Aplicar las migraciones pendientes. Devuelve la lista de versiones aplicadas.
+
+    Una vez aplicadas en este proceso no se vuelve a consultar la base de
+    datos en cada rerun, salvo que se pase force=True.
+    """
+    db_path = get_db_path()
+    if db_path in _applied_paths and not force:
+        return []
+
+    conn = conn or get_conn()
+    applied = get_applied_versions(conn)
+    newly_applied = []
+
+    for version, name, func in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            conn.execute('BEGIN')
+            func(conn)
+            conn.execute(
+                'INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+                (version, name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        newly_applied.append(version)
+
+    _applied_paths.add(db_path)
+    return newly_applied
+
+
+# ----------------------
+# Migraciones
+# ----------------------
+
+@migration(1, 'indices_columnas_calientes')
+def _m001_hot_column_indexes(conn):
+    statements = [
+        # Kanban: WHERE stage = ? ORDER BY last_interaction DESC (id desempata)
+        'CREATE INDEX IF NOT EXISTS idx_institutions_stage_last_interaction '
+        'ON institutions(stage, last_interaction DESC, id DESC)',
+        # Alertas de leads sin contacto: WHERE last_interaction < ?
+        'CREATE INDEX IF NOT EXISTS idx_institutions_last_interaction '
+        'ON institutions(last_interaction)',
+        # Panel de ventas: WHERE assigned_commercial = ? ORDER BY stage, last_interaction DESC
+        'CREATE INDEX IF NOT EXISTS idx_institutions_commercial_stage '
+        'ON institutions(assigned_commercial, stage, last_interaction DESC)',
+        # Filtros rápidos del sidebar
+        'CREATE INDEX IF NOT EXISTS idx_institutions_pais ON institutions(pais)',
+        'CREATE INDEX IF NOT EXISTS idx_institutions_ciudad ON institutions(ciudad)',
+        'CREATE INDEX IF NOT EXISTS idx_institutions_medium ON institutions(initial_contact_medium)',
+        # Joins de tareas e interacciones (tareas de una institución ORDER BY id DESC)
+        'CREATE INDEX IF NOT EXISTS idx_tasks_institution_id ON tasks(institution_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks(due_date)',
+        'CREATE INDEX IF NOT EXISTS idx_interactions_institution_id ON interactions(institution_id)',
+    ]
+    for statement in statements:
+        conn.execute(statement)
+
+
+@migration(2, 'busqueda_fts_instituciones')
+def _m002_institution_search(conn):
+    # Tabla FTS5 + triggers de sincronización, y carga inicial del índice
+    create_search_index(conn)
+    conn.execute("INSERT INTO institutions_fts(institutions_fts) VALUES ('rebuild')")
+
+
+@migration(3, 'version_de_datos_instituciones')
+def _m003_institution_data_version(conn):
+    # Cualquier escritura en institutions invalida las cachés que dependen de ella
+    create_data_versions_table(conn)
+    conn.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES ('institutions', 0)")
+    for event, name in (('INSERT', 'ai'), ('UPDATE', 'au'), ('DELETE', 'ad')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS institutions_version_{name} AFTER {event} ON institutions BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = 'institutions';
+            END
+        ''')
+
+
+
+@migration(4, 'agregados_pipeline')
+def _m004_pipeline_aggregates(conn):
+    # Tabla de agregados + triggers incrementales, y carga inicial
+    rebuild_pipeline_aggregates(conn)
+
+
+@migration(5, 'registro_cambios_backup')
+def _m005_backup_change_log(conn):
+    # change_log + triggers para los backups incrementales
+    create_change_log(conn)
+
+
+@migration(6, 'cola_emails_salientes')
+def _m006_email_outbox(conn):
+    # Cola persistente que vacía el worker SMTP en segundo plano
+    create_email_outbox(conn)
+
+
+@migration(7, 'campanas_email')
+def _m007_email_campaigns(conn):
+    # Campañas personalizadas: cada destinatario es una fila de email_outbox
+    create_campaign_tables(conn)
+
+
+@migration(8, 'responsable_tareas')
+def _m008_task_assignees(conn):
+    # Responsable en columnas indexadas en lugar de líneas dentro de notes
+    add_task_assignee_columns(conn)
+    backfill_task_assignees(conn)
+
+
+@migration(9, 'alertas_leads_sin_contacto')
+def _m009_stale_lead_alerts(conn):
+    # Umbrales por etapa y alertas precalculadas por el job periódico
+    create_alert_tables(conn)
+
+
+@migration(10, 'registro_consultas_lentas')
+def _m010_slow_query_log(conn):
+    # Consultas que superan SLOW_QUERY_MS, con su duración y la función que las hizo
+    create_slow_query_log(conn)
+
+
+# ----------------------
+# Verificación de planes de consulta
+# ----------------------
+
+# Consultas representativas de los dashboards que deben usar índices
+HOT_QUERIES = {
+    'kanban_por_etapa': (
+        'SELECT * FROM institutions WHERE stage = ? ORDER BY last_interaction DESC LIMIT 10',
+        ('En cola',)
+    ),
+    'kanban_siguiente_pagina': (
+        'SELECT * FROM institutions WHERE stage = ? AND last_interaction IS NOT NULL '
+        'AND last_interaction <= ? AND (last_interaction < ? OR id < ?) '
+        'ORDER BY last_interaction DESC, id DESC LIMIT 11',
+        ('En cola', '2025-01-01', '2025-01-01', 'x')
+    ),
+    'conteo_por_etapa': (
+        'SELECT stage, COUNT(*) FROM institutions GROUP BY stage',
+        ()
+    ),
+    'instituciones_de_ventas': (
+        'SELECT * FROM institutions WHERE assigned_commercial = ? ORDER BY stage, last_interaction DESC',
+        ('ventas1',)
+    ),
+    'leads_sin_contacto': (
+        "SELECT id, name, last_interaction, assigned_commercial FROM institutions "
+        "WHERE last_interaction < datetime('now', '-7 days') ORDER BY last_interaction ASC",
+        ()
+    ),
+    'filtro_pais_ciudad': (
+        'SELECT * FROM institutions WHERE pais IN (?) AND ciudad IN (?)',
+        ('Ecuador', 'Quito')
+    ),
+    'filtro_medio': (
+        'SELECT * FROM institutions WHERE initial_contact_medium IN (?)',
+        ('Whatsapp',)
+    ),
+    'tareas_de_institucion': (
+        'SELECT id, title, due_date FROM tasks WHERE institution_id = ? ORDER BY id DESC',
+        ('x',)
+    ),
+    'tareas_de_usuario': (
+        'SELECT id, title FROM tasks WHERE assignee_username = ? ORDER BY due_date',
+        ('ventas',)
+    ),
+    'tareas_por_vencimiento': (
+        'SELECT t.id, i.name FROM tasks t LEFT JOIN institutions i ON t.institution_id = i.id '
+        'WHERE t.due_date <= ? ORDER BY t.due_date ASC',
+        ('2025-01-01',)
+    ),
+    'busqueda_instituciones': (
+        "SELECT i.* FROM institutions_fts f JOIN institutions i ON i.rowid = f.rowid "
+        "WHERE institutions_fts MATCH ? ORDER BY bm25(institutions_fts) LIMIT 200",
+        ('"colegio"*',)
+    ),
+    'opciones_filtro_ciudad': (
+        "SELECT DISTINCT ciudad FROM institutions WHERE ciudad IS NOT NULL AND ciudad != '' ORDER BY ciudad",
+        ()
+    ),
+    'interacciones_de_institucion': (
+        'SELECT * FROM interactions WHERE institution_id = ?',
+        ('x',)
+    ),
+    'reporte_campana': (
+        'SELECT status, COUNT(*) FROM email_outbox WHERE campaign_id = ? GROUP BY status',
+        (1,)
+    ),
+    'alertas_de_comercial': (
+        'SELECT * FROM stale_lead_alerts WHERE assigned_commercial = ? ORDER BY days_since_contact DESC',
+        ('ventas',)
+    ),
+    'alertas_sin_contacto': (
+        'SELECT * FROM stale_lead_alerts ORDER BY days_since_contact DESC LIMIT 50',
+        ()
+    ),
+    'cola_emails_vencidos': (
+        'SELECT id FROM email_outbox WHERE status = ? AND next_attempt_at <= ? '
+        'ORDER BY next_attempt_at, id LIMIT 50',
+        ('pendiente', '2025-01-01 00:00:00')
+    ),
+}
+
+
+def explain_query_plan(sql, params=(), conn=None):
+    """Devolver las líneas de EXPLAIN QUERY PLAN de una consulta"""
+    conn = conn or get_conn()
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def find_full_scans(sql, params=(), conn=None):
+    """Devolver los pasos del plan que recorren una tabla completa sin índice"""
+    full_scans = []
+    for detail in explain_query_plan(sql, params, conn):
+        # 'VIRTUAL TABLE INDEX' es una búsqueda resuelta por el índice FTS5
+        indexed = any(marker in detail for marker in ('USING', 'CONSTANT ROW', 'VIRTUAL TABLE INDEX'))
+        if detail.startswith('SCAN ') and not indexed:
+            full_scans.append(detail)
+    return full_scans
+
+
+def check_query_plans(queries=None, conn=None):
+    """Revisar las consultas calientes y reportar las que hacen full scan.
+
+    Devuelve {nombre_consulta: [pasos con full scan]} solo para las
+    consultas con problemas; un diccionario vacío significa que todas usan
+    índices.
+    """
+    queries = queries or HOT_QUERIES
+    report = {}
+    for name, (sql, params) in queries.items():
+        scans = find_full_scans(sql, params, conn)
+        if scans:
+            report[name] = scans
+    return report
+
+
+if __name__ == '__main__':
+    applied = apply_migrations(force=True)
+    print(f"Migraciones aplicadas: {applied or 'ninguna pendiente'}")
+
+    report = check_query_plans()
+    if report:
+        print("⚠️ Consultas que recorren tablas completas:")
+        for name, scans in report.items():
+            print(f"  - {name}: {'; '.join(scans)}")
+        sys.exit(1)
+    print("✅ Todas las consultas calientes usan índices")
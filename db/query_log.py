@@ -0,0 +1,261 @@
+"""
+Instrumentación de las consultas SQL de los dashboards.
+
+Las conexiones del pool (db.connection) crean cursores
+InstrumentedCursor: cada consulta registra su SQL, parámetros, duración
+(ejecución más fetchone/fetchmany/fetchall, también con
+pd.read_sql_query), filas leídas con fetch* y la función que la hizo.
+Una consulta cuyas filas no se leen hasta el final queda pendiente y se
+registra en la siguiente consulta del mismo hilo, al cerrar su cursor o
+al empezar el siguiente rerun. Las estadísticas se acumulan en el
+diccionario que la app registra al empezar cada rerun con
+collect_queries() (normalmente guardado en st.session_state), y las
+consultas que superan SLOW_QUERY_MS se guardan en la tabla slow_queries
+desde un hilo en segundo plano.
+"""
+
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+SLOW_QUERY_MS = float(os.environ.get('MUYU_SLOW_QUERY_MS', 200))
+MAX_SLOW_QUERIES = 5000        # Filas que se conservan en slow_queries
+MAX_PARAMS_CHARS = 300
+DEFAULT_TOP_N = 15
+
+_local = threading.local()
+_slow_queue = queue.Queue(maxsize=1000)
+_writer = None
+_writer_lock = threading.Lock()
+# Marcos que no cuentan como "función que hizo la consulta"
+_INTERNAL_FILES = (os.path.join('db', 'query_log.py'), os.path.join('db', 'connection.py'))
+_PANDAS_DIR = f"{os.sep}pandas{os.sep}"
+
+
+def create_slow_query_log(conn):
+    """Crear la tabla del registro de consultas lentas (idempotente)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS slow_queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sql TEXT NOT NULL,
+            params TEXT,
+            duration_ms REAL NOT NULL,
+            rows INTEGER,
+            caller TEXT,
+            logged_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_slow_queries_logged_at ON slow_queries(logged_at)')
+
+
+def collect_queries(store):
+    """Acumular en store las consultas de este hilo; llamar al empezar cada rerun.
+
+    store guarda 'queries' ({(sql, función): totales}) durante toda la sesión
+    y 'rerun' (número de consultas y milisegundos) solo del rerun actual.
+    """
+    _flush_pending()
+    store.setdefault('queries', {})
+    store['rerun'] = {'count': 0, 'total_ms': 0.0}
+    _local.store = store
+    return store
+
+
+def _caller():
+    frame = sys._getframe(1)
+    while frame is not None and (frame.f_code.co_filename.endswith(_INTERNAL_FILES)
+                                 or _PANDAS_DIR in frame.f_code.co_filename):
+        frame = frame.f_back
+    if frame is None:
+        return '?'
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{frame.f_lineno}"
+
+
+def _format_params(params):
+    text = repr(params) if params else ''
+    return text if len(text) <= MAX_PARAMS_CHARS else text[:MAX_PARAMS_CHARS] + '...'
+
+
+def _record(query):
+    store = query['store']
+    if store is not None:
+        totals = store['queries'].setdefault((query['sql'], query['caller']), {
+            'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'last_params': '',
+        })
+        totals['calls'] += 1
+        totals['total_ms'] += query['ms']
+        totals['max_ms'] = max(totals['max_ms'], query['ms'])
+        totals['rows'] += query['rows']
+        totals['last_params'] = query['params']
+        store['rerun']['count'] += 1
+        store['rerun']['total_ms'] += query['ms']
+    if query['ms'] >= SLOW_QUERY_MS:
+        try:
+            _slow_queue.put_nowait((query['sql'], query['params'], query['ms'], query['rows'], query['caller'],
+                                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        except queue.Full:
+            return
+        _start_writer()
+
+
+def _flush_pending():
+    """Registrar la consulta del hilo que quedó sin leer hasta el final"""
+    cursor = getattr(_local, 'pending', None)
+    _local.pending = None
+    if cursor is not None:
+        cursor._finish()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor que mide la ejecución y las lecturas fetch* de cada consulta"""
+
+    _query = None
+
+    def _begin(self, sql, params, started):
+        elapsed = (time.perf_counter() - started) * 1000
+        if getattr(_local, 'disabled', False):
+            return
+        query = {
+            'sql': ' '.join(str(sql).split()),
+            'params': params,
+            'ms': elapsed,
+            'rows': 0,
+            'caller': _caller(),
+            'store': getattr(_local, 'store', None),
+        }
+        if self.description is None:
+            # INSERT/UPDATE/DELETE: no hay filas que leer
+            query['rows'] = max(self.rowcount, 0)
+            _record(query)
+        else:
+            self._query = query
+            _local.pending = self
+
+    def _finish(self):
+        query, self._query = self._query, None
+        if query is not None:
+            if getattr(_local, 'pending', None) is self:
+                _local.pending = None
+            _record(query)
+
+    def _fetched(self, started, rows, done):
+        query = self._query
+        if query is not None:
+            query['ms'] += (time.perf_counter() - started) * 1000
+            query['rows'] += rows
+            if done:
+                self._finish()
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        _flush_pending()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._begin(sql, _format_params(parameters), started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        _flush_pending()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._begin(sql, '(executemany)', started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        rows = super().fetchmany(*args, **kwargs)
+        self._fetched(started, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+def top_queries(store, limit=DEFAULT_TOP_N):
+    """Consultas de la sesión ordenadas por tiempo total (la más costosa primero)"""
+    rows = [
+        {
+            'sql': sql,
+            'caller': caller,
+            'calls': totals['calls'],
+            'total_ms': totals['total_ms'],
+            'avg_ms': totals['total_ms'] / totals['calls'],
+            'max_ms': totals['max_ms'],
+            'rows': totals['rows'],
+            'last_params': totals['last_params'],
+        }
+        for (sql, caller), totals in store.get('queries', {}).items()
+    ]
+    rows.sort(key=lambda row: row['total_ms'], reverse=True)
+    return rows[:limit]
+
+
+def get_slow_queries(limit=50, conn=None):
+    """Últimas consultas lentas registradas"""
+    from db.connection import get_conn
+    conn = conn or get_conn()
+    rows = conn.execute('''
+        SELECT logged_at, duration_ms, rows, caller, sql, params
+        FROM slow_queries ORDER BY id DESC LIMIT ?
+    ''', (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+class SlowQueryWriter(threading.Thread):
+    """Hilo que guarda en slow_queries las consultas lentas encoladas"""
+
+    def __init__(self):
+        super().__init__(name='slow-query-log', daemon=True)
+
+    def run(self):
+        # Importación diferida: db.connection importa este módulo
+        from db.connection import get_conn
+        # Las escrituras del propio registro no se instrumentan
+        _local.disabled = True
+        while True:
+            batch = [_slow_queue.get()]
+            while True:
+                try:
+                    batch.append(_slow_queue.get_nowait())
+                except queue.Empty:
+                    break
+            conn = get_conn()
+            try:
+                conn.executemany('''
+                    INSERT INTO slow_queries (sql, params, duration_ms, rows, caller, logged_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', batch)
+                conn.execute('DELETE FROM slow_queries WHERE id <= (SELECT MAX(id) FROM slow_queries) - ?',
+                             (MAX_SLOW_QUERIES,))
+                conn.commit()
+            except sqlite3.Error:
+                # Tabla aún sin migrar o base ocupada: se descarta el lote
+                conn.rollback()
+
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = SlowQueryWriter()
+            _writer.start()
@@ -0,0 +1,108 @@
+"""
+Búsqueda de texto completo de instituciones con SQLite FTS5.
+
+La tabla virtual institutions_fts indexa (como contenido externo, sin
+duplicar los datos) el nombre, los contactos, la ciudad y las
+observaciones de cada institución. Los triggers creados por la migración
+la mantienen sincronizada con institutions.
+"""
+
+import re
+
+from db.connection import get_conn
+
+FTS_TABLE = "institutions_fts"
+
+# Columnas indexadas y su peso en el ranking bm25 (mismo orden que la tabla)
+FTS_COLUMNS = [
+    ("name", 10.0),
+    ("rector_name", 5.0),
+    ("rector_email", 3.0),
+    ("contraparte_name", 5.0),
+    ("contraparte_email", 3.0),
+    ("ciudad", 2.0),
+    ("observations", 1.0),
+]
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def create_search_index(conn):
+    """Crear la tabla FTS5 y sus triggers (idempotente)"""
+    columns = ", ".join(name for name, _ in FTS_COLUMNS)
+    new_values = ", ".join(f"new.{name}" for name, _ in FTS_COLUMNS)
+    old_values = ", ".join(f"old.{name}" for name, _ in FTS_COLUMNS)
+
+    # remove_diacritics 2: "jose" encuentra "José"; prefix acelera "térm*"
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            {columns},
+            content='institutions',
+            content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS institutions_fts_ai AFTER INSERT ON institutions BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.rowid, {new_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS institutions_fts_ad AFTER DELETE ON institutions BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});
+        END
+    ''')
+    # Solo se reindexa cuando cambian columnas indexadas (no al mover de etapa)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS institutions_fts_au AFTER UPDATE OF {columns} ON institutions BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.rowid, {new_values});
+        END
+    ''')
+
+
+def rebuild_search_index(conn=None):
+    """Reconstruir el índice completo desde institutions.
+
+    Necesario si la tabla institutions se recrea (p. ej. con
+    fix_last_interaction_column.py), ya que eso elimina los triggers y
+    cambia los rowid.
+    """
+    conn = conn or get_conn()
+    create_search_index(conn)
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    conn.commit()
+
+
+def build_match_expression(text):
+    """Convertir el texto del usuario en una expresión MATCH de prefijos.
+
+    Cada palabra se busca como prefijo y todas deben aparecer:
+    "colegio jos" -> "colegio"* "jos"*
+    """
+    tokens = _TOKEN_RE.findall(text or "")
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def search_institutions_sql(text, limit=200):
+    """Consulta (sql, params) que devuelve las instituciones ordenadas por relevancia.
+
+    Devuelve (None, None) si el texto no contiene palabras buscables.
+    """
+    match = build_match_expression(text)
+    if match is None:
+        return None, None
+
+    weights = ", ".join(str(weight) for _, weight in FTS_COLUMNS)
+    sql = f'''
+        SELECT i.*
+        FROM {FTS_TABLE} f
+        JOIN institutions i ON i.rowid = f.rowid
+        WHERE {FTS_TABLE} MATCH ?
+        ORDER BY bm25({FTS_TABLE}, {weights})
+        LIMIT ?
+    '''
+    return sql, [match, limit]
@@ -0,0 +1,97 @@
+"""
+Responsable de las tareas en columnas propias.
+
+Antes el responsable se guardaba como líneas de texto dentro de
+tasks.notes ("Responsable: Nombre (usuario)", "Email: ...", "Rol: ...") y
+las tareas de un usuario se buscaban con notes LIKE '%usuario%'. La
+migración 8 añade tasks.assignee_username y tasks.assignee_email con su
+índice, traslada esos datos desde las notas y deja en notes solo el texto
+escrito por el usuario.
+"""
+
+from db.connection import get_conn
+
+# Líneas de notes que pasan a las columnas del responsable
+ASSIGNEE_NOTE_PREFIXES = ('Responsable:', 'Email:', 'Rol:')
+
+
+def parse_assignee_from_notes(notes):
+    """Extraer nombre, usuario, email y rol de las líneas de responsable de las notas"""
+    info = {}
+    for line in str(notes or '').split('\n'):
+        line = line.strip()
+        if line.startswith('Responsable:'):
+            responsable = line[len('Responsable:'):].strip()
+            if responsable.endswith(')') and '(' in responsable:
+                # "Responsable: Juan Pérez (jperez)"
+                name, _, username = responsable[:-1].rpartition('(')
+                info['full_name'] = name.strip()
+                info['username'] = username.strip()
+            elif responsable and responsable != 'Sin asignar':
+                info['full_name'] = responsable
+        elif line.startswith('Email:'):
+            info['email'] = line[len('Email:'):].strip()
+        elif line.startswith('Rol:'):
+            info['role'] = line[len('Rol:'):].strip()
+    return {key: value for key, value in info.items() if value}
+
+
+def strip_assignee_lines(notes):
+    """Notas sin las líneas de responsable (y sin líneas vacías al final)"""
+    lines = [line for line in str(notes or '').split('\n')
+             if not line.strip().startswith(ASSIGNEE_NOTE_PREFIXES)]
+    return '\n'.join(lines).strip()
+
+
+def resolve_assignee(name_or_username=None, email=None, conn=None):
+    """Buscar el usuario por username, nombre completo o email.
+
+    Returns:
+        (username, email): los valores conocidos; None si no hay coincidencia.
+    """
+    conn = conn or get_conn()
+    row = None
+    if name_or_username:
+        row = conn.execute(
+            'SELECT username, email FROM users WHERE username = ? OR full_name = ? '
+            'ORDER BY username = ? DESC LIMIT 1',
+            (name_or_username, name_or_username, name_or_username)
+        ).fetchone()
+    if row is None and email:
+        row = conn.execute('SELECT username, email FROM users WHERE email = ? LIMIT 1', (email,)).fetchone()
+    if row is None:
+        return None, email or None
+    return row[0], email or row[1]
+
+
+def add_task_assignee_columns(conn):
+    """Añadir las columnas del responsable y su índice (idempotente)"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(tasks)')}
+    if 'assignee_username' not in columns:
+        conn.execute('ALTER TABLE tasks ADD COLUMN assignee_username TEXT')
+    if 'assignee_email' not in columns:
+        conn.execute('ALTER TABLE tasks ADD COLUMN assignee_email TEXT')
+    # Tareas de un usuario ordenadas por vencimiento
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_assignee_due ON tasks(assignee_username, due_date)')
+
+
+def backfill_task_assignees(conn):
+    """Trasladar el responsable de las notas a las columnas. Devuelve las tareas actualizadas."""
+    rows = conn.execute(
+        "SELECT id, notes FROM tasks WHERE assignee_username IS NULL AND assignee_email IS NULL "
+        "AND (notes LIKE '%Responsable:%' OR notes LIKE '%Email:%')"
+    ).fetchall()
+    updates = []
+    for task_id, notes in rows:
+        info = parse_assignee_from_notes(notes)
+        username = info.get('username')
+        email = info.get('email')
+        if username or info.get('full_name') or email:
+            resolved_username, email = resolve_assignee(username or info.get('full_name'), email, conn)
+            # Sin usuario que coincida se guarda el nombre escrito, igual que al crear la tarea en app1.py
+            username = resolved_username or username or info.get('full_name')
+        updates.append((username, email, strip_assignee_lines(notes), task_id))
+    conn.executemany(
+        'UPDATE tasks SET assignee_username = ?, assignee_email = ?, notes = ? WHERE id = ?', updates
+    )
+    return len(updates)
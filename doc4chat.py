@@ -1,7 +1,16 @@
 import streamlit as st
 st.set_page_config(page_title="Doc4Chat", page_icon="🦜")
-import fitz  # PyMuPDF library
-from langchain.llms import OpenAI
+import math
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from modules.llm_gateway import get_llm
+from modules.pdf_extract import iter_pdf_pages, iter_word_chunks
+
+CHUNK_WORDS = 2000
+MAP_TOP_K = 4            # Chunks sent to the model in map-reduce mode
+MAP_MAX_CONCURRENCY = 4  # Parallel LLM calls in the map step
+NO_INFO_MARKER = "NO_INFO"
 
 # --- Traducción simple (diccionario) ---
 TRANSLATIONS = {
@@ -26,7 +35,11 @@ TRANSLATIONS = {
         "you": "You:",
         "ask": "Ask",
         "response_prefix": "Doc4Chat:",
-        "error_api": "Please enter your OpenAI API key in the sidebar."
+        "error_api": "Please enter your OpenAI API key in the sidebar.",
+        "mode_label": "Answer mode",
+        "mode_map_reduce": "Fast (most relevant excerpts in parallel)",
+        "mode_sequential": "Full (whole document, one excerpt at a time)",
+        "no_answer": "The document does not seem to contain information about this question."
     },
     "es": {
         "title": "🦜 Doc4Chat: Interactúa con tus PDFs de forma conversacional",
@@ -49,7 +62,11 @@ TRANSLATIONS = {
         "you": "Tú:",
         "ask": "Preguntar",
         "response_prefix": "Doc4Chat:",
-        "error_api": "Por favor, introduce tu clave API de OpenAI en la barra lateral."
+        "error_api": "Por favor, introduce tu clave API de OpenAI en la barra lateral.",
+        "mode_label": "Modo de respuesta",
+        "mode_map_reduce": "Rápido (fragmentos más relevantes en paralelo)",
+        "mode_sequential": "Completo (todo el documento, fragmento a fragmento)",
+        "no_answer": "El documento no parece contener información sobre esta pregunta."
     }
 }
 
@@ -68,40 +85,91 @@ with col_lang2:
 
 T = TRANSLATIONS[st.session_state.lang]
 
-# Function to extract text from PDF file
-def extract_text_from_pdf(file):
-    pdf_text = ""
+# Function to stream (page_no, text) from the PDF, parsed in parallel with PyMuPDF.
+# Pages of the current file are kept in session so later questions don't parse it again.
+def iter_pdf_pages_cached(file):
+    key = (file.name, file.size)
+    cached = st.session_state.get("pdf_pages")
+    if cached and cached[0] == key:
+        yield from cached[1]
+        return
+    pages = []
     try:
-        with fitz.open(stream=file.read(), filetype="pdf") as doc:
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                pdf_text += page.get_text()
+        for page in iter_pdf_pages(file.getvalue(), engine="pymupdf"):
+            pages.append(page)
+            yield page
     except Exception as e:
         st.error(f"Error: Unable to read the PDF file. {e}")
-    return pdf_text
+        return
+    st.session_state.pdf_pages = (key, pages)
 
 # Function to summarize a chunk of text
 def summarize_chunk(chunk, openai_api_key):
-    llm = OpenAI(openai_api_key=openai_api_key, temperature=0.7, max_tokens=1500)
+    llm = get_llm(openai_api_key, temperature=0.7, max_tokens=1500, source="doc4chat")
     prompt = f"Please summarize the following text:\n\n{chunk}"
     summary = llm(prompt)
     return summary
 
-# Function to divide text into chunks of approximately 2000 tokens
-def chunk_text(text, chunk_size=2000):
-    words = text.split()
-    chunks = [' '.join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
-    return chunks
+# Function to split text into lowercase search terms (words of 3+ characters)
+def search_terms(text):
+    return [term for term in re.findall(r"\w+", text.lower()) if len(term) > 2]
+
+# Function to pick the top_k chunks most related to the question with a local
+# TF-IDF score (no API calls); they are returned in document order
+def rank_chunks(question, chunks, top_k=MAP_TOP_K):
+    question_terms = set(search_terms(question))
+    if not question_terms:
+        return chunks[:top_k]
+    term_counts = [Counter(term for term in search_terms(chunk) if term in question_terms) for chunk in chunks]
+    doc_freq = Counter(term for counts in term_counts for term in counts)
+    scores = [
+        sum((1 + math.log(count)) * math.log(1 + len(chunks) / doc_freq[term]) for term, count in counts.items())
+        for counts in term_counts
+    ]
+    best = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))[:top_k]
+    return [chunks[i] for i in sorted(best)]
+
+# Function to answer with map-reduce: the most relevant chunks are asked in
+# parallel (map) and their partial answers merged in one final call (reduce)
+def generate_response_map_reduce(input_text, pages, openai_api_key, on_partial=None, no_answer=""):
+    chunks = rank_chunks(input_text, list(iter_word_chunks(pages, CHUNK_WORDS)))
+    if not chunks:
+        return no_answer
+    llm = get_llm(openai_api_key, temperature=0.7, max_tokens=1500, source="doc4chat")
+    map_prompts = [
+        f"Based only on the following excerpt of a document:\n\n{chunk}\n\n"
+        f"Answer the following question:\n\n{input_text}\n\n"
+        f"If the excerpt has no information to answer it, reply exactly {NO_INFO_MARKER}."
+        for chunk in chunks
+    ]
+    with ThreadPoolExecutor(max_workers=min(MAP_MAX_CONCURRENCY, len(map_prompts))) as executor:
+        partials = [answer.strip() for answer in executor.map(llm, map_prompts)]
+    partials = [answer for answer in partials if answer and NO_INFO_MARKER not in answer]
+    if not partials:
+        return no_answer
+    if len(partials) == 1:
+        return partials[0]
+    if on_partial:
+        on_partial("\n\n".join(partials))
+    numbered = "\n\n".join(f"Partial answer {i}:\n{answer}" for i, answer in enumerate(partials, 1))
+    reduce_prompt = (
+        f"The following partial answers were obtained from different excerpts of the same document:\n\n"
+        f"{numbered}\n\nCombine them into a single, clear and concise answer to the question:\n\n{input_text}"
+    )
+    return llm(reduce_prompt)
 
-# Function to generate response using ChatGPT based on PDF content
-def generate_response(input_text, pdf_text, openai_api_key):
-    chunks = chunk_text(pdf_text)
-    llm = OpenAI(openai_api_key=openai_api_key, temperature=0.7, max_tokens=1500)
+# Function to generate response using ChatGPT based on PDF content.
+# Chunks are consumed as pages are parsed, so the first partial answer is shown
+# (via on_partial) before the last page of a long PDF has been read.
+def generate_response(input_text, pages, openai_api_key, on_partial=None):
+    llm = get_llm(openai_api_key, temperature=0.7, max_tokens=1500, source="doc4chat")
     response = ""
-    for chunk in chunks:
+    for chunk in iter_word_chunks(pages, CHUNK_WORDS):
         prompt = f"Based on the following document:\n\n{chunk}\n\nAnswer the following question:\n\n{input_text}"
         response_chunk = llm(prompt)
         response += response_chunk + "\n"
+        if on_partial:
+            on_partial(response)
         if input_text.lower() in response_chunk.lower():
             break
     return response
@@ -110,6 +178,11 @@ def generate_response(input_text, pdf_text, openai_api_key):
 openai_api_key = st.sidebar.text_input(T["sidebar_api"], type='password')
 st.sidebar.write(T["sidebar_get_key"])
 st.sidebar.markdown(T["sidebar_get_key_link"])
+answer_mode = st.sidebar.radio(
+    T["mode_label"],
+    ["map_reduce", "sequential"],
+    format_func=lambda mode: T[f"mode_{mode}"]
+)
 
 st.markdown(
         f"""
@@ -136,9 +209,6 @@ st.sidebar.markdown(T["sidebar_powered"], unsafe_allow_html=True)
 uploaded_file = st.file_uploader(T["upload_label"], type="pdf")
 
 if uploaded_file is not None:
-    # Extract text from the uploaded PDF file
-    pdf_text = extract_text_from_pdf(uploaded_file)
-
     st.warning(T["welcome"])
 
     user_input = st.text_input(T["you"], "")
@@ -146,8 +216,14 @@ if uploaded_file is not None:
     if st.button(T["ask"]):
         if user_input:
             if openai_api_key:
-                response = generate_response(user_input, pdf_text, openai_api_key)
-                st.info(f"{T['response_prefix']} {response}")
+                answer_box = st.empty()
+                show_answer = lambda text: answer_box.info(f"{T['response_prefix']} {text}")
+                pages = iter_pdf_pages_cached(uploaded_file)
+                if answer_mode == "map_reduce":
+                    response = generate_response_map_reduce(user_input, pages, openai_api_key, show_answer, T["no_answer"])
+                else:
+                    response = generate_response(user_input, pages, openai_api_key, show_answer)
+                show_answer(response)
             else:
                 st.error(T["error_api"])
                 st.error(T["error_api"])
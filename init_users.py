@@ -3,18 +3,12 @@
 Script para inicializar usuarios del sistema CRM
 """
 
-import sqlite3
 import uuid
 import hashlib
 import secrets
 from datetime import date
 
-DB_PATH = "muyu_crm.db"
-
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-    conn.row_factory = sqlite3.Row
-    return conn
+from db.connection import get_conn
 
 def hash_password(password: str, salt: str = None) -> tuple:
     """Hash password using SHA-256 with salt"""
@@ -1,5 +1,5 @@
 import streamlit as st
-from langchain.llms import OpenAI
+from modules.llm_gateway import get_llm
 
 def content_manager_dashboard():
     st.header("Asesor Experto en Creación de Contenidos para Manejo de Clientes")
@@ -36,7 +36,7 @@ def content_manager_dashboard():
                 f"Consulta: {user_question}\n\nRespuesta:"
             )
             # Aumenta el límite de tokens para respuestas más largas
-            llm = OpenAI(openai_api_key=openai_api_key, temperature=0.7, max_tokens=1500)
+            llm = get_llm(openai_api_key, temperature=0.7, max_tokens=1500, source="content_manager")
             with st.spinner("Consultando al asesor experto..."):
                 try:
                     respuesta = llm(prompt)
@@ -1,33 +1,112 @@
 import streamlit as st
 import pandas as pd
-import json
-from langchain.llms import OpenAI
-import smtplib
-from email.mime.text import MIMEText
+import sqlite3
+import time
+from modules.llm_gateway import get_llm
+from modules.table_context import build_table_context, column_summaries
+from modules.table_ingest import content_key, load_uploaded_table
+from modules.table_profile import clean_emails, profile_table
+from modules.table_query import answer_table_question
+from modules.value_index import build_value_index
+from db.campaigns import (CAMPAIGN_ACTIVE, CAMPAIGN_CANCELLED, CAMPAIGN_PAUSED, DEFAULT_MAX_PER_MINUTE,
+                          cancel_campaign, create_campaign, create_campaign_tables, get_campaign_report,
+                          set_campaign_status)
+from db.connection import connection
+from db.email_outbox import create_email_outbox, register_smtp_account, start_email_worker
 
-def send_mass_email(subject, body, recipients):
-    # Usa las credenciales de st.secrets
+# Presupuesto de tokens del contexto de la tabla en el chat
+SAMPLE_TOKEN_BUDGET = 3000
+FULL_TABLE_TOKEN_BUDGET = 12000
+
+def _campaign_account_ready():
+    """Registrar la cuenta de campañas y arrancar el pool de envío"""
     EMAIL_USER = st.secrets.get("EMAIL_USER")
     EMAIL_PASS = st.secrets.get("EMAIL_PASS")
     if not EMAIL_USER or not EMAIL_PASS:
         st.error("No se encontraron credenciales de email en st.secrets.")
         return False
+    # Solo las tablas de envío: esta app no crea institutions, de la que dependen las demás migraciones
+    try:
+        with connection() as conn:
+            create_email_outbox(conn)
+            create_campaign_tables(conn)
+    except sqlite3.Error as e:
+        st.error(f"❌ No se pudo preparar la cola de emails: {e}")
+        return False
+    register_smtp_account(
+        'campanas', EMAIL_USER, EMAIL_PASS,
+        host=st.secrets.get("SMTP_HOST", "smtp.gmail.com"),
+        port=st.secrets.get("SMTP_PORT", 587),
+        starttls=st.secrets.get("SMTP_STARTTLS", True),
+        max_per_minute=st.secrets.get("EMAIL_MAX_PER_MINUTE", DEFAULT_MAX_PER_MINUTE)
+    )
+    start_email_worker()
+    return True
 
+def launch_campaign(df, email_column, subject, body, max_per_minute=DEFAULT_MAX_PER_MINUTE, name=None):
+    """Crear la campaña en segundo plano y recordar su id para mostrar el progreso"""
+    if not _campaign_account_ready():
+        return False
     try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASS)
-        for recipient in recipients:
-            msg = MIMEText(body, "plain", "utf-8")
-            msg["Subject"] = subject
-            msg["From"] = EMAIL_USER
-            msg["To"] = recipient
-            server.sendmail(EMAIL_USER, recipient, msg.as_string())
-        server.quit()
-        return True
-    except Exception as e:
-        st.error(f"Error enviando emails: {e}")
+        campaign_id, skipped = create_campaign(
+            df, email_column, subject, body, name=name,
+            max_per_minute=max_per_minute,
+            created_by=st.session_state.get('username')
+        )
+    except (ValueError, sqlite3.Error) as e:
+        st.error(f"❌ {e}")
+        return False
+    if skipped:
+        st.warning(f"⚠️ {len(skipped)} filas omitidas (emails vacíos, no válidos o duplicados)")
+    if campaign_id is None:
+        st.warning("No hay destinatarios válidos.")
         return False
+    st.session_state.active_campaign_id = campaign_id
+    return True
+
+def send_mass_email(subject, body, recipients):
+    # El mismo mensaje a una lista de emails: campaña sin marcadores
+    recipients_df = pd.DataFrame({'email': list(recipients)})
+    return launch_campaign(recipients_df, 'email', subject.replace('{', '{{').replace('}', '}}'),
+                           body.replace('{', '{{').replace('}', '}}'))
+
+def show_campaign_progress():
+    """Progreso de la última campaña lanzada, con pausa/reanudar/cancelar"""
+    campaign_id = st.session_state.get('active_campaign_id')
+    if campaign_id is None:
+        return
+    report = get_campaign_report(campaign_id)
+    if report is None:
+        return
+    counts = report['counts']
+    sent = counts.get('enviado', 0)
+    failed = counts.get('error', 0)
+    total = report['total_recipients'] or 1
+    st.markdown(f"### 📬 {report['name']} — {report['status']}")
+    st.progress(min((sent + failed) / total, 1.0))
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Enviados", sent)
+    col2.metric("Pendientes", counts.get('pendiente', 0) + counts.get('enviando', 0))
+    col3.metric("Con error", failed)
+    col4.metric("Cancelados", counts.get('cancelado', 0))
+    if report['finished']:
+        st.success(f"✅ Campaña terminada: {sent} de {report['total_recipients']} enviados.")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.button("🔄 Actualizar progreso", key="campaign_refresh")
+    if not report['finished'] and report['status'] != CAMPAIGN_CANCELLED:
+        with col2:
+            if report['status'] == CAMPAIGN_PAUSED:
+                if st.button("▶️ Reanudar", key="campaign_resume"):
+                    set_campaign_status(campaign_id, CAMPAIGN_ACTIVE)
+                    st.rerun()
+            elif st.button("⏸️ Pausar", key="campaign_pause"):
+                set_campaign_status(campaign_id, CAMPAIGN_PAUSED)
+                st.rerun()
+        with col3:
+            if st.button("⛔ Cancelar campaña", key="campaign_cancel"):
+                cancel_campaign(campaign_id)
+                st.rerun()
 
 def crm_dashboard():
     # --- Sidebar: API Key ---
@@ -55,28 +134,39 @@ def crm_dashboard():
         type=["csv", "xlsx", "xls", "json", "parquet"]
     )
 
-    def load_table(file):
+    def load_table(file, data):
         try:
-            if file.name.endswith(".csv"):
-                return pd.read_csv(file)
-            elif file.name.endswith(".xlsx") or file.name.endswith(".xls"):
-                return pd.read_excel(file)
-            elif file.name.endswith(".json"):
-                return pd.read_json(file)
-            elif file.name.endswith(".parquet"):
-                return pd.read_parquet(file)
-            else:
-                st.error("Formato de archivo no soportado.")
-                return None
+            return load_uploaded_table(file.name, data)
         except Exception as e:
             st.error(f"❌ Error al procesar el archivo: {e}")
-            return None
+            return None, None
 
     if uploaded_table:
-        df = load_table(uploaded_table)
+        # La tabla, su resumen, su índice de valores y el perfil de columnas se calculan una vez por archivo, no en cada rerun;
+        # el archivo ya parseado queda además en la caché en disco (Parquet) para otras sesiones
+        # Clave por contenido: otro archivo con el mismo nombre y tamaño no reutiliza la tabla anterior
+        data = uploaded_table.getvalue()
+        table_key = (uploaded_table.name, content_key(data))
+        if st.session_state.get("tabular_file_key") == table_key and "tabular_data" in st.session_state:
+            df = st.session_state.tabular_data
+        else:
+            df, info = load_table(uploaded_table, data)
+            if df is not None:
+                st.session_state.tabular_data = df
+                st.session_state.tabular_summaries = column_summaries(df)
+                st.session_state.tabular_value_index = build_value_index(df)
+                st.session_state.tabular_profile = profile_table(df)
+                st.session_state.tabular_file_key = table_key
+                st.session_state.tabular_ingest_info = info
         if df is not None:
-            st.session_state.tabular_data = df
             st.success(f"✅ Datos cargados ({len(df)} filas, {len(df.columns)} columnas)")
+            info = st.session_state.get("tabular_ingest_info")
+            if info:
+                origen = "Leídos de la caché" if info['cached'] else "Procesados"
+                st.caption(
+                    f"{origen}: {info['optimized_bytes'] / 1e6:.1f} MB en memoria "
+                    f"({info['saved_bytes'] / 1e6:.1f} MB menos con tipos compactos)."
+                )
             # Mostrar la tabla dentro de un expander
             with st.expander("Ver tabla completa", expanded=False):
                 st.dataframe(df, use_container_width=True, height=500)
@@ -84,24 +174,31 @@ def crm_dashboard():
     # --- Envío masivo de emails ---
     if "tabular_data" in st.session_state:
         df = st.session_state.tabular_data
-        email_columns = [col for col in df.columns if "mail" in col.lower() or "email" in col.lower()]
+        # Columnas de emails, nombres, teléfonos y fechas detectadas al cargar la tabla
+        profile = st.session_state.get("tabular_profile")
+        if profile is None:
+            profile = st.session_state.tabular_profile = profile_table(df)
+        email_columns = profile['email']
         if email_columns:
             st.markdown("### Enviar email masivo a prospectos")
+            st.caption("Personaliza el asunto y el mensaje con columnas de la tabla, p. ej. {" + str(df.columns[0]) + "}. "
+                       "El envío se hace en segundo plano; puedes seguir usando la aplicación.")
             with st.form("mass_email_form"):
+                campaign_name = st.text_input("Nombre de la campaña (opcional)")
                 subject = st.text_input("Asunto del email")
                 body = st.text_area("Mensaje a enviar")
                 selected_col = st.selectbox("Columna de emails", email_columns)
+                max_per_minute = st.number_input("Máximo de emails por minuto", min_value=1, max_value=300,
+                                                 value=DEFAULT_MAX_PER_MINUTE)
                 submit_email = st.form_submit_button("Enviar email masivo")
                 if submit_email:
-                    recipients = df[selected_col].dropna().unique().tolist()
                     if not subject or not body:
                         st.warning("Debes completar el asunto y el mensaje.")
-                    elif not recipients:
+                    elif not profile['recipients'][selected_col]:
                         st.warning("No se encontraron emails en la columna seleccionada.")
-                    else:
-                        ok = send_mass_email(subject, body, recipients)
-                        if ok:
-                            st.success(f"Emails enviados a {len(recipients)} prospectos.")
+                    elif launch_campaign(df, selected_col, subject, body, max_per_minute, campaign_name or None):
+                        st.success("📬 Campaña en cola: los emails se están enviando en segundo plano.")
+            show_campaign_progress()
         else:
             st.info("No se detectó ninguna columna de emails en la tabla.")
 
@@ -114,8 +211,7 @@ def crm_dashboard():
 
         # Detecta si el usuario pide enviar un email a una persona específica
         import re
-        email_columns = [col for col in df.columns if "mail" in col.lower() or "email" in col.lower()]
-        name_columns = [col for col in df.columns if "nombre" in col.lower() or "name" in col.lower()]
+        name_columns = profile['name']
         match = re.search(r"manda un mail a ([\w\s]+) con el asunto: (.+?) y el mensaje: (.+)", user_input, re.IGNORECASE)
         if match and email_columns and name_columns:
             persona = match.group(1).strip()
@@ -124,7 +220,7 @@ def crm_dashboard():
             # Busca la persona en la tabla (ignora mayúsculas/minúsculas)
             df_match = df[df[name_columns[0]].str.lower().str.contains(persona.lower(), na=False)]
             if not df_match.empty:
-                destinatarios = df_match[email_columns[0]].dropna().unique().tolist()
+                destinatarios = clean_emails(df_match[email_columns[0]])
                 if destinatarios:
                     send_email_from_chat = True
                     chat_email_info = {
@@ -140,23 +236,6 @@ def crm_dashboard():
 
         # NUEVO: Detectar si el usuario pide email masivo a todos los prospectos
         trigger_mass_email_form = False
-        # Buscar columnas candidatas a emails de forma más flexible
-        def is_email_column(col):
-            col_lower = col.lower()
-            keywords = [
-                "mail", "email", "correo", "e-mail", "e_mail", "e mail", "direccion", "contacto"
-            ]
-            # Considera columnas que tengan palabras clave y al menos un valor con un '@'
-            if any(kw in col_lower for kw in keywords):
-                return True
-            # También revisa si la mayoría de los valores parecen emails
-            sample = df[col].dropna().astype(str).head(20)
-            if sample.apply(lambda x: "@" in x and "." in x).sum() > 0:
-                return True
-            return False
-
-        # Encuentra todas las columnas candidatas a emails
-        email_columns = [col for col in df.columns if is_email_column(col)]
         mass_email_keywords = [
             "manda un email masivo", "enviar email masivo", "envía un email masivo",
             "manda un correo masivo", "enviar correo masivo", "envía un correo masivo",
@@ -181,7 +260,7 @@ def crm_dashboard():
                     else:
                         ok = send_mass_email(subject, body, recipients)
                         if ok:
-                            st.success(f"Email enviado a {', '.join(recipients)}.")
+                            st.success(f"📬 Email en cola para {', '.join(recipients)}.")
         elif trigger_mass_email_form:
             st.markdown("### Enviar email masivo a prospectos (detectado desde el chat)")
             if email_columns:
@@ -190,7 +269,7 @@ def crm_dashboard():
                     body = st.text_area("Mensaje a enviar", key="mass_body_chat", value="hola!")
                     selected_col = st.selectbox("Columna de emails", email_columns, key="mass_col_chat")
                     # NUEVO: Selección de prospectos específicos
-                    all_prospectos = df[selected_col].dropna().unique().tolist()
+                    all_prospectos = profile['recipients'][selected_col]
                     selected_prospectos = st.multiselect(
                         "Selecciona los prospectos a los que quieres enviar el email (deja vacío para enviar a todos)",
                         all_prospectos,
@@ -206,7 +285,7 @@ def crm_dashboard():
                         else:
                             ok = send_mass_email(subject, body, recipients)
                             if ok:
-                                st.success(f"Emails enviados a {len(recipients)} prospectos.")
+                                st.success(f"📬 Emails en cola para {len(recipients)} prospectos.")
             else:
                 # Si no se detectan columnas candidatas, muestra todas las columnas para que el usuario elija
                 st.info("No se detectó ninguna columna de emails en la tabla. Selecciona manualmente la columna que contiene los emails.")
@@ -215,9 +294,8 @@ def crm_dashboard():
                     body = st.text_area("Mensaje a enviar", key="mass_body_chat_manual", value="hola!")
                     selected_col = st.selectbox("Selecciona la columna que contiene los emails", list(df.columns), key="mass_col_chat_manual")
                     # NUEVO: Selección de prospectos específicos
-                    all_prospectos = df[selected_col].dropna().unique().tolist()
-                    # Filtra solo los que parecen emails
-                    all_prospectos = [r for r in all_prospectos if "@" in str(r) and "." in str(r)]
+                    # Solo direcciones válidas, normalizadas y sin duplicados
+                    all_prospectos = clean_emails(df[selected_col])
                     selected_prospectos = st.multiselect(
                         "Selecciona los prospectos a los que quieres enviar el email (deja vacío para enviar a todos)",
                         all_prospectos,
@@ -233,7 +311,7 @@ def crm_dashboard():
                         else:
                             ok = send_mass_email(subject, body, recipients)
                             if ok:
-                                st.success(f"Emails enviados a {len(recipients)} prospectos.")
+                                st.success(f"📬 Emails en cola para {len(recipients)} prospectos.")
         else:
             # NUEVO: Permitir al usuario elegir si quiere enviar toda la tabla al modelo
             use_full_table = False
@@ -256,19 +334,15 @@ def crm_dashboard():
             selected_row_info = ""
             # Buscar columnas relevantes
             search_columns = list(df.columns)
-            # Buscar si el prompt menciona un valor de columna
-            for col in search_columns:
-                for val in df[col].dropna().unique():
-                    val_str = str(val).strip().lower()
-                    if val_str and val_str in user_input.lower():
-                        selected_row = df[df[col].astype(str).str.lower() == val_str]
-                        selected_col = col
-                        selected_value = val
-                        if not selected_row.empty:
-                            selected_row_info = f"Se ha detectado que tu pregunta se refiere a la fila donde '{col}' = '{val}'. "
-                            break
-                if selected_row is not None and not selected_row.empty:
-                    break
+            # Buscar si el prompt menciona un valor de columna (índice de valores creado al cargar la tabla)
+            value_index = st.session_state.get("tabular_value_index")
+            if value_index is None or value_index.columns != search_columns:
+                value_index = st.session_state.tabular_value_index = build_value_index(df)
+            match = value_index.find(user_input)
+            if match:
+                selected_col, selected_value, positions = match
+                selected_row = df.iloc[positions]
+                selected_row_info = f"Se ha detectado que tu pregunta se refiere a la fila donde '{selected_col}' = '{selected_row.iloc[0][selected_col]}'. "
 
             # Buscar si el usuario pregunta por una columna específica
             col_in_prompt = None
@@ -293,97 +367,73 @@ def crm_dashboard():
                     list_column = col
                     break
 
-            # NUEVO: Detectar si el usuario pregunta por el número de filas de la tabla
-            count_rows_keywords = [
-                "cuántas filas", "cuantas filas", "número de filas", "numero de filas",
-                "cuántos registros", "cuantos registros", "número de registros", "numero de registros",
-                "cuántos datos", "cuantos datos", "cuántos hay en la tabla", "cuantos hay en la tabla"
-            ]
-            ask_count_rows = any(kw in user_input.lower() for kw in count_rows_keywords)
-
             if st.button("Preguntar", key="tabular_chat_button"):
-                if not openai_api_key:
-                    st.error("Por favor, ingresa tu OpenAI API Key en la barra lateral.")
-                elif not user_input:
+                # Conteos, sumas, promedios, filtros, agrupaciones y top-N se resuelven
+                # localmente con pandas, sin llamar a OpenAI
+                started = time.perf_counter()
+                local_answer = answer_table_question(df, user_input, value_index) if user_input else None
+                if not user_input:
                     st.warning("Escribe una pregunta.")
+                elif local_answer is not None:
+                    answer_text, answer_table = local_answer
+                    st.info(answer_text)
+                    if answer_table is not None:
+                        st.dataframe(answer_table, use_container_width=True, hide_index=True)
+                    st.caption(f"Respondido localmente en {(time.perf_counter() - started) * 1000:.0f} ms, sin llamar a la IA.")
+                elif not openai_api_key:
+                    st.error("Por favor, ingresa tu OpenAI API Key en la barra lateral.")
                 else:
-                    columns = list(df.columns)
-                    # Si el usuario pregunta por el número de filas, responde directamente sin usar OpenAI
-                    if ask_count_rows:
-                        st.info(f"La tabla tiene {len(df)} filas.")
-                        return
+                    # El contexto se arma dentro de un presupuesto de tokens con las filas y
+                    # columnas más relacionadas con la pregunta (TSV compacto + resumen por columna)
+                    summaries = st.session_state.get("tabular_summaries")
+                    if summaries is None or set(summaries) != set(df.columns):
+                        summaries = column_summaries(df)
+                    token_budget = FULL_TABLE_TOKEN_BUDGET if use_full_table else SAMPLE_TOKEN_BUDGET
                     # Si el usuario pide una lista de una columna (como correos)
                     if list_column:
-                        values = df[list_column].dropna().tolist()
+                        table_context, info = build_table_context(
+                            df[[list_column]], user_input, FULL_TABLE_TOKEN_BUDGET,
+                            summaries={list_column: summaries[list_column]}
+                        )
                         muestra_texto = (
                             f"Has solicitado todos los registros de la columna '{list_column}'. "
                             f"Solo se ha enviado esa columna al modelo para evitar errores de límite de tokens."
                         )
-                        context = (
-                            f"Tienes una tabla con las siguientes columnas: {columns}.\n"
-                            f"A continuación tienes todos los valores de la columna '{list_column}':\n"
-                            f"{json.dumps(values, ensure_ascii=False, indent=2, default=str)}\n"
-                            f"{muestra_texto}\n"
-                            f"Responde la siguiente pregunta del usuario sobre estos datos."
-                        )
-                    # Si se detecta fila y columna específica, solo enviar ese dato
+                    # Si se detecta fila y columna específica, esa fila y columna van primero
                     elif selected_row is not None and not selected_row.empty and col_in_prompt:
-                        cell_value = selected_row.iloc[0][col_in_prompt]
-                        data_to_send = {
-                            "columna": col_in_prompt,
-                            "valor": cell_value,
-                            "toda_la_fila": selected_row.iloc[0].to_dict()
-                        }
+                        table_context, info = build_table_context(
+                            df, user_input, token_budget, focus_rows=selected_row.index,
+                            focus_columns=[col_in_prompt], summaries=summaries
+                        )
                         muestra_texto = (
                             f"{selected_row_info}\n"
-                            f"Además, se ha detectado que preguntas por la columna '{col_in_prompt}'. "
-                            f"Solo se ha enviado ese dato y la fila correspondiente al modelo para evitar errores de límite de tokens."
-                        )
-                        context = (
-                            f"Tienes una tabla con las siguientes columnas: {columns}.\n"
-                            f"A continuación tienes el valor solicitado:\n"
-                            f"Columna: {col_in_prompt}\nValor: {cell_value}\n"
-                            f"Fila completa: {json.dumps(selected_row.iloc[0].to_dict(), ensure_ascii=False, indent=2, default=str)}\n"
-                            f"{muestra_texto}\n"
-                            f"Responde la siguiente pregunta del usuario sobre este dato."
+                            f"Además, se ha detectado que preguntas por la columna '{col_in_prompt}' "
+                            f"(valor: {selected_row.iloc[0][col_in_prompt]})."
                         )
                     # Si solo se detecta una fila relevante
                     elif selected_row is not None and not selected_row.empty:
-                        data_to_send = selected_row.to_dict(orient="records")
-                        muestra_texto = (
-                            f"{selected_row_info}\n"
-                            f"Solo se ha enviado una muestra de 10 filas. "
-                            f"Si necesitas analizar toda la tabla, marca la casilla correspondiente."
-                        )
-                        context = (
-                            f"Tienes una tabla con las siguientes columnas: {columns}.\n"
-                            f"Aquí tienes los datos:\n{json.dumps(data_to_send, ensure_ascii=False, indent=2, default=str)}\n"
-                            f"{muestra_texto}\n"
-                            f"Responde la siguiente pregunta del usuario sobre estos datos."
-                        )
-                    elif use_full_table:
-                        data_to_send = df.to_dict(orient="records")
-                        muestra_texto = f"Se ha enviado toda la tabla ({len(df)} filas)."
-                        context = (
-                            f"Tienes una tabla con las siguientes columnas: {columns}.\n"
-                            f"Aquí tienes los datos:\n{json.dumps(data_to_send, ensure_ascii=False, indent=2, default=str)}\n"
-                            f"{muestra_texto}\n"
-                            f"Responde la siguiente pregunta del usuario sobre estos datos."
+                        table_context, info = build_table_context(
+                            df, user_input, token_budget, focus_rows=selected_row.index, summaries=summaries
                         )
+                        muestra_texto = selected_row_info
                     else:
-                        data_to_send = df.head(10).to_dict(orient="records")
-                        muestra_texto = (
-                            f"Solo se ha enviado una muestra de 10 filas. "
-                            f"Si necesitas analizar toda la tabla, marca la casilla correspondiente."
-                        )
-                        context = (
-                            f"Tienes una tabla con las siguientes columnas: {columns}.\n"
-                            f"Aquí tienes los datos:\n{json.dumps(data_to_send, ensure_ascii=False, indent=2, default=str)}\n"
-                            f"{muestra_texto}\n"
-                            f"Responde la siguiente pregunta del usuario sobre estos datos."
+                        table_context, info = build_table_context(df, user_input, token_budget, summaries=summaries)
+                        muestra_texto = ""
+                    if info['rows'] < info['total_rows']:
+                        muestra_texto += (
+                            f" Se han enviado {info['rows']} de {info['total_rows']} filas (las más relacionadas "
+                            f"con la pregunta) y un resumen de cada columna."
                         )
+                        if not use_full_table:
+                            muestra_texto += " Si necesitas analizar más filas, marca la casilla correspondiente."
+                    st.caption(f"Contexto enviado: {info['rows']} filas, {len(info['columns'])} columnas, ~{info['tokens']} tokens.")
+                    context = (
+                        f"{table_context}\n"
+                        f"{muestra_texto.strip()}\n"
+                        f"Responde la siguiente pregunta del usuario sobre estos datos."
+                    )
                     prompt = f"{context}\n\nPregunta: {user_input}\nRespuesta:"
-                    llm = OpenAI(openai_api_key=openai_api_key, temperature=0.2)
+                    llm = get_llm(openai_api_key, temperature=0.2, source="crm")
                     with st.spinner("Consultando a la IA..."):
                         try:
                             response = llm(prompt)
@@ -401,7 +451,7 @@ def crm_dashboard():
                         selected_col = st.selectbox("Columna de emails (rápido)", email_columns, key="quick_col")
                         submit_quick = st.form_submit_button("Enviar email rápido")
                         if submit_quick:
-                            recipients = df[selected_col].dropna().unique().tolist()
+                            recipients = profile['recipients'][selected_col]
                             if not subject or not body:
                                 st.warning("Debes completar el asunto y el mensaje.")
                             elif not recipients:
@@ -409,7 +459,7 @@ def crm_dashboard():
                             else:
                                 ok = send_mass_email(subject, body, recipients)
                                 if ok:
-                                    st.success(f"Emails enviados a {len(recipients)} prospectos.")
+                                    st.success(f"📬 Emails en cola para {len(recipients)} prospectos.")
                 else:
                     st.info("No se detectó ninguna columna de emails en la tabla.")
     else:
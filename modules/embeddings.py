@@ -0,0 +1,127 @@
+"""
+Motores de embeddings intercambiables para el PDF Viewer.
+
+Todos exponen la interfaz de LangChain (embed_documents / embed_query), así
+que alimentan el mismo índice FAISS y la caché de modules/vector_cache.py:
+
+- 'openai': OpenAIEmbeddings (requiere API Key y red).
+- 'local': vectorizador por hashing de palabras y bigramas calculado con
+  NumPy en lotes; no necesita red ni modelos descargados.
+- 'local-modelo': modelo sentence-transformers pequeño, solo si la
+  librería está instalada en la máquina.
+"""
+
+import hashlib
+import importlib.util
+import re
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+HASHING_DIM = 1024
+HASHING_BATCH = 256
+LOCAL_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def _normalize_text(text):
+    """Minúsculas y sin tildes, para que 'Matrícula' y 'matricula' coincidan"""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+@lru_cache(maxsize=200000)
+def _feature_slot(feature, dim):
+    """Columna y signo de un término (hashing trick con signo)"""
+    digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+    return digest % dim, 1.0 if (digest >> 63) else -1.0
+
+
+class HashingEmbeddings(Embeddings):
+    """Embeddings locales: conteo de palabras y bigramas proyectado por hashing,
+    escalado sublineal (log1p) y normalizado L2, de modo que la distancia L2
+    de FAISS ordena igual que la similitud coseno"""
+
+    def __init__(self, dim=HASHING_DIM, batch_size=HASHING_BATCH):
+        self.dim = dim
+        self.batch_size = batch_size
+        self.model = f'hashing-{dim}'
+
+    def _features(self, text):
+        tokens = _TOKEN_RE.findall(_normalize_text(text))
+        return tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+
+    def _embed_batch(self, texts):
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                col, sign = _feature_slot(feature, self.dim)
+                rows.append(row)
+                cols.append(col)
+                signs.append(sign)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)),
+                  np.asarray(signs, dtype=np.float32))
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0].tolist()
+
+
+def local_model_available():
+    """True si sentence-transformers está instalado"""
+    return importlib.util.find_spec('sentence_transformers') is not None
+
+
+def _openai_embeddings(api_key):
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=api_key)
+
+
+def _local_model_embeddings(api_key=None):
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=LOCAL_MODEL_NAME, encode_kwargs={'normalize_embeddings': True})
+
+
+# nombre: (etiqueta, constructor(api_key), requiere API Key)
+EMBEDDING_BACKENDS = {
+    'openai': ('OpenAI (en línea)', _openai_embeddings, True),
+    'local': ('Local por hashing (sin red)', lambda api_key=None: HashingEmbeddings(), False),
+    'local-modelo': ('Modelo local sentence-transformers', _local_model_embeddings, False),
+}
+
+
+def available_backends():
+    """Motores que se pueden usar en esta máquina"""
+    return [name for name in EMBEDDING_BACKENDS if name != 'local-modelo' or local_model_available()]
+
+
+def backend_requires_api_key(backend):
+    return EMBEDDING_BACKENDS[backend][2]
+
+
+def get_embeddings(backend='openai', api_key=None):
+    """Instancia del motor de embeddings indicado.
+
+    Raises:
+        ValueError: si el motor no existe o le falta la API Key.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Motor de embeddings desconocido: {backend}")
+    _, factory, needs_key = EMBEDDING_BACKENDS[backend]
+    if needs_key and not api_key:
+        raise ValueError("Ingresa tu API Key de OpenAI.")
+    return factory(api_key)
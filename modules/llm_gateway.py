@@ -0,0 +1,208 @@
+"""
+Punto único de acceso al LLM con caché persistente de respuestas.
+
+get_llm() devuelve un objeto que se llama igual que OpenAI(...)(prompt),
+pero antes busca la respuesta en un SQLite local por (modelo,
+temperatura, max_tokens, hash del prompt normalizado). Las entradas
+caducan a los CACHE_TTL_SECONDS y, si se supera CACHE_MAX_ENTRIES, se
+eliminan las menos usadas recientemente (LRU). Cada acierto o fallo se
+contabiliza por módulo (source) junto con la latencia ahorrada.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+LLM_CACHE_DIR = os.environ.get('MUYU_LLM_CACHE_DIR', '.cache')
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+CACHE_MAX_ENTRIES = 5000
+DEFAULT_MODEL = 'openai-default'
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+
+def normalize_prompt(prompt):
+    """Prompt sin espacios repetidos ni saltos de línea sobrantes"""
+    return _WHITESPACE_RE.sub(' ', str(prompt)).strip()
+
+
+def cache_key(prompt, model, temperature, max_tokens=None):
+    """Clave de la caché: modelo, parámetros y hash del prompt normalizado"""
+    raw = f"{model}\0{float(temperature)}\0{max_tokens}\0{normalize_prompt(prompt)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """Respuestas del LLM en SQLite con TTL y expulsión LRU"""
+
+    def __init__(self, cache_dir=LLM_CACHE_DIR, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.path = os.path.join(cache_dir, 'llm_responses.db')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        with _schema_lock:
+            if self.path not in _schema_ready:
+                os.makedirs(cache_dir, exist_ok=True)
+                with self._connect() as conn:
+                    self._create_tables(conn)
+                _schema_ready.add(self.path)
+
+    @contextmanager
+    def _connect(self):
+        """Conexión de una operación: confirma (o deshace) y se cierra siempre al salir"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_tables(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                latency_ms REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_responses_last_used ON llm_responses(last_used_at)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache_metrics (
+                source TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0,
+                saved_ms REAL NOT NULL DEFAULT 0,
+                miss_ms REAL NOT NULL DEFAULT 0
+            )
+        ''')
+
+    def _record(self, conn, source, hit, latency_ms):
+        conn.execute('''
+            INSERT INTO llm_cache_metrics (source, hits, misses, saved_ms, miss_ms) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET
+                hits = hits + excluded.hits,
+                misses = misses + excluded.misses,
+                saved_ms = saved_ms + excluded.saved_ms,
+                miss_ms = miss_ms + excluded.miss_ms
+        ''', (source, int(hit), int(not hit), latency_ms if hit else 0, 0 if hit else latency_ms))
+
+    def get(self, key, source=''):
+        """Respuesta guardada (None si no existe o caducó); cuenta el acierto"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT response, latency_ms, created_at FROM llm_responses WHERE key = ?',
+                               (key,)).fetchone()
+            if row is None:
+                return None
+            response, latency_ms, created_at = row
+            if now - created_at > self.ttl:
+                conn.execute('DELETE FROM llm_responses WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE llm_responses SET last_used_at = ?, hits = hits + 1 WHERE key = ?', (now, key))
+            self._record(conn, source, True, latency_ms)
+        return response
+
+    def put(self, key, model, response, latency_ms, source=''):
+        """Guardar una respuesta nueva (cuenta el fallo) y aplicar el límite de tamaño"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO llm_responses (key, model, response, latency_ms, created_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+            ''', (key, model, response, latency_ms, now, now))
+            self._record(conn, source, False, latency_ms)
+            conn.execute('DELETE FROM llm_responses WHERE created_at < ?', (now - self.ttl,))
+            conn.execute('''
+                DELETE FROM llm_responses WHERE key IN (
+                    SELECT key FROM llm_responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+    def metrics(self):
+        """Aciertos, fallos y latencia ahorrada por módulo"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT source, hits, misses, saved_ms, miss_ms FROM llm_cache_metrics ORDER BY source')
+            metrics = []
+            for source, hits, misses, saved_ms, miss_ms in rows:
+                total = hits + misses
+                metrics.append({
+                    'source': source,
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': hits / total if total else 0.0,
+                    'saved_seconds': saved_ms / 1000,
+                    'avg_miss_seconds': miss_ms / 1000 / misses if misses else 0.0,
+                })
+            entries = conn.execute('SELECT COUNT(*) FROM llm_responses').fetchone()[0]
+        return {'entries': entries, 'sources': metrics}
+
+    def clear(self):
+        """Vaciar respuestas y métricas"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM llm_responses')
+            conn.execute('DELETE FROM llm_cache_metrics')
+
+
+class CachedLLM:
+    """Sustituto de OpenAI(...) con caché: llm(prompt) -> texto.
+
+    El cliente de OpenAI solo se crea en el primer fallo de caché.
+    """
+
+    def __init__(self, openai_api_key, temperature=0.7, max_tokens=None, model=None, source='', cache=None):
+        self.openai_api_key = openai_api_key
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.model = model
+        self.source = source
+        self.cache = cache or LLMResponseCache()
+        self._llm = None
+        self._llm_lock = threading.Lock()
+
+    def _client(self):
+        with self._llm_lock:
+            if self._llm is None:
+                from langchain.llms import OpenAI
+                kwargs = {'openai_api_key': self.openai_api_key, 'temperature': self.temperature}
+                if self.max_tokens is not None:
+                    kwargs['max_tokens'] = self.max_tokens
+                if self.model:
+                    kwargs['model_name'] = self.model
+                self._llm = OpenAI(**kwargs)
+            return self._llm
+
+    def __call__(self, prompt):
+        model = self.model or DEFAULT_MODEL
+        key = cache_key(prompt, model, self.temperature, self.max_tokens)
+        response = self.cache.get(key, self.source)
+        if response is not None:
+            return response
+        started = time.perf_counter()
+        response = self._client()(prompt)
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.cache.put(key, model, response, latency_ms, self.source)
+        return response
+
+
+def get_llm(openai_api_key, temperature=0.7, max_tokens=None, model=None, source=''):
+    """LLM con caché de respuestas; source identifica al módulo en las métricas"""
+    return CachedLLM(openai_api_key, temperature, max_tokens, model, source)
+
+
+def get_llm_cache_metrics():
+    return LLMResponseCache().metrics()
+
+
+def clear_llm_cache():
+    LLMResponseCache().clear()
@@ -0,0 +1,145 @@
+"""
+Extracción de texto de PDFs página a página y en paralelo.
+
+iter_pdf_pages() reparte rangos de páginas entre un pool de procesos (el
+parseo de PDF es CPU) y devuelve un generador de (número de página, texto)
+en orden, a medida que cada rango termina: el troceado, los embeddings o
+las preguntas al LLM pueden empezar con las primeras páginas mientras el
+resto se sigue procesando. Los PDFs pequeños se procesan en el propio
+proceso, donde arrancar el pool costaría más que el parseo.
+"""
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from itertools import islice
+
+PAGES_PER_TASK = 4
+MIN_PAGES_FOR_POOL = 16
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+TASKS_IN_FLIGHT_PER_WORKER = 2
+
+# Documento abierto en cada proceso del pool: (documento, motor)
+_worker_doc = None
+
+
+def _open_document(pdf_bytes, engine):
+    if engine == 'pymupdf':
+        import fitz
+        return fitz.open(stream=pdf_bytes, filetype='pdf')
+    from PyPDF2 import PdfReader
+    return PdfReader(BytesIO(pdf_bytes))
+
+
+def _page_count(doc, engine):
+    return len(doc) if engine == 'pymupdf' else len(doc.pages)
+
+
+def _page_text(doc, engine, page_no):
+    if engine == 'pymupdf':
+        return doc.load_page(page_no).get_text()
+    return doc.pages[page_no].extract_text() or ''
+
+
+def _init_worker(pdf_bytes, engine):
+    # El PDF se envía y se abre una sola vez por proceso, no en cada tarea
+    global _worker_doc
+    _worker_doc = (_open_document(pdf_bytes, engine), engine)
+
+
+def _extract_range(start, stop):
+    doc, engine = _worker_doc
+    return [(page_no, _page_text(doc, engine, page_no)) for page_no in range(start, stop)]
+
+
+def pdf_bytes_from(pdf_file):
+    """Bytes de un PDF recibido como bytes, ruta o archivo (p. ej. UploadedFile)"""
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return bytes(pdf_file)
+    if isinstance(pdf_file, str):
+        with open(pdf_file, 'rb') as f:
+            return f.read()
+    if hasattr(pdf_file, 'getvalue'):
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+
+def iter_pdf_pages(pdf_file, engine='pypdf', workers=MAX_WORKERS, pages_per_task=PAGES_PER_TASK):
+    """Generador de (número de página desde 0, texto) en orden.
+
+    Args:
+        engine: 'pypdf' (PyPDF2) o 'pymupdf' (fitz).
+        workers: procesos del pool; con 1 se extrae en el propio proceso.
+    """
+    pdf_bytes = pdf_bytes_from(pdf_file)
+    doc = _open_document(pdf_bytes, engine)
+    total = _page_count(doc, engine)
+    next_page = 0
+
+    if workers > 1 and total >= MIN_PAGES_FOR_POOL:
+        ranges = iter([(start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task)])
+        executor = None
+        try:
+            # 'spawn' para no heredar con fork los hilos en segundo plano de la app
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(pdf_bytes, engine)
+            )
+            # Ventana acotada de tareas en curso: el pool va por delante del
+            # consumidor sin cargar todo el documento en memoria
+            pending = deque(executor.submit(_extract_range, *page_range)
+                            for page_range in islice(ranges, workers * TASKS_IN_FLIGHT_PER_WORKER))
+            while pending:
+                pages = pending.popleft().result()
+                page_range = next(ranges, None)
+                if page_range is not None:
+                    pending.append(executor.submit(_extract_range, *page_range))
+                for page in pages:
+                    yield page
+                    next_page = page[0] + 1
+        except (BrokenProcessPool, OSError):
+            # Sin pool disponible (entorno restringido): se sigue en este proceso
+            pass
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    for page_no in range(next_page, total):
+        yield page_no, _page_text(doc, engine, page_no)
+
+
+def iter_text_chunks(pages, split_text, flush_size):
+    """Trocear el texto a medida que llegan las páginas.
+
+    Se acumula texto hasta flush_size caracteres, se trocea con split_text y
+    se emiten todos los fragmentos menos el último, que sigue acumulando
+    texto de las páginas siguientes para no cortar en el salto de página.
+    """
+    buffer = ''
+    for _, text in pages:
+        buffer += text
+        if len(buffer) >= flush_size:
+            chunks = split_text(buffer)
+            if len(chunks) > 1:
+                yield from chunks[:-1]
+                buffer = chunks[-1]
+    if buffer.strip():
+        yield from split_text(buffer)
+
+
+def iter_word_chunks(pages, chunk_size):
+    """Fragmentos de chunk_size palabras a medida que llegan las páginas"""
+    words = []
+    for _, text in pages:
+        words.extend(text.split())
+        while len(words) >= chunk_size:
+            yield ' '.join(words[:chunk_size])
+            del words[:chunk_size]
+    if words:
+        yield ' '.join(words)
@@ -1,28 +1,35 @@
 import streamlit as st
-from PyPDF2 import PdfReader
 from langchain.text_splitter import CharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.llms import OpenAI
+from modules.llm_gateway import get_llm
+from modules.pdf_extract import iter_pdf_pages, iter_text_chunks
+from modules.embeddings import EMBEDDING_BACKENDS, available_backends, backend_requires_api_key, get_embeddings
+from modules.vector_cache import get_or_build_index
 
-def get_pdf_text(pdf_file):
-    reader = PdfReader(pdf_file)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() or ""
-    return text
+CHUNK_SEPARATOR = "\n"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+def iter_pdf_chunks(pdf_bytes):
+    """Fragmentos del PDF a medida que se extraen las páginas (en paralelo)"""
+    return iter_text_chunks(iter_pdf_pages(pdf_bytes), get_text_chunks, CHUNK_SIZE * 4)
 
 def get_text_chunks(text):
-    splitter = CharacterTextSplitter(separator="\n", chunk_size=1000, chunk_overlap=200)
+    splitter = CharacterTextSplitter(separator=CHUNK_SEPARATOR, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
     return splitter.split_text(text)
 
-def build_vectorstore(chunks, api_key):
-    embeddings = OpenAIEmbeddings(openai_api_key=api_key)
-    store = FAISS.from_texts(texts=chunks, embedding=embeddings)
-    return store
+def load_or_build_vectorstore(pdf_bytes, api_key=None, backend="openai"):
+    """Índice del PDF desde la caché en disco; solo se embeben los fragmentos nuevos"""
+    embeddings = get_embeddings(backend, api_key)
+    params = (CHUNK_SEPARATOR, CHUNK_SIZE, CHUNK_OVERLAP)
+    return get_or_build_index(
+        pdf_bytes,
+        lambda: iter_pdf_chunks(pdf_bytes),
+        embeddings,
+        params
+    )
 
 def generate_personalized_response(query, context, api_key):
-    llm = OpenAI(openai_api_key=api_key, temperature=0.7)
+    llm = get_llm(api_key, temperature=0.7, source="pdf_viewer")
     prompt = (
         f"Basado en el siguiente fragmento del documento:\n\n{context}\n\n"
         f"Responde de manera clara y concisa a la siguiente pregunta:\n\n{query}"
@@ -38,6 +45,9 @@ def search_pdf(query: str) -> str:
     context = docs[0].page_content.strip()
     api_key = st.session_state.get("pdf_api_key", None)
     if not api_key:
+        # Sin API Key (modo local) se devuelve el fragmento más relevante tal cual
+        if st.session_state.get("pdf_embedding_backend", "openai") != "openai":
+            return f"Fragmento más relevante del PDF:\n\n{context}"
         return "❌ Ingresa tu API Key de OpenAI."
     return generate_personalized_response(query, context, api_key)
 
@@ -51,17 +61,31 @@ def pdf_viewer_dashboard():
         3. **Haz preguntas** sobre el contenido del PDF en el campo de consulta.
         4. **Recuerda** ingresar tu API Key de OpenAI en la barra lateral.
         5. El sistema buscará el fragmento más relevante y generará una respuesta personalizada.
+        6. Con un **motor de embeddings local** el PDF se indexa sin red ni API Key; sin API Key se muestra el fragmento encontrado.
         """)
     api_key = st.sidebar.text_input("OpenAI API Key", type="password", key="pdf_api_key")
+    backend = st.sidebar.selectbox(
+        "Motor de embeddings",
+        available_backends(),
+        format_func=lambda name: EMBEDDING_BACKENDS[name][0],
+        key="pdf_embedding_backend"
+    )
     uploaded_file = st.file_uploader("Elige un archivo PDF", type="pdf", key="pdf_viewer_uploader")
     if st.button("Procesar PDF", key="procesar_pdf_viewer") and uploaded_file:
         with st.spinner("Procesando PDF..."):
-            pdf_text = get_pdf_text(uploaded_file)
-            text_chunks = get_text_chunks(pdf_text)
-            if api_key:
-                vectorstore = build_vectorstore(text_chunks, api_key)
-                st.session_state.vectorstore = vectorstore
-                st.success("✅ PDF procesado y vectorizado.")
+            if api_key or not backend_requires_api_key(backend):
+                try:
+                    vectorstore, stats = load_or_build_vectorstore(uploaded_file.getvalue(), api_key, backend)
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                else:
+                    st.session_state.vectorstore = vectorstore
+                    if stats['cached']:
+                        st.success(f"✅ PDF cargado desde la caché ({stats['chunks']} fragmentos, sin llamadas a la API).")
+                    else:
+                        st.success(f"✅ PDF procesado y vectorizado: {stats['chunks']} fragmentos, "
+                                   f"{stats['embedded']} nuevos embebidos y "
+                                   f"{stats['chunks'] - stats['embedded']} reutilizados de la caché.")
             else:
                 st.error("❌ Ingresa tu API Key de OpenAI.")
     user_query = st.text_input("¿Qué quieres saber del PDF?", key="pdf_viewer_query")
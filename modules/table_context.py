@@ -0,0 +1,178 @@
+"""
+Contexto de tablas para el chat con presupuesto de tokens.
+
+build_table_context() empaqueta en TSV compacto las filas y columnas más
+relacionadas con la pregunta hasta llenar un presupuesto de tokens. De las
+columnas que no caben (y de toda la tabla cuando no caben todas las filas)
+se envía un resumen estadístico calculado de antemano con
+column_summaries(), para que el modelo pueda responder agregados sin ver
+cada fila.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_TOKEN_BUDGET = 6000
+CHARS_PER_TOKEN = 4       # Estimación sin tokenizador
+MAX_CELL_CHARS = 200
+MIN_ROWS = 20             # Filas que deben caber antes de descartar columnas
+TOP_VALUES = 3
+
+_TERM_RE = re.compile(r'\w+')
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:
+    _encoding = None
+
+
+def estimate_tokens(text):
+    """Tokens de un texto (tiktoken si está instalado; si no, ~4 caracteres por token)"""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def question_terms(question):
+    """Palabras de la pregunta de 3 o más caracteres, en minúsculas"""
+    return sorted({term for term in _TERM_RE.findall(str(question).lower()) if len(term) > 2})
+
+
+def column_summaries(df):
+    """Resumen de una línea por columna (numéricas: rango y media; resto: valores más frecuentes)"""
+    summaries = {}
+    for col in df.columns:
+        series = df[col]
+        non_null = int(series.notna().sum())
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series) and non_null:
+            summaries[col] = (
+                f"numérica, {non_null} valores, min {series.min():g}, max {series.max():g}, "
+                f"media {series.mean():.4g}, suma {series.sum():.6g}"
+            )
+        else:
+            counts = series.dropna().astype(str).value_counts()
+            top = ', '.join(f"{value[:40]} ({count})" for value, count in counts.head(TOP_VALUES).items())
+            summaries[col] = f"{non_null} valores, {len(counts)} distintos" + (f"; más frecuentes: {top}" if top else '')
+    return summaries
+
+
+def _cell_text(df):
+    """Tabla como texto en una línea por celda (sin tabuladores ni saltos)"""
+    text = df.astype(object).where(df.notna(), '').astype(str)
+    return text.apply(lambda col: col.str.replace(r'[\t\r\n]+', ' ', regex=True).str.slice(0, MAX_CELL_CHARS))
+
+
+def _rank_columns(df, text, terms, focus_columns):
+    """Columnas por relevancia: foco, nombradas en la pregunta, con valores que coinciden, resto"""
+    question = ' '.join(terms)
+    scores = {}
+    for position, col in enumerate(df.columns):
+        score = 0
+        if col in focus_columns:
+            score += 100
+        if str(col).lower() in question or any(term in str(col).lower() for term in terms):
+            score += 10
+        if terms and text[col].str.lower().str.contains('|'.join(map(re.escape, terms)), regex=True).any():
+            score += 1
+        scores[col] = (-score, position)
+    return sorted(df.columns, key=lambda col: scores[col])
+
+
+def _rank_rows(text, terms, focus_rows):
+    """Posiciones de fila por relevancia: foco, términos de la pregunta que aparecen (IDF), orden original"""
+    score = np.zeros(len(text), dtype=np.float64)
+    if terms:
+        lowered = [text[col].str.lower().to_numpy().astype(str) for col in text.columns]
+        for term in terms:
+            found = np.zeros(len(text), dtype=bool)
+            for values in lowered:
+                found |= np.char.find(values, term) >= 0
+            # Los términos raros (un nombre, un código) pesan más que los comunes
+            if found.any():
+                score += found * np.log(1 + len(text) / found.sum())
+    if focus_rows is not None:
+        score[text.index.isin(focus_rows)] += 1000
+    scores = score.tolist()
+    return sorted(range(len(text)), key=lambda i: (-scores[i], i))
+
+
+def _pack_rows(row_lines, row_order, budget):
+    """Posiciones de las filas que caben en budget, en orden de relevancia"""
+    selected = []
+    used = 0
+    for position in row_order:
+        cost = row_lines(position)[1]
+        if used + cost > budget:
+            break
+        selected.append(position)
+        used += cost
+    return selected
+
+
+def build_table_context(df, question, token_budget=DEFAULT_TOKEN_BUDGET, focus_rows=None,
+                        focus_columns=(), summaries=None):
+    """Contexto de la tabla para el prompt, dentro de token_budget.
+
+    Args:
+        focus_rows: índices de filas que deben ir primero (p. ej. la fila detectada).
+        focus_columns: columnas que deben enviarse siempre.
+        summaries: resultado de column_summaries(df), si ya se calculó.
+
+    Returns:
+        (context, info) con info = {'rows', 'total_rows', 'columns', 'omitted_columns', 'tokens'}
+    """
+    summaries = summaries if summaries is not None else column_summaries(df)
+    focus_columns = set(focus_columns)
+    terms = question_terms(question)
+    text = _cell_text(df)
+    columns = _rank_columns(df, text, terms, focus_columns)
+    row_order = _rank_rows(text, terms, focus_rows)
+
+    # Descartar las columnas menos relevantes mientras MIN_ROWS filas no quepan en medio presupuesto
+    sample = text.iloc[row_order[:MIN_ROWS]]
+    while len(columns) > 1 and columns[-1] not in focus_columns:
+        lines = ['\t'.join(map(str, columns))] + ['\t'.join(row) for row in sample[columns].itertuples(index=False)]
+        if estimate_tokens('\n'.join(lines)) <= token_budget // 2:
+            break
+        columns = columns[:-1]
+    omitted = [col for col in df.columns if col not in columns]
+
+    rows_text = text[columns]
+    line_cache = {}
+
+    def row_lines(position):
+        if position not in line_cache:
+            line = '\t'.join(rows_text.iloc[position])
+            line_cache[position] = (line, estimate_tokens(line) + 1)
+        return line_cache[position]
+
+    header = '\t'.join(map(str, columns))
+    # Resumen de las columnas omitidas; si además no caben todas las filas, de toda la tabla
+    summary_lines = [f"- {col}: {summaries[col]}" for col in omitted]
+    budget = token_budget - estimate_tokens(header) - estimate_tokens('\n'.join(summary_lines))
+    selected = _pack_rows(row_lines, row_order, budget)
+    if len(selected) < len(df):
+        summary_lines = [f"- {col}: {summaries[col]}" for col in df.columns]
+        budget = token_budget - estimate_tokens(header) - estimate_tokens('\n'.join(summary_lines))
+        selected = _pack_rows(row_lines, row_order, budget)
+    selected.sort()
+
+    parts = [f"Tabla de {len(df)} filas y {len(df.columns)} columnas: {list(map(str, df.columns))}."]
+    if len(selected) < len(df):
+        parts.append(f"Se incluyen {len(selected)} filas (las más relacionadas con la pregunta).")
+    if omitted:
+        parts.append(f"Columnas no incluidas en las filas: {list(map(str, omitted))}.")
+    if summary_lines:
+        parts.append("Resumen por columna (calculado sobre toda la tabla):\n" + '\n'.join(summary_lines))
+    parts.append("Filas (TSV):\n" + '\n'.join([header] + [row_lines(position)[0] for position in selected]))
+    context = '\n'.join(parts)
+    return context, {
+        'rows': len(selected),
+        'total_rows': len(df),
+        'columns': list(columns),
+        'omitted_columns': omitted,
+        'tokens': estimate_tokens(context),
+    }
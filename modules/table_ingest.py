@@ -0,0 +1,186 @@
+"""
+Ingesta de tablas subidas al chat del CRM con caché en disco.
+
+Cada archivo (CSV, Excel, JSON o Parquet) se parsea una sola vez: el
+resultado, con tipos compactos (category para textos con pocos valores
+distintos, enteros y decimales reducidos sin pérdida, fechas), se guarda en
+Parquet con el hash SHA-256 del contenido como nombre. Las siguientes
+cargas, también en otras sesiones, leen ese Parquet con memory-map en lugar
+de volver a parsear el archivo original.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from io import BytesIO
+
+import pandas as pd
+
+from modules.table_profile import DATE_PATTERN
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    # Sin pyarrow la tabla se optimiza igual, pero no se guarda en disco
+    pq = None
+
+TABLE_CACHE_DIR = os.environ.get('MUYU_TABLE_CACHE_DIR', os.path.join('.cache', 'tablas'))
+INGEST_VERSION = 2              # Cambiarlo invalida la caché si cambia la inferencia de tipos
+CATEGORY_MAX_RATIO = 0.5        # Valores distintos / filas para usar category
+DATE_SAMPLE_SIZE = 200
+# Formatos de fecha probados en orden: día antes que mes (locale español); el
+# mes primero solo se usa si ningún formato con el día primero sirve
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%d/%m/%y', '%d/%m/%Y', '%d-%m-%y', '%d-%m-%Y',
+                '%d.%m.%y', '%d.%m.%Y', '%m/%d/%y', '%m/%d/%Y')
+TIME_FORMATS = ('', ' %H:%M', ' %H:%M:%S', 'T%H:%M', 'T%H:%M:%S')
+
+
+def _parse(name, data):
+    lowered = name.lower()
+    if lowered.endswith('.csv'):
+        # Todo como texto: optimize_dtypes decide los tipos y conserva ceros iniciales (teléfonos, cédulas)
+        return pd.read_csv(BytesIO(data), dtype=str)
+    if lowered.endswith(('.xlsx', '.xls')):
+        return pd.read_excel(BytesIO(data))
+    if lowered.endswith('.json'):
+        return pd.read_json(BytesIO(data))
+    if lowered.endswith('.parquet'):
+        return pd.read_parquet(BytesIO(data))
+    raise ValueError("Formato de archivo no soportado.")
+
+
+def _parse_dates(series, non_null):
+    """Fechas con un único formato explícito que sirva para todos los valores, o None.
+
+    Solo textos con fecha (no horas sueltas como '10:30'), y nunca se
+    adivina el orden día/mes valor por valor.
+    """
+    text = series.dropna().astype(str).str.strip()
+    if not text.str.fullmatch(DATE_PATTERN).all():
+        return None
+    sample = text.head(DATE_SAMPLE_SIZE)
+    for date_format in DATE_FORMATS:
+        for time_format in TIME_FORMATS:
+            fmt = date_format + time_format
+            if pd.to_datetime(sample, format=fmt, errors='coerce').notna().all():
+                dates = pd.to_datetime(series.astype(str).str.strip().where(series.notna()), format=fmt,
+                                       errors='coerce')
+                if dates.notna().sum() == non_null:
+                    return dates
+    return None
+
+
+def _optimize_text(series):
+    non_null = series.notna().sum()
+    if not non_null:
+        return series
+    # Números guardados como texto (salvo códigos con cero inicial o '+', como teléfonos)
+    text = series.dropna().astype(str)
+    if not text.str.match(r'\s*\+|\s*0\d').any():
+        numbers = pd.to_numeric(series, errors='coerce')
+        if numbers.notna().sum() == non_null:
+            return _optimize_number(numbers)
+    dates = _parse_dates(series, non_null)
+    if dates is not None:
+        return dates
+    if series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(series):
+        return series.astype('category')
+    return series
+
+
+def _optimize_number(series):
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(series):
+        non_null = series.dropna()
+        if not non_null.empty and (non_null % 1 == 0).all() and non_null.abs().max() < 2 ** 53:
+            # Decimales que en realidad son enteros con nulos: entero con nulos de pandas (Int8...Int64)
+            smallest = pd.to_numeric(non_null.astype('int64'), downcast='integer').dtype.name
+            return series.astype(smallest.capitalize())
+        reduced = series.astype('float32')
+        # Solo si float32 conserva exactamente todos los valores
+        if (reduced.astype('float64') == series)[series.notna()].all():
+            return reduced
+    return series
+
+
+def optimize_dtypes(df):
+    """Copia de df con tipos compactos (sin perder información)"""
+    optimized = {}
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_bool_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+            optimized[column] = series
+        elif pd.api.types.is_numeric_dtype(series):
+            optimized[column] = _optimize_number(series)
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            optimized[column] = _optimize_text(series)
+        else:
+            optimized[column] = series
+    return pd.DataFrame(optimized, index=df.index)
+
+
+def _memory(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def _write_cache(path, df, info):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.parquet', dir=directory)
+    os.close(fd)
+    try:
+        # Con el índice: la recarga desde la caché devuelve la misma tabla que la primera carga
+        df.to_parquet(tmp_path)
+        with open(path + '.json', 'w', encoding='utf-8') as info_file:
+            json.dump(info, info_file)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def content_key(data):
+    """Hash SHA-256 del contenido del archivo (clave de la caché)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_uploaded_table(name, data, cache_dir=TABLE_CACHE_DIR):
+    """Tabla de un archivo subido, desde la caché si ya se procesó.
+
+    Returns:
+        (df, info) con info = {'cached', 'rows', 'columns', 'original_bytes',
+        'optimized_bytes', 'saved_bytes'}
+
+    Raises:
+        ValueError: si el formato no está soportado.
+    """
+    key = content_key(data)
+    path = os.path.join(cache_dir, f"{key}.v{INGEST_VERSION}.parquet")
+
+    if pq is not None and os.path.exists(path) and os.path.exists(path + '.json'):
+        df = pq.read_table(path, memory_map=True).to_pandas()
+        with open(path + '.json', encoding='utf-8') as info_file:
+            info = json.load(info_file)
+        return df, dict(info, cached=True)
+
+    original = _parse(name, data)
+    df = optimize_dtypes(original)
+    original_bytes = _memory(original)
+    optimized_bytes = _memory(df)
+    info = {
+        'rows': len(df),
+        'columns': len(df.columns),
+        'original_bytes': original_bytes,
+        'optimized_bytes': optimized_bytes,
+        'saved_bytes': original_bytes - optimized_bytes,
+    }
+    if pq is not None:
+        try:
+            _write_cache(path, df, info)
+        except (OSError, ValueError, TypeError):
+            # Columnas que Parquet no admite (objetos mezclados): solo en memoria
+            pass
+    return df, dict(info, cached=False)
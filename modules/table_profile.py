@@ -0,0 +1,131 @@
+"""
+Perfil de columnas de la tabla del chat: emails, teléfonos, nombres y fechas.
+
+profile_table() se calcula una vez al cargar la tabla (junto al resumen y
+al índice de valores) con expresiones regulares vectorizadas sobre las
+columnas completas, no sobre una muestra. Para cada columna de emails
+guarda además las direcciones ya normalizadas (sin espacios, en
+minúsculas), validadas y sin duplicados, listas para los envíos.
+"""
+
+import numpy as np
+import pandas as pd
+
+EMAIL_PATTERN = r"[a-z0-9.!#$%&'*+/=?^_`{|}~-]+@[a-z0-9](?:[a-z0-9-]*[a-z0-9])?(?:\.[a-z0-9](?:[a-z0-9-]*[a-z0-9])?)*\.[a-z]{2,}"
+PHONE_PATTERN = r'\+?[\d\s().-]{7,20}'
+_LETTERS = '[A-Za-zÀ-ÖØ-öø-ÿ]+'    # Explícitas: \w no incluye tildes en el motor de regex de pyarrow
+NAME_PATTERN = rf"{_LETTERS}(?:[ '.-]+{_LETTERS})*\.?"
+DATE_PATTERN = r'\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?'
+
+EMAIL_KEYWORDS = ('mail', 'correo')
+PHONE_KEYWORDS = ('tel', 'phone', 'celular', 'movil', 'móvil', 'whatsapp', 'contacto')
+NAME_KEYWORDS = ('nombre', 'name', 'apellido', 'cliente', 'prospecto', 'rector', 'contraparte')
+DATE_KEYWORDS = ('fecha', 'date', 'dia', 'día')
+
+MIN_RATIO = 0.8            # Valores que deben encajar para detectar la columna sin palabra clave
+MIN_KEYWORD_RATIO = 0.3    # Con palabra clave en el nombre basta con menos
+MIN_PHONE_DIGITS = 7
+
+KINDS = ('email', 'phone', 'name', 'date')
+
+
+def _distinct(series):
+    """Valores distintos no vacíos (como texto, sin espacios en los extremos) y cuántas veces aparece cada uno.
+
+    Las expresiones regulares se evalúan una vez por valor distinto, no por fila.
+    """
+    codes, uniques = pd.factorize(series)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    values = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.strip()
+    if values.duplicated().any():
+        # Valores que solo se distinguían por espacios en los extremos
+        counts = pd.Series(counts).groupby(values.to_numpy(), sort=False).sum()
+        values, counts = pd.Series(counts.index, dtype=object), counts.to_numpy()
+    keep = (values != '').to_numpy()
+    return values[keep].reset_index(drop=True), counts[keep]
+
+
+def _ratio(matches, counts):
+    """Fracción de filas cuyo valor cumple matches"""
+    return float(np.dot(matches.to_numpy(dtype=bool), counts) / counts.sum()) if counts.sum() else 0.0
+
+
+def _has_keyword(column, keywords):
+    name = str(column).lower()
+    return any(keyword in name for keyword in keywords)
+
+
+def normalize_emails(series):
+    """Serie con cada dirección normalizada (sin espacios, minúsculas) o NaN si no es válida"""
+    text = series.astype('string').str.strip().str.lower()
+    return text.where(text.str.fullmatch(EMAIL_PATTERN).fillna(False).astype(bool))
+
+
+def clean_emails(series):
+    """Direcciones válidas, normalizadas y sin duplicados, en el orden de la tabla"""
+    return normalize_emails(series).dropna().drop_duplicates().tolist()
+
+
+def _is_email(column, text, counts):
+    ratio = _ratio(text.str.lower().str.fullmatch(EMAIL_PATTERN), counts)
+    return ratio >= MIN_RATIO or (ratio > 0 and _has_keyword(column, EMAIL_KEYWORDS))
+
+
+def _is_phone(column, text, counts):
+    matches = text.str.fullmatch(PHONE_PATTERN) & (text.str.count(r'\d') >= MIN_PHONE_DIGITS)
+    ratio = _ratio(matches, counts)
+    return ratio >= (MIN_KEYWORD_RATIO if _has_keyword(column, PHONE_KEYWORDS) else MIN_RATIO)
+
+
+def _is_name(column, text, counts):
+    ratio = _ratio(text.str.fullmatch(NAME_PATTERN), counts)
+    if _has_keyword(column, NAME_KEYWORDS):
+        return ratio >= MIN_KEYWORD_RATIO
+    # Sin palabra clave, solo textos de varias palabras y casi todos distintos (no ciudades o estados)
+    return (ratio >= MIN_RATIO and text.str.count(' ').mean() >= 1
+            and len(text) >= MIN_RATIO * counts.sum())
+
+
+def _is_date(column, text, counts):
+    ratio = _ratio(text.str.fullmatch(DATE_PATTERN), counts)
+    return ratio >= (MIN_KEYWORD_RATIO if _has_keyword(column, DATE_KEYWORDS) else MIN_RATIO)
+
+
+def profile_table(df):
+    """Clasificar las columnas de df.
+
+    Returns:
+        dict con 'email', 'phone', 'name', 'date' (listas de columnas),
+        'recipients' ({columna de emails: direcciones limpias}) e 'invalid'
+        ({columna de emails: número de filas no vacías que no son un email válido}).
+    """
+    profile = {kind: [] for kind in KINDS}
+    profile['recipients'] = {}
+    profile['invalid'] = {}
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_datetime64_any_dtype(series):
+            profile['date'].append(column)
+            continue
+        text, counts = _distinct(series)
+        if text.empty:
+            continue
+        if pd.api.types.is_numeric_dtype(series):
+            # Los números solo son teléfonos si la columna lo dice
+            if _has_keyword(column, PHONE_KEYWORDS) and _is_phone(column, text, counts):
+                profile['phone'].append(column)
+            continue
+        if _is_email(column, text, counts):
+            profile['email'].append(column)
+            normalized = normalize_emails(text)
+            profile['recipients'][column] = normalized.dropna().drop_duplicates().tolist()
+            profile['invalid'][column] = int(counts[normalized.isna().to_numpy()].sum())
+        elif _is_date(column, text, counts):
+            profile['date'].append(column)
+        elif _is_phone(column, text, counts):
+            profile['phone'].append(column)
+        elif _is_name(column, text, counts):
+            profile['name'].append(column)
+    return profile
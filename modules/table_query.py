@@ -0,0 +1,269 @@
+"""
+Respuestas locales a preguntas deterministas sobre la tabla del chat.
+
+answer_table_question() reconoce en español e inglés preguntas de conteo,
+suma, promedio, máximo/mínimo, valores distintos y top-N, con filtros
+(un valor de celda mencionado o una comparación numérica) y agrupación
+("por ciudad", "by city"), y las resuelve con operaciones vectorizadas de
+pandas. Si la pregunta no encaja o es abierta devuelve None y el chat la
+envía al LLM.
+"""
+
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+MAX_GROUPS = 50
+DEFAULT_TOP_N = 10
+ID_UNIQUE_RATIO = 0.9       # Enteros casi todos distintos: códigos, no cantidades
+ID_KEYWORDS = ('id', 'codigo', 'cod', 'cedula', 'ruc', 'dni', 'telefono', 'celular', 'phone', 'zip', 'postal')
+
+OPEN_ENDED = ('por que', 'porque', 'why', 'recomienda', 'recommend', 'sugier', 'suggest', 'deberia', 'should',
+              'explica', 'explain', 'analiza', 'analyze', 'analyse', 'opina', 'estrategia', 'strategy',
+              'redacta', 'escribe', 'write', 'como puedo', 'how can', 'how should', 'mejorar', 'improve')
+
+OPERATIONS = [
+    ('top', r'\btop\s*\d*\b|\blos\s+\d+\s+(?:mayores|menores|primeros|mejores|peores)\b|'
+            r'\b(?:first|highest|lowest|largest|smallest)\s+\d+\b|\b\d+\s+(?:mayores|menores|highest|lowest|largest|smallest)\b'),
+    ('mean', r'\bpromedio\b|\bmedia\b|\baverage\b|\bmean\b|\bavg\b'),
+    ('sum', r'\bsuma\b|\bsumar?\b|\bsum\b'),
+    ('max', r'\bmaxim[oa]\b|\bmax\b|\bmaximum\b|\bmayor\s+(?!(?:que|a)\b)|\bhighest\b|\blargest\b|\bmas\s+alt[oa]\b'),
+    ('min', r'\bminim[oa]\b|\bmin\b|\bminimum\b|\bmenor\s+(?!(?:que|a)\b)|\blowest\b|\bsmallest\b|\bmas\s+baj[oa]\b'),
+    ('distinct', r'\bdistint[oa]s\b|\bunic[oa]s\b|\bdiferentes\b|\bunique\b|\bdistinct\b'),
+    ('count', r'\bcuant[oa]s\b|\bnumero\s+de\b|\bcantidad\s+de\b|\bhow\s+many\b|\bcount\b|\bnumber\s+of\b|\bcontar\b'),
+]
+
+COMPARATORS = [
+    ('>=', r'>=|al\s+menos|como\s+minimo|at\s+least'),
+    ('<=', r'<=|como\s+maximo|a\s+lo\s+sumo|at\s+most'),
+    ('>', r'>|mayor(?:es)?\s+(?:a|que)|mas\s+de|greater\s+than|more\s+than|over|above|superior(?:es)?\s+a'),
+    ('<', r'<|menor(?:es)?\s+(?:a|que)|menos\s+de|less\s+than|fewer\s+than|under|below|inferior(?:es)?\s+a'),
+    ('==', r'=|igual(?:es)?\s+a|equal\s+to'),
+]
+_NUMBER = r'(-?\d+(?:,\d{3})*(?:[.,]\d+)?)(?!\d)'
+# "total" solo es una suma justo antes de una columna numérica ("total de alumnos"), no en "¿cuántos hay en total?"
+_TOTAL_BEFORE = r'\btotal\s+(?:(?:de|of)\s+)?(?:(?:el|la|los|las|the)\s+)?$'
+# Sin filtro ni columna, un conteo solo es el número de filas si la pregunta habla de filas
+ROW_WORDS = r'\b(?:filas?|registros?|rows?|records?)\b'
+
+
+def normalize(text):
+    """Minúsculas, sin tildes y con espacios simples"""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return re.sub(r'\s+', ' ', text.replace('_', ' ')).strip()
+
+
+def _mentioned_columns(df, question):
+    """Apariciones de nombres de columna en la pregunta: [(columna, inicio, fin)] en orden.
+    Los nombres más largos se buscan primero para no confundir 'precio' con 'precio total'."""
+    found = []
+    for column in sorted(df.columns, key=lambda col: -len(str(col))):
+        name = normalize(column)
+        if len(name) < 3:
+            continue
+        for match in re.finditer(rf'\b{re.escape(name)}(?:es|s)?\b', question):
+            if not any(start < match.end() and match.start() < end for _, start, end in found):
+                found.append((column, match.start(), match.end()))
+    return sorted(found, key=lambda item: item[1])
+
+
+def _group_column(question, mentioned):
+    for column, start, _ in mentioned:
+        if re.search(r'\b(?:por|by|per|segun|agrupad[oa]s?\s+por|grouped\s+by|para\s+cada|for\s+each)\s+'
+                     r'(?:(?:el|la|los|las|the|cada|each)\s+)?$', question[:start]):
+            return column
+    return None
+
+
+def _parse_number(text):
+    """'1,5' es 1.5, pero '1,000' (coma seguida de 3 cifras) es mil"""
+    if re.fullmatch(r'-?\d+(?:,\d{3})+(?:\.\d+)?', text):
+        return float(text.replace(',', ''))
+    return float(text.replace(',', '.'))
+
+
+def _is_identifier(df, column):
+    """Columna numérica que identifica filas (códigos, cédulas, teléfonos) en lugar de medir algo"""
+    if set(normalize(column).split()) & set(ID_KEYWORDS):
+        return True
+    values = df[column].dropna()
+    if values.empty or not (pd.api.types.is_integer_dtype(values) or (values % 1 == 0).all()):
+        return False
+    return values.nunique() >= ID_UNIQUE_RATIO * len(values)
+
+
+def _is_measure(df, column):
+    return pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column])
+
+
+def _total_of_column(df, question, mentioned):
+    """Coincidencia de 'total de <columna numérica>' en la pregunta, o None"""
+    for column, start, _ in mentioned:
+        if _is_measure(df, column):
+            match = re.search(_TOTAL_BEFORE, question[:start])
+            if match:
+                return match
+    return None
+
+
+def _numeric_filters(df, question, mentioned):
+    """Comparaciones '<columna> mayor que N' o 'más de N <columna>': [(columna, op, N, inicio)]"""
+    filters = []
+    for column, start, end in mentioned:
+        if not pd.api.types.is_numeric_dtype(df[column]):
+            continue
+        after = question[end:end + 40]
+        before = question[max(0, start - 40):start]
+        for op, pattern in COMPARATORS:
+            match = (re.match(rf'\s*(?:es|sea|son|sean|is|are|de)?\s*(?:{pattern})\s*{_NUMBER}', after)
+                     or re.search(rf'(?:{pattern})\s*{_NUMBER}\s*(?:de\s+)?$', before))
+            if match:
+                filters.append((column, op, _parse_number(match.group(1)), start))
+                break
+    return filters
+
+
+def _format_number(value):
+    if pd.isna(value):
+        return 'sin datos'
+    value = float(value)
+    return f"{value:,.0f}" if value.is_integer() else f"{value:,.2f}"
+
+
+def answer_table_question(df, question, value_index=None):
+    """Responder localmente si la pregunta es determinista.
+
+    Returns:
+        (texto, tabla o None) o None si hay que preguntar al LLM.
+    """
+    q = normalize(question)
+    if not q or any(marker in q for marker in OPEN_ENDED):
+        return None
+    mentioned = _mentioned_columns(df, q)
+    total_match = _total_of_column(df, q, mentioned)
+    operations = [(name, match) for name, pattern in OPERATIONS
+                  for match in [re.search(pattern, q) or (total_match if name == 'sum' else None)] if match]
+    if not operations:
+        return None
+
+    group_col = _group_column(q, mentioned)
+    numeric_filters = _numeric_filters(df, q, mentioned)
+    filter_cols = {column for column, _, _, _ in numeric_filters}
+    filter_starts = {start for _, _, _, start in numeric_filters}
+
+    # Filtros: valor de celda mencionado (no numérico: los números van por comparación) y comparaciones
+    mask = np.ones(len(df), dtype=bool)
+    descriptions = []
+    match = value_index.find(question) if value_index is not None else None
+    if match and not re.fullmatch(r'[\d.,]+', match[1]) and match[0] != group_col:
+        value_col, _, positions = match
+        value_mask = np.zeros(len(df), dtype=bool)
+        value_mask[positions] = True
+        mask &= value_mask
+        filter_cols.add(value_col)
+        descriptions.append(f"{value_col} = {df[value_col].iloc[positions[0]]}")
+    for column, op, number, _ in numeric_filters:
+        mask &= getattr(df[column], COMPARISON_METHODS[op])(number).fillna(False).to_numpy(dtype=bool)
+        descriptions.append(f"{column} {op} {_format_number(number)}")
+
+    plan = {
+        'table': df,
+        'data': df[mask],
+        'scope': f" (filtro: {', '.join(descriptions)})" if descriptions else "",
+        'group': group_col,
+        'mentioned': list(dict.fromkeys(column for column, _, _ in mentioned)),
+        'filters': filter_cols,
+        # Columna numérica nombrada fuera de un filtro ("promedio de alumnos donde alumnos < 100")
+        'target': next((column for column, start, _ in mentioned
+                        if column != group_col and start not in filter_starts
+                        and _is_measure(df, column)), None),
+    }
+    # La primera operación reconocida que se pueda ejecutar con las columnas de la pregunta
+    for name, op_match in operations:
+        answer = EXECUTORS[name](plan, q, op_match)
+        if answer is not None:
+            return answer
+    return None
+
+
+def _count(plan, q, _):
+    data, scope, group_col, target = plan['data'], plan['scope'], plan['group'], plan['target']
+    if target is not None:
+        if _is_identifier(plan['table'], target):
+            # "¿Cuántos códigos hay?" no es la suma de los códigos: mejor que responda el LLM
+            return None
+        # "¿Cuántos alumnos hay en Quito?" es la suma de la columna alumnos
+        return _aggregate(plan, 'sum')
+    if group_col is not None:
+        counts = data[group_col].value_counts(dropna=False)
+        # Las categorías sin filas tras el filtro no se listan
+        counts = counts[counts > 0].head(MAX_GROUPS)
+        return f"Filas por {group_col}{scope}:", counts.rename_axis(group_col).reset_index(name='cantidad')
+    if not scope and not re.search(ROW_WORDS, q):
+        # "¿Cuántos colegios están en negociación?" sin reconocer el valor: el total de filas sería engañoso
+        return None
+    return f"Hay {len(data):,} filas{scope}.", None
+
+
+def _distinct(plan, q, _):
+    columns = [column for column in plan['mentioned'] if column not in plan['filters']] or plan['mentioned']
+    if not columns:
+        return None
+    column = columns[0]
+    values = plan['data'][column].dropna().unique()
+    table = pd.DataFrame({column: values[:MAX_GROUPS]})
+    return f"{column} tiene {len(values):,} valores distintos{plan['scope']}.", table
+
+
+def _top(plan, q, op_match):
+    data, scope, group_col, target = plan['data'], plan['scope'], plan['group'], plan['target']
+    digits = re.search(r'\d+', op_match.group(0))
+    n = int(digits.group(0)) if digits else DEFAULT_TOP_N
+    smallest = re.search(r'menores|peores|lowest|smallest|bottom', q) is not None
+    if target is None:
+        if group_col is None:
+            return None
+        counts = data[group_col].value_counts()
+        counts = counts[counts > 0].head(n)
+        return f"{group_col} con más filas{scope}:", counts.rename_axis(group_col).reset_index(name='cantidad')
+    word = 'menor' if smallest else 'mayor'
+    if group_col is not None:
+        totals = data.groupby(group_col, observed=True)[target].sum()
+        totals = totals.nsmallest(n) if smallest else totals.nlargest(n)
+        return f"Top {n} de {group_col} por {target} total ({word} primero){scope}:", totals.reset_index()
+    rows = data.nsmallest(n, target) if smallest else data.nlargest(n, target)
+    return f"{n} filas con {word} {target}{scope}:", rows
+
+
+def _aggregate(plan, operation):
+    data, scope, group_col, target = plan['data'], plan['scope'], plan['group'], plan['target']
+    if target is None:
+        return None
+    label = AGGREGATE_LABELS[operation]
+    if group_col is not None:
+        result = data.groupby(group_col, observed=True)[target].agg(operation).sort_values(ascending=False)
+        table = result.head(MAX_GROUPS).reset_index(name=f"{label.lower()} de {target}")
+        return f"{label} de {target} por {group_col}{scope}:", table
+    value = getattr(data[target], operation)()
+    if operation in ('max', 'min') and not pd.isna(value):
+        # Además de la cifra, la fila donde se alcanza
+        values = data[target].to_numpy(dtype=float, na_value=np.nan)
+        position = np.nanargmax(values) if operation == 'max' else np.nanargmin(values)
+        return f"{label} de {target}{scope}: {_format_number(value)}.", data.iloc[[position]]
+    return f"{label} de {target}{scope}: {_format_number(value)}.", None
+
+
+AGGREGATE_LABELS = {'sum': 'Total', 'mean': 'Promedio', 'max': 'Máximo', 'min': 'Mínimo'}
+COMPARISON_METHODS = {'>': 'gt', '<': 'lt', '>=': 'ge', '<=': 'le', '==': 'eq'}
+EXECUTORS = {
+    'top': _top,
+    'mean': lambda plan, q, _: _aggregate(plan, 'mean'),
+    'sum': lambda plan, q, _: _aggregate(plan, 'sum'),
+    'max': lambda plan, q, _: _aggregate(plan, 'max'),
+    'min': lambda plan, q, _: _aggregate(plan, 'min'),
+    'distinct': _distinct,
+    'count': _count,
+}
@@ -0,0 +1,82 @@
+"""
+Índice inverso de valores de celda para detectar a qué fila se refiere una
+pregunta del chat de tablas.
+
+build_value_index() recorre la tabla una sola vez (al cargarla) y guarda
+valor normalizado -> [(columna, posiciones de fila)]. find() divide la
+pregunta en palabras y busca sus n-gramas en el índice, así que el coste
+depende de la longitud de la pregunta y no del tamaño de la tabla.
+"""
+
+import re
+import string
+
+import numpy as np
+import pandas as pd
+
+MAX_NGRAM = 8           # Valores de más palabras no se indexan
+MAX_VALUE_CHARS = 120   # Ni textos largos (notas, descripciones)
+_PUNCTUATION = re.escape(string.punctuation + '¿¡«»“”‘’')
+# Signos de puntuación al principio o al final de cada palabra
+_EDGE_PUNCTUATION = re.compile(rf'(?<!\S)[{_PUNCTUATION}]+|[{_PUNCTUATION}]+(?!\S)')
+
+
+def normalize_tokens(text):
+    """Palabras en minúsculas sin signos de puntuación en los extremos"""
+    return _EDGE_PUNCTUATION.sub(' ', str(text).lower()).split()
+
+
+class ValueIndex:
+    """valor normalizado -> [(columna, posiciones de fila)]"""
+
+    def __init__(self, columns, entries, max_ngram):
+        self.columns = list(columns)
+        self.entries = entries
+        self.max_ngram = max_ngram
+
+    def find(self, question):
+        """Valor de celda más específico que aparece en la pregunta.
+
+        Returns:
+            (columna, valor, posiciones de fila) o None. Ante varias
+            coincidencias gana la de más palabras y, a igualdad, la primera
+            columna de la tabla.
+        """
+        tokens = normalize_tokens(question)
+        for size in range(min(self.max_ngram, len(tokens)), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                value = ' '.join(tokens[start:start + size])
+                matches = self.entries.get(value)
+                if matches:
+                    column, positions = matches[0]
+                    return column, value, positions
+        return None
+
+
+def build_value_index(df):
+    """Construir el índice de una tabla (una pasada por columna)"""
+    entries = {}
+    max_ngram = 1
+    column_order = {column: position for position, column in enumerate(df.columns)}
+    for column in df.columns:
+        # Se normaliza cada valor distinto una sola vez, igual que la pregunta
+        codes, uniques = pd.factorize(df[column])
+        normalized = np.array([
+            ' '.join(tokens) if 0 < len(tokens) <= MAX_NGRAM else ''
+            for tokens in (normalize_tokens(value) if len(str(value)) <= MAX_VALUE_CHARS else ()
+                           for value in uniques)
+        ] + [''], dtype=object)
+        # codes == -1 (nulos) apunta al '' añadido al final
+        row_values = normalized[codes].astype(str)
+        positions = np.flatnonzero(row_values != '')
+        if not len(positions):
+            continue
+        values, inverse = np.unique(row_values[positions], return_inverse=True)
+        max_ngram = max(max_ngram, max(value.count(' ') + 1 for value in values.tolist()))
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(values) + 1))
+        for i, value in enumerate(values.tolist()):
+            entries.setdefault(value, []).append((column, positions[order[bounds[i]:bounds[i + 1]]]))
+    for matches in entries.values():
+        matches.sort(key=lambda match: column_order[match[0]])
+    return ValueIndex(df.columns, entries, max_ngram)
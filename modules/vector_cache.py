@@ -0,0 +1,198 @@
+"""
+Caché persistente de índices vectoriales para los PDFs.
+
+- Índice por documento: se identifica con el hash SHA-256 del contenido
+  del PDF (más el modelo de embeddings y los parámetros de troceado). Si
+  ya existe en disco se carga directamente (índice FAISS con mmap y los
+  fragmentos en JSON), sin extraer texto ni llamar a la API.
+- Embeddings por fragmento: guardados en un SQLite por hash del texto, así
+  que al procesar una versión modificada del documento solo se pagan los
+  fragmentos nuevos o cambiados.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from array import array
+from itertools import islice
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+VECTOR_CACHE_DIR = os.environ.get('MUYU_VECTOR_CACHE_DIR', os.path.join('.cache', 'vectores'))
+INDEX_FILE = 'index.faiss'
+CHUNKS_FILE = 'chunks.json'
+EMBED_BATCH = 256
+
+_db_lock = threading.Lock()
+
+
+def content_hash(data):
+    """SHA-256 en hexadecimal de bytes o texto"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def embedding_model_name(embeddings):
+    """Nombre del modelo de embeddings para separar sus entradas en la caché"""
+    return f"{type(embeddings).__name__}:{getattr(embeddings, 'model', None) or getattr(embeddings, 'model_name', '')}"
+
+
+class EmbeddingCache:
+    """Vectores de fragmentos guardados por (modelo, hash del texto) en SQLite"""
+
+    def __init__(self, cache_dir=VECTOR_CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'embeddings.db')
+        with _db_lock, self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS chunk_embeddings (
+                    model TEXT NOT NULL,
+                    chunk_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, chunk_hash)
+                ) WITHOUT ROWID
+            ''')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode = WAL')
+        return conn
+
+    def get_many(self, model, hashes):
+        """{hash: vector} de los hashes que ya están en la caché"""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._connect() as conn:
+            # Por bloques para no superar el límite de variables de SQLite
+            for start in range(0, len(unique), 500):
+                block = unique[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT chunk_hash, vector FROM chunk_embeddings "
+                    f"WHERE model = ? AND chunk_hash IN ({','.join('?' * len(block))})",
+                    [model] + block
+                )
+                for chunk_hash, blob in rows:
+                    found[chunk_hash] = array('f', blob).tolist()
+        return found
+
+    def put_many(self, model, items):
+        """Guardar [(hash, vector)]"""
+        with _db_lock, self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO chunk_embeddings (model, chunk_hash, vector) VALUES (?, ?, ?)',
+                [(model, chunk_hash, array('f', vector).tobytes()) for chunk_hash, vector in items]
+            )
+
+
+def embed_with_cache(chunks, embeddings, cache=None):
+    """Vectores de los fragmentos; solo se calculan los que no están en caché.
+
+    Returns:
+        (vectores en el orden de chunks, número de fragmentos embebidos ahora)
+    """
+    cache = cache or EmbeddingCache()
+    model = embedding_model_name(embeddings)
+    hashes = [content_hash(chunk) for chunk in chunks]
+    vectors = cache.get_many(model, hashes)
+
+    missing = {}
+    for chunk_hash, chunk in zip(hashes, chunks):
+        if chunk_hash not in vectors:
+            missing.setdefault(chunk_hash, chunk)
+    missing_items = list(missing.items())
+    for start in range(0, len(missing_items), EMBED_BATCH):
+        batch = missing_items[start:start + EMBED_BATCH]
+        new_vectors = embeddings.embed_documents([chunk for _, chunk in batch])
+        new_items = list(zip([chunk_hash for chunk_hash, _ in batch], new_vectors))
+        cache.put_many(model, new_items)
+        vectors.update(new_items)
+
+    return [vectors[chunk_hash] for chunk_hash in hashes], len(missing_items)
+
+
+def document_key(file_bytes, embeddings, params=''):
+    """Clave del índice de un documento: contenido + modelo + parámetros de troceado"""
+    return content_hash(content_hash(file_bytes) + embedding_model_name(embeddings) + str(params))
+
+
+def _read_index(path):
+    # Memory-map cuando el tipo de índice lo permite; si no, lectura normal
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def load_cached_index(doc_key, embeddings, cache_dir=VECTOR_CACHE_DIR):
+    """Cargar el índice de un documento desde disco (None si no existe)"""
+    index_dir = os.path.join(cache_dir, doc_key)
+    index_path = os.path.join(index_dir, INDEX_FILE)
+    chunks_path = os.path.join(index_dir, CHUNKS_FILE)
+    if not (os.path.exists(index_path) and os.path.exists(chunks_path)):
+        return None
+    with open(chunks_path, encoding='utf-8') as chunks_file:
+        chunks = json.load(chunks_file)
+    index = _read_index(index_path)
+    docstore = InMemoryDocstore({str(i): Document(page_content=chunk) for i, chunk in enumerate(chunks)})
+    return FAISS(embeddings, index, docstore, {i: str(i) for i in range(len(chunks))})
+
+
+def save_index(doc_key, chunks, store, cache_dir=VECTOR_CACHE_DIR):
+    """Guardar índice y fragmentos; se escribe en un directorio temporal y se renombra"""
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f'{doc_key}.', dir=cache_dir)
+    try:
+        faiss.write_index(store.index, os.path.join(tmp_dir, INDEX_FILE))
+        with open(os.path.join(tmp_dir, CHUNKS_FILE), 'w', encoding='utf-8') as chunks_file:
+            json.dump(chunks, chunks_file, ensure_ascii=False)
+        target = os.path.join(cache_dir, doc_key)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(tmp_dir, target)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def get_or_build_index(file_bytes, get_chunks, embeddings, params='', cache_dir=VECTOR_CACHE_DIR):
+    """Índice vectorial del documento, desde la caché si ya se procesó.
+
+    Args:
+        get_chunks: función sin argumentos que devuelve los fragmentos (lista
+            o generador); solo se llama si el documento no está en caché. Se
+            consume por lotes, así que los embeddings de un lote se piden
+            mientras se siguen extrayendo las páginas siguientes.
+        params: parámetros que cambian los fragmentos (tamaño, solape...).
+
+    Returns:
+        (store, stats) con stats = {'cached': bool, 'chunks': n, 'embedded': n}
+    """
+    doc_key = document_key(file_bytes, embeddings, params)
+    store = load_cached_index(doc_key, embeddings, cache_dir)
+    if store is not None:
+        return store, {'cached': True, 'chunks': store.index.ntotal, 'embedded': 0}
+
+    cache = EmbeddingCache(cache_dir)
+    chunks, vectors, embedded = [], [], 0
+    pending = (chunk for chunk in get_chunks() if chunk.strip())
+    while True:
+        batch = list(islice(pending, EMBED_BATCH))
+        if not batch:
+            break
+        batch_vectors, batch_embedded = embed_with_cache(batch, embeddings, cache)
+        chunks.extend(batch)
+        vectors.extend(batch_vectors)
+        embedded += batch_embedded
+    if not chunks:
+        raise ValueError("El documento no contiene texto extraíble")
+    store = FAISS.from_embeddings(list(zip(chunks, vectors)), embeddings)
+    save_index(doc_key, chunks, store, cache_dir)
+    return store, {'cached': False, 'chunks': len(chunks), 'embedded': embedded}
@@ -0,0 +1,31 @@
+import sqlite3
+
+from db.task_assignees import add_task_assignee_columns, backfill_task_assignees
+
+
+def make_conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE users (username TEXT, full_name TEXT, email TEXT)')
+    conn.execute('CREATE TABLE tasks (id TEXT PRIMARY KEY, notes TEXT, due_date TEXT)')
+    conn.execute("INSERT INTO users VALUES ('jperez', 'Juan Pérez', 'juan@muyu.com')")
+    add_task_assignee_columns(conn)
+    return conn
+
+
+def fetch_task(conn, task_id):
+    return conn.execute('SELECT notes, assignee_username, assignee_email FROM tasks WHERE id = ?',
+                        (task_id,)).fetchone()
+
+
+def test_backfill_resolves_known_user():
+    conn = make_conn()
+    conn.execute("INSERT INTO tasks (id, notes) VALUES ('1', 'Llamar\nResponsable: Juan Pérez\nRol: sales')")
+    assert backfill_task_assignees(conn) == 1
+    assert fetch_task(conn, '1') == ('Llamar', 'jperez', 'juan@muyu.com')
+
+
+def test_backfill_keeps_unresolved_free_text_name():
+    conn = make_conn()
+    conn.execute("INSERT INTO tasks (id, notes) VALUES ('1', 'Llamar al rector\nWhatsapp: 0999\nResponsable: Maria Lopez')")
+    backfill_task_assignees(conn)
+    assert fetch_task(conn, '1') == ('Llamar al rector\nWhatsapp: 0999', 'Maria Lopez', None)